@@ -0,0 +1,76 @@
+"""Script to benchmark the queries over the subtree of a place.
+
+Almost every listing and count in the app joins place_parents with one
+of the tables having a place_id. This prints the time and the query plan
+of those queries, so that the plans can be compared before and after a
+change to the schema:
+
+    python manage.py benchmark-queries KA > before.txt
+    python manage.py db upgrade
+    python manage.py benchmark-queries KA > after.txt
+"""
+import datetime
+import time
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql
+from .models import db, Place, Member, Contact, Door2DoorEntry, place_parents
+from .plugins.audit.models import Audit
+
+# model, column used for paging, whether the pages are latest first, created column
+TABLES = [
+    (Member, Member.id, False, Member.created),
+    (Contact, Contact.id, False, None),
+    (Door2DoorEntry, Door2DoorEntry.id, True, Door2DoorEntry.created),
+    (Audit, Audit.id, True, Audit.timestamp),
+]
+
+def get_queries(place, page_size=100, days=30):
+    """Returns (name, query) of the count, recent count and first page
+    queries of every table, built the same way as the Place methods.
+    """
+    since = datetime.datetime.now() - datetime.timedelta(days=days)
+    queries = []
+    for model, column, descending, created in TABLES:
+        name = model.__tablename__
+        q = model.query.filter(
+            place_parents.c.child_id==model.place_id,
+            place_parents.c.parent_id==place.id)
+
+        queries.append((name + " count", q.with_entities(func.count(column))))
+        if created is not None:
+            queries.append((name + " recent count", q.with_entities(func.count(column)).filter(created >= since)))
+        order = column.desc() if descending else column
+        queries.append((name + " page", q.order_by(order).limit(page_size + 1)))
+    return queries
+
+def execute(query, prefix=""):
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    return db.session.connection().execute(prefix + str(compiled), compiled.params).fetchall()
+
+def explain(query):
+    """Returns the plan of the query, with the actual times and buffers.
+    """
+    rows = execute(query, prefix="EXPLAIN (ANALYZE, BUFFERS) ")
+    return [row[0] for row in rows]
+
+def timeit(query, repeat):
+    """Runs the query repeat times and returns the best time in milliseconds.
+    """
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        execute(query)
+        times.append((time.time() - t0) * 1000)
+    return min(times)
+
+def main(key, repeat=5):
+    place = Place.find(key)
+    if not place:
+        raise ValueError("Invalid place: {}".format(key))
+
+    for name, query in get_queries(place):
+        print "== {} ({:.2f} ms)".format(name, timeit(query, repeat))
+        for line in explain(query):
+            print "  " + line
+        print
+    db.session.rollback()
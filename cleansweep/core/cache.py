@@ -1,24 +1,248 @@
 """Simple caching utilities.
+
+The cache uses the shared redis client from redisclient. The cache is
+optional, all the functions return None when redis is not configured.
+
+When redis is not reachable, the error is logged and the cache is
+skipped for REDIS_RETRY_INTERVAL seconds so that the requests are not
+slowed down by connection timeouts.
+
+The get/set functions work with strings. The cached decorator caches
+the return value of a function, serialized as JSON or msgpack:
+
+    @cache.cached(ttl=300, key=lambda place: place.key)
+    def get_member_count(place):
+        ...
+
+    get_member_count(place)               # from the cache when available
+    get_member_count.refresh(place)       # recompute and update the cache
+    get_member_count.invalidate(place)    # remove from the cache
+
+See cached for details.
 """
+import functools
+import json
+import logging
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from redis import RedisError
 from ..app import app
-from redis import Redis
+from . import redisclient
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+# time until which the cache is skipped after an error
+_retry_after = 0
 
 def get_redis_connection():
-    host = app.config.get('REDIS_HOST')
-    port = app.config.get('REDIS_PORT')
-    if host and port:
-        return Redis(host, port)
+    """Returns the shared redis client or None if redis is not configured
+    or not reachable.
+    """
+    if time.time() < _retry_after:
+        return None
+    return redisclient.get_client()
+
+def _call(f, *args, **kwargs):
+    global _retry_after
+    redis = get_redis_connection()
+    if redis is None:
+        return None
+    try:
+        return f(redis, *args, **kwargs)
+    except RedisError:
+        logger.error("redis error, skipping the cache", exc_info=True)
+        _retry_after = time.time() + app.config.get('REDIS_RETRY_INTERVAL', 30)
 
 def get(key):
     """Gets the given key from cache.
     """
-    redis = get_redis_connection()
-    return redis and redis.get(key)
+    return _call(lambda redis: redis.get(key))
+
+def get_many(keys):
+    """Gets the values of all the given keys in one round trip.
+
+    Returns a list of values in the same order as the keys, with None for
+    missing keys.
+    """
+    values = keys and _call(lambda redis: redis.mget(keys))
+    return values or [None] * len(keys)
 
 def set(key, value, expiry=None):
     """Sets the given key-value pair in the cache.
 
     Optionally expiry can be specified in seconds.
     """
-    redis = get_redis_connection()
-    return redis and redis.set(key, value, ex=expiry)
+    return _call(lambda redis: redis.set(key, value, ex=expiry))
+
+def set_many(mapping, expiry=None):
+    """Sets all the key-value pairs in one round trip.
+    """
+    def f(redis):
+        with redisclient.pipeline(redis) as p:
+            for key, value in mapping.items():
+                p.set(key, value, ex=expiry)
+        return True
+    return mapping and _call(f)
+
+def delete(key):
+    """Deletes the given key from the cache.
+    """
+    return _call(lambda redis: redis.delete(key))
+
+def incr(key):
+    """Increments the integer value of the key by one.
+    """
+    return _call(lambda redis: redis.incr(key))
+
+SERIALIZERS = {
+    "json": (json.dumps, json.loads)
+}
+if msgpack is not None:
+    SERIALIZERS["msgpack"] = (
+        functools.partial(msgpack.packb, use_bin_type=True),
+        functools.partial(msgpack.unpackb, raw=False))
+
+# Controls how early the cached values are recomputed before they expire.
+# Larger values refresh earlier. See _should_refresh.
+EARLY_REFRESH_BETA = 1.0
+
+class LRUCache(object):
+    """Thread-safe in-process cache that keeps at most size entries.
+
+    Every entry has an expiry time and the least recently used entries
+    are discarded when the cache is full.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        """Returns (value,) when the key is found and not expired, None
+        otherwise. The value is wrapped in a tuple so that None can be a
+        cached value.
+        """
+        now = now or time.time()
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[1] <= now:
+                return None
+            self._data[key] = entry
+            return (entry[0],)
+
+    def set(self, key, value, expires):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+def _should_refresh(expires, delta, now):
+    """Decides if a cached value should be recomputed before it expires.
+
+    When a popular key expires, all the workers would recompute it at the
+    same time. To avoid that, each reader recomputes the value early with
+    a probability that increases as the expiry time comes closer and with
+    the time it took to compute the value (delta). Usually one reader
+    refreshes the value well before the expiry and others keep using the
+    cached value.
+    """
+    # 1 - random() is in (0, 1], log of it is <= 0
+    return now - delta * EARLY_REFRESH_BETA * math.log(1.0 - random.random()) >= expires
+
+def _default_key(*args, **kwargs):
+    return json.dumps([args, kwargs], sort_keys=True, default=repr)
+
+def cached(ttl, key=None, namespace=None, serializer="json", local_ttl=10, local_size=1000):
+    """Decorator to cache the return value of a function.
+
+    The value is cached in redis for ttl seconds and in a LRU cache in
+    the process for local_ttl seconds. Falsy values including None and 0
+    are cached like any other value.
+
+    The cache key is computed from the arguments using the key function
+    or, when key is a string, using key.format(*args, **kwargs). When key
+    is not specified, the arguments are encoded as JSON, which works only
+    for simple arguments. The keys are prefixed with the namespace, which
+    defaults to the module and name of the function.
+
+    The value must be serializable using the specified serializer,
+    "json" or "msgpack" (available only when msgpack is installed).
+
+    The cached value is recomputed a little before it expires by one of
+    the readers so that an expensive value is not recomputed by all the
+    workers at once. Invalidation clears the local cache of the current
+    process only, other processes notice it within local_ttl seconds.
+    """
+    dumps, loads = SERIALIZERS[serializer]
+
+    def decorator(f):
+        prefix = "cache/{}/".format(namespace or f.__module__ + "." + f.__name__)
+        local = LRUCache(local_size)
+
+        def make_key(args, kwargs):
+            if key is None:
+                k = _default_key(*args, **kwargs)
+            elif isinstance(key, basestring):
+                k = key.format(*args, **kwargs)
+            else:
+                k = key(*args, **kwargs)
+            return prefix + k
+
+        def compute(k, args, kwargs):
+            start = time.time()
+            value = f(*args, **kwargs)
+            now = time.time()
+            set(k, dumps([value, now + ttl, now - start]), expiry=ttl)
+            local.set(k, value, now + min(ttl, local_ttl))
+            return value
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            k = make_key(args, kwargs)
+            now = time.time()
+            hit = local.get(k, now)
+            if hit is not None:
+                return hit[0]
+
+            data = get(k)
+            if data is not None:
+                value, expires, delta = loads(data)
+                if not _should_refresh(expires, delta, now):
+                    local.set(k, value, min(expires, now + local_ttl))
+                    return value
+            return compute(k, args, kwargs)
+
+        def refresh(*args, **kwargs):
+            """Recomputes the value and updates the cache.
+            """
+            return compute(make_key(args, kwargs), args, kwargs)
+
+        def invalidate(*args, **kwargs):
+            """Removes the value from the cache.
+            """
+            k = make_key(args, kwargs)
+            local.delete(k)
+            delete(k)
+
+        wrapper.refresh = refresh
+        wrapper.invalidate = invalidate
+        wrapper.local_cache = local
+        return wrapper
+    return decorator
@@ -1,4 +1,5 @@
 from ..models import Document, db
+from .docregistry import DocumentRegistry
 
 class Division(object):
 	"""Division of the organization.
@@ -36,9 +37,11 @@ class Division(object):
 
 	def save(self):
 		self.doc.save()
+		_registry.invalidate()
 
 	def delete(self):
 		self.doc.delete()
+		_registry.invalidate()
 
 	@staticmethod
 	def new():
@@ -50,14 +53,24 @@ class Division(object):
 
 	@staticmethod
 	def find(key):
-		"""Returns the PermissionGroup with specified key.
+		"""Returns the Division with specified key.
+
+		The returned object is read-only, use load to modify it.
+		"""
+		doc = _registry.get(key)
+		return doc and Division(doc)
+
+	@staticmethod
+	def load(key):
+		"""Loads the Division with specified key from the database.
 		"""
 		doc = Document.find(key, type="division")
 		return doc and Division(doc)
 
 	@staticmethod
 	def all():
-		"""Returns all PermissionGroup objects.
+		"""Returns all Division objects.
 		"""
-		docs = Document.search(type="division")
-		return [Division(doc) for doc in docs]
+		return [Division(doc) for doc in _registry.all()]
+
+_registry = DocumentRegistry(Division.type)
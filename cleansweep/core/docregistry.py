@@ -0,0 +1,79 @@
+"""In-process registry of small collections of documents.
+
+Permission groups and divisions are stored in the document store, but
+they are read on almost every request and modified only from the admin
+pages. This module keeps all the documents of such a type in memory and
+reloads them only when they are modified.
+
+Every registry has a version number stored in the cache. Modifying a
+document increments the version and the other worker processes notice
+the change within CHECK_INTERVAL seconds.
+
+    registry = DocumentRegistry("division")
+    registry.get("north")
+    registry.all()
+    registry.invalidate()   # after saving or deleting a document
+
+The documents returned are copies, not attached to the database session.
+They can be modified and saved only after loading them again from the
+database.
+"""
+import copy
+import time
+from collections import OrderedDict
+from . import cache
+from ..models import Document
+
+# Number of seconds to wait before checking the shared version again
+CHECK_INTERVAL = 10
+
+class DocumentRegistry(object):
+    def __init__(self, type):
+        self.type = type
+        self.version_key = "docregistry.version." + type
+        self._data = None
+        self._version = None
+        self._last_check = 0
+
+    def _load(self):
+        docs = Document.query.filter_by(type=self.type).order_by(Document.id).all()
+        # data of the documents by key, in the order of creation
+        return OrderedDict((doc.key, copy.deepcopy(doc.data)) for doc in docs)
+
+    def _get_data(self):
+        now = time.time()
+        if self._data is not None and now - self._last_check < CHECK_INTERVAL:
+            return self._data
+        self._last_check = now
+
+        # The version is read before loading the documents so that a change
+        # that happens while loading is noticed in the next check.
+        version = cache.get(self.version_key)
+        if self._data is None or self._version != version:
+            self._data = self._load()
+            self._version = version
+        return self._data
+
+    def _make_document(self, key, data):
+        return Document(key, self.type, copy.deepcopy(data))
+
+    def get(self, key):
+        """Returns the document with given key or None.
+        """
+        data = self._get_data().get(key)
+        if data is not None:
+            return self._make_document(key, data)
+
+    def all(self):
+        """Returns all the documents.
+        """
+        return [self._make_document(k, data) for k, data in self._get_data().items()]
+
+    def invalidate(self):
+        """Invalidates the registry in this process and all other processes.
+
+        This must be called whenever a document of this type is saved or
+        deleted.
+        """
+        self._data = None
+        cache.incr(self.version_key)
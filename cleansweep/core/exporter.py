@@ -0,0 +1,171 @@
+"""Streaming exports of tabular data as CSV and XLSX.
+
+The exports of volunteers, contacts and committee members can have
+millions of rows. Instead of building the whole table in memory, the
+functions in this module consume the rows one at a time and write them
+out incrementally.
+
+CSV is written as a stream of chunks, which can be sent in the response
+as they are generated. XLSX is a zip archive and can't be streamed, so
+the worksheet is written row by row to a temporary file, which is then
+compressed into the output file.
+
+    headers = ["Name", "Phone"]
+    rows = ((m.name, m.phone) for m in place.get_all_members_iter())
+    for chunk in exporter.iter_csv(headers, rows):
+        ...
+"""
+import csv
+import datetime
+import itertools
+import re
+import tempfile
+import zipfile
+from cStringIO import StringIO
+from xml.sax.saxutils import escape
+
+FORMATS = ["xlsx", "csv"]
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+# Size of the chunks yielded by iter_csv
+CHUNK_SIZE = 64 * 1024
+
+def batches(iterable, size):
+    """Splits the iterable into lists of at most size elements.
+
+    Useful to process rows coming from a cursor in batches, for example
+    to bulkload the related data of each batch.
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            break
+        yield batch
+
+def _to_text(value):
+    if value is None:
+        return u""
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    elif isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    else:
+        return unicode(value)
+
+def iter_csv(headers, rows):
+    """Yields the CSV representation of the rows in chunks.
+
+    The output is UTF-8 encoded and starts with a BOM, so that Excel
+    displays the non-ASCII text correctly.
+    """
+    buf = StringIO()
+    buf.write('\xef\xbb\xbf')
+    writer = csv.writer(buf)
+    for row in itertools.chain([headers], rows):
+        writer.writerow([_to_text(v).encode('utf-8') for v in row])
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def write_csv(fileobj, headers, rows):
+    for chunk in iter_csv(headers, rows):
+        fileobj.write(chunk)
+
+# characters not allowed in XML 1.0
+_re_xml_illegal = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def _column_name(index):
+    """Returns the spreadsheet name of the column at index. 0 -> A, 26 -> AA.
+    """
+    name = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(ord('A') + rem) + name
+    return name
+
+def _xlsx_cell(ref, value):
+    if value is None:
+        return ''
+    elif isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return '<c r="%s"><v>%s</v></c>' % (ref, repr(value).rstrip("L"))
+    text = _re_xml_illegal.sub(u"", _to_text(value))
+    return '<c r="%s" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % (ref, escape(text).encode('utf-8'))
+
+def _xlsx_row(rownum, columns, row):
+    cells = "".join(_xlsx_cell(col + str(rownum), value) for col, value in zip(columns, row))
+    return '<row r="%d">%s</row>' % (rownum, cells)
+
+XLSX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+
+XLSX_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+XLSX_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>"""
+
+XLSX_SHEET_HEADER = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>"""
+
+XLSX_SHEET_FOOTER = """</sheetData></worksheet>"""
+
+def _sheet_title(title):
+    # Excel doesn't allow these characters and more than 31 chars in sheet names
+    title = re.sub(r'[\[\]:*?/\\]', ' ', _to_text(title or "Sheet1"))[:31]
+    return escape(title, {'"': "&quot;"}).encode('utf-8')
+
+def write_xlsx(fileobj, headers, rows, title=None):
+    """Writes the rows as an XLSX workbook with a single sheet.
+
+    The fileobj must be seekable as required by zipfile. All strings are
+    written inline, so the memory used doesn't depend on the number of
+    rows.
+    """
+    columns = [_column_name(i) for i in range(len(headers))]
+
+    with tempfile.NamedTemporaryFile(suffix=".xml") as sheet:
+        sheet.write(XLSX_SHEET_HEADER)
+        for i, row in enumerate(itertools.chain([headers], rows)):
+            sheet.write(_xlsx_row(i + 1, columns, row))
+        sheet.write(XLSX_SHEET_FOOTER)
+        sheet.flush()
+
+        with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+            z.writestr("_rels/.rels", XLSX_ROOT_RELS)
+            z.writestr("xl/workbook.xml", XLSX_WORKBOOK % _sheet_title(title))
+            z.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+            z.write(sheet.name, "xl/worksheets/sheet1.xml")
+
+def write(fileobj, format, headers, rows, title=None):
+    """Writes the rows to fileobj in the specified format.
+    """
+    if format == "csv":
+        write_csv(fileobj, headers, rows)
+    elif format == "xlsx":
+        write_xlsx(fileobj, headers, rows, title=title)
+    else:
+        raise ValueError("Unsupported export format: %r" % format)
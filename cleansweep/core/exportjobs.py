@@ -0,0 +1,198 @@
+"""Background jobs for exporting large tables as files.
+
+Exporting all the volunteers or contacts of a state takes longer than
+the request timeout. Such exports are run as jobs on the RQ queue. The
+job writes the file to a local directory (EXPORTS_DIR) and keeps track
+of its progress in the cache, so that the user can watch the progress
+and download the file once it is ready. The web app and the workers
+must share EXPORTS_DIR.
+
+An export is identified by its name, params and format. When the same
+export is requested again within EXPORTS_TTL seconds, the existing file
+is reused instead of running the export again.
+
+The exports are registered using the register decorator. The function
+is called with the params and it must return the headers and an
+iterator over the rows.
+
+    @exportjobs.register("volunteers")
+    def export_volunteers(place_key):
+        ...
+        return headers, rows
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import time
+from ..app import app
+from . import cache, exporter
+from .mailer import get_queue
+
+logger = logging.getLogger(__name__)
+
+# Maximum time in seconds an export job is allowed to run
+JOB_TIMEOUT = 3 * 60 * 60
+
+# The progress is updated in the cache after these many rows
+PROGRESS_INTERVAL = 1000
+
+_exporters = {}
+
+def register(name):
+    """Decorator to register an export function with the given name.
+    """
+    def decorator(f):
+        _exporters[name] = f
+        return f
+    return decorator
+
+def is_enabled():
+    """Exports can run in background only when redis is configured.
+    """
+    return cache.get_redis_connection() is not None
+
+def get_rows(name, params):
+    """Returns the headers and rows of the registered export.
+    """
+    return _exporters[name](**params)
+
+def get_exports_dir():
+    return app.config.get("EXPORTS_DIR", "/tmp/cleansweep-exports")
+
+def get_ttl():
+    return app.config.get("EXPORTS_TTL", 3600)
+
+def _get_export_id(name, params, format):
+    key = json.dumps([name, params, format], sort_keys=True)
+    return hashlib.sha1(key).hexdigest()
+
+def _get_status_key(export_id):
+    return "exports/" + export_id
+
+def get_status(export_id):
+    """Returns the status of the export as a dict or None if there is no
+    such export or if it has expired.
+    """
+    value = cache.get(_get_status_key(export_id))
+    return value and json.loads(value)
+
+def _save_status(status):
+    status['updated'] = time.time()
+    cache.set(_get_status_key(status['id']), json.dumps(status), expiry=get_ttl())
+
+def get_path(status):
+    """Returns path of the exported file.
+    """
+    return os.path.join(get_exports_dir(), status['id'] + "." + status['format'])
+
+def _is_reusable(status):
+    if status is None or status['state'] == 'failed':
+        return False
+    elif status['state'] == 'finished':
+        return os.path.exists(get_path(status))
+    else:
+        # the worker running the job may have died without marking it as
+        # failed. RQ stops a job after JOB_TIMEOUT, so an export queued or
+        # started before that is not waited for.
+        started = status.get('started') or status['created']
+        return time.time() - started < JOB_TIMEOUT
+
+def start(name, params, format, filename, title=None, place=None, permission=None):
+    """Starts an export job and returns its status.
+
+    If the same export is already running or finished within the TTL,
+    the status of that export is returned.
+
+    The place and permission are stored along with the status so that
+    the progress and the file can be shown only to the users having
+    that permission at that place.
+    """
+    export_id = _get_export_id(name, params, format)
+    status = get_status(export_id)
+    if _is_reusable(status):
+        return status
+
+    status = dict(
+        id=export_id,
+        name=name,
+        params=params,
+        format=format,
+        filename=filename,
+        title=title,
+        place=place,
+        permission=permission,
+        state="queued",
+        rows=0,
+        created=time.time())
+    _save_status(status)
+    get_queue().enqueue(run, export_id, timeout=JOB_TIMEOUT)
+    return status
+
+def _track_progress(status, rows):
+    for i, row in enumerate(rows):
+        if i and i % PROGRESS_INTERVAL == 0:
+            status['rows'] = i
+            _save_status(status)
+        yield row
+        status['rows'] = i + 1
+
+def run(export_id):
+    """Runs the export. This is called from the worker.
+    """
+    # imported here to avoid circular import as models depends on core
+    from ..models import db
+
+    status = get_status(export_id)
+    if not status:
+        logger.warn("export %s has expired, ignoring...", export_id)
+        return
+
+    status['state'] = 'running'
+    status['started'] = time.time()
+    _save_status(status)
+
+    path = get_path(status)
+    tmp_path = path + ".tmp"
+    try:
+        if not os.path.exists(get_exports_dir()):
+            os.makedirs(get_exports_dir())
+
+        headers, rows = get_rows(status['name'], status['params'])
+        with open(tmp_path, "wb") as f:
+            exporter.write(f, status['format'], headers, _track_progress(status, rows), title=status['title'])
+        os.rename(tmp_path, path)
+    except Exception:
+        logger.error("export %s failed", export_id, exc_info=True)
+        status['state'] = 'failed'
+        _save_status(status)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        db.session.remove()
+
+    status['state'] = 'finished'
+    _save_status(status)
+    cleanup()
+
+def cleanup():
+    """Deletes the exported files that are older than the TTL.
+
+    The temporary files of exports that may still be running are kept
+    until the job timeout. Another worker may be cleaning up at the same
+    time, so files that are already gone are ignored.
+    """
+    root = get_exports_dir()
+    now = time.time()
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        ttl = JOB_TIMEOUT if name.endswith(".tmp") else get_ttl()
+        try:
+            if os.path.getmtime(path) < now - ttl:
+                logger.info("deleting expired export %s", path)
+                os.remove(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
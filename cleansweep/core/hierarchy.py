@@ -0,0 +1,113 @@
+"""Checks and repairs the place_parents table.
+
+The place_parents table has a row for every place and each of its
+parents, including the place itself. It is derived from the iparent_id
+column of the place table, but it can go out of sync when places are
+moved or loaded partially.
+
+The checker computes the expected rows with a recursive query over
+iparent_id and compares them with the table, all in the database. The
+differences are kept in temporary tables and repaired in batches, each
+batch in its own transaction, so that it works with millions of rows
+without loading any objects in memory.
+
+    checker = HierarchyChecker()
+    counts = checker.check()
+    if checker.has_errors(counts):
+        checker.repair()
+    checker.close()
+"""
+import logging
+from ..models import db, place_closure_ctes
+
+logger = logging.getLogger(__name__)
+
+# All the (parent_id, child_id) rows expected in place_parents
+CLOSURE_QUERY = place_closure_ctes() + " SELECT parent_id, child_id FROM closure"
+
+class HierarchyChecker(object):
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+        # temporary tables live as long as the connection
+        self.conn = db.engine.connect()
+
+    def close(self):
+        self.conn.close()
+
+    def _count(self, query):
+        return self.conn.execute(query).scalar()
+
+    def check(self):
+        """Finds the differences between place_parents and the hierarchy.
+
+        Returns a dict with the number of missing rows, missing self rows
+        (a place as its own parent, included in missing), extra rows,
+        duplicated valid rows and rows with null values.
+        """
+        with self.conn.begin():
+            self.conn.execute("DROP TABLE IF EXISTS hierarchy_closure, hierarchy_missing, hierarchy_extra, hierarchy_duplicate")
+            self.conn.execute("CREATE TEMPORARY TABLE hierarchy_closure AS " + CLOSURE_QUERY)
+            self.conn.execute(
+                "CREATE TEMPORARY TABLE hierarchy_missing AS"
+                + " SELECT row_number() OVER () AS n, parent_id, child_id FROM ("
+                + "     SELECT parent_id, child_id FROM hierarchy_closure"
+                + "     EXCEPT SELECT parent_id, child_id FROM place_parents) t")
+            self.conn.execute(
+                "CREATE TEMPORARY TABLE hierarchy_extra AS"
+                + " SELECT row_number() OVER () AS n, parent_id, child_id FROM ("
+                + "     SELECT parent_id, child_id FROM place_parents"
+                + "     WHERE parent_id IS NOT NULL AND child_id IS NOT NULL"
+                + "     EXCEPT SELECT parent_id, child_id FROM hierarchy_closure) t")
+            # the extra rows are deleted with all their copies, only the
+            # duplicates of the valid rows are added back by repair
+            self.conn.execute(
+                "CREATE TEMPORARY TABLE hierarchy_duplicate AS"
+                + " SELECT row_number() OVER () AS n, parent_id, child_id FROM ("
+                + "     SELECT parent_id, child_id FROM place_parents"
+                + "     WHERE parent_id IS NOT NULL AND child_id IS NOT NULL"
+                + "     GROUP BY parent_id, child_id HAVING count(*) > 1"
+                + "     INTERSECT SELECT parent_id, child_id FROM hierarchy_closure) t")
+            self.conn.execute("DROP TABLE hierarchy_closure")
+
+            # repair reads the tables in batches by n
+            for table in ["hierarchy_missing", "hierarchy_extra", "hierarchy_duplicate"]:
+                self.conn.execute("CREATE INDEX ON {0} (n)".format(table))
+                self.conn.execute("ANALYZE {0}".format(table))
+
+        return dict(
+            missing=self._count("SELECT count(*) FROM hierarchy_missing"),
+            self=self._count("SELECT count(*) FROM hierarchy_missing WHERE parent_id=child_id"),
+            extra=self._count("SELECT count(*) FROM hierarchy_extra"),
+            duplicate=self._count("SELECT count(*) FROM hierarchy_duplicate"),
+            null=self._count("SELECT count(*) FROM place_parents WHERE parent_id IS NULL OR child_id IS NULL"))
+
+    def has_errors(self, counts):
+        return any(counts.values())
+
+    def _run_in_batches(self, table, queries):
+        total = self._count("SELECT count(*) FROM " + table)
+        for start in range(0, total, self.batch_size):
+            params = dict(start=start, end=start + self.batch_size)
+            with self.conn.begin():
+                for q in queries:
+                    self.conn.execute(q, params)
+            logger.info("%s: repaired %d of %d", table, min(start + self.batch_size, total), total)
+
+    def repair(self):
+        """Repairs the differences found by the last check.
+        """
+        batch = " t.n > %(start)s AND t.n <= %(end)s"
+        self._run_in_batches("hierarchy_missing", [
+            "INSERT INTO place_parents (parent_id, child_id)"
+            + " SELECT parent_id, child_id FROM hierarchy_missing t WHERE" + batch])
+        self._run_in_batches("hierarchy_extra", [
+            "DELETE FROM place_parents pp USING hierarchy_extra t"
+            + " WHERE pp.parent_id=t.parent_id AND pp.child_id=t.child_id AND" + batch])
+        # delete all the copies of a duplicate row and add it back once
+        self._run_in_batches("hierarchy_duplicate", [
+            "DELETE FROM place_parents pp USING hierarchy_duplicate t"
+            + " WHERE pp.parent_id=t.parent_id AND pp.child_id=t.child_id AND" + batch,
+            "INSERT INTO place_parents (parent_id, child_id)"
+            + " SELECT parent_id, child_id FROM hierarchy_duplicate t WHERE" + batch])
+        with self.conn.begin():
+            self.conn.execute("DELETE FROM place_parents WHERE parent_id IS NULL OR child_id IS NULL")
@@ -1,10 +1,10 @@
 from ..app import app
 from envelopes import Envelope
 from rq import Queue
-from redis import Redis
 import pynliner
 import logging
 from ..models import Unsubscribe
+from . import redisclient
 
 logger = logging.getLogger(__name__)
 
@@ -85,20 +85,26 @@ def get_queue():
         _q = Queue(connection=get_connection())
     return _q
 
-def get_connection():
-    host = app.config.get('REDIS_HOST')
-    port = app.config.get('REDIS_PORT')
-    if host and port:
-        return Redis(host, port)
-    else:
-        return Redis()
+def get_connection(socket_timeout=redisclient.DEFAULT_TIMEOUT):
+    """Returns the shared redis client used for the queue.
+
+    The queue uses the redis running on localhost when redis is not
+    configured.
+    """
+    return (redisclient.get_client(socket_timeout=socket_timeout)
+        or redisclient.get_client("localhost", 6379, socket_timeout=socket_timeout))
 
 def run_worker():
     from rq import Worker, Connection
-    with Connection(get_connection()):
-        q = get_queue()
-        qs = [q]
-        w = Worker(qs)
+    # The worker blocks on redis for minutes waiting for jobs, longer
+    # than the socket timeout of the shared client. Use a connection
+    # without a timeout.
+    connection = get_connection(socket_timeout=None)
+    if not redisclient.check_health(connection):
+        raise Exception("Unable to connect to redis")
+    with Connection(connection):
+        q = Queue(connection=connection)
+        w = Worker([q])
         w.work()
 
 def sendmail_async(*a, **kw):
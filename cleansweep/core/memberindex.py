@@ -0,0 +1,250 @@
+"""Prefix index of members in redis for the volunteer autocomplete.
+
+The autocomplete sends a request on every keystroke. Instead of searching
+the member table each time, the members are indexed in redis:
+
+* a sorted set with an entry for every term of every member. The terms
+  are the words of the name, the email and the digits of the phone number.
+  All the entries have the same score, so the set is sorted by the entry
+  and the entries starting with a prefix are found using ZRANGEBYLEX.
+* a hash with the name, email, phone and place of every member, used to
+  show the matches and to check them against the whole query.
+
+Each entry is "term\\0place_id\\0member_id". The place is used to restrict
+the matches to the subtree of a place using the placeindex, without
+querying the database.
+
+    memberindex.rebuild()                     # from manage.py
+    memberindex.update(member)                # when a member is added or changed
+    memberindex.search(place.id, "rav")       # list of dicts or None
+
+The index is kept up to date by the models, which call save_many with
+all the members added, changed or deleted by a commit, irrespective of
+where the change is made. The search returns None when
+redis is not available, when the index is not built yet or when the prefix
+is too common to find the matches quickly; the caller is expected to
+search the database in that case.
+"""
+import json
+import logging
+import re
+from redis import RedisError
+from . import cache, placeindex, redisclient
+
+logger = logging.getLogger(__name__)
+
+TERMS_KEY = "memberindex:terms"
+DOCS_KEY = "memberindex:docs"
+READY_KEY = "memberindex:ready"
+
+# Number of entries read from the sorted set in one round trip
+SCAN_BATCH_SIZE = 500
+
+# Maximum number of entries read for a search before giving up
+MAX_SCAN = 5000
+
+def _call(f):
+    redis = cache.get_redis_connection()
+    if redis is None:
+        return None
+    try:
+        return f(redis)
+    except RedisError:
+        logger.error("redis error in member index", exc_info=True)
+
+# a query made of only these characters is treated as a phone number
+PHONE_QUERY_RE = re.compile(r"^\+?[0-9 ()-]+$")
+
+# the phone numbers are indexed and searched without this country code
+COUNTRY_CODE = "91"
+
+def normalize(text):
+    return (text or u"").strip().lower()
+
+def normalize_phone(phone):
+    """Returns the digits of the phone number without the leading zeros
+    and the country code.
+
+    The country code is removed when it is written with + or 00, or when
+    there are more than 10 digits, so that +91 98450 12345, 098450 12345
+    and 9845012345 are all the same. A number or a prefix starting with
+    91 without those is left as it is.
+    """
+    phone = (phone or "").strip()
+    digits = re.sub(r"[^0-9]", "", phone)
+    international = phone.startswith("+") or digits.startswith("00")
+    digits = digits.lstrip("0")
+    if digits.startswith(COUNTRY_CODE) and (international or len(digits) > 10):
+        digits = digits[len(COUNTRY_CODE):]
+    return digits
+
+def get_phone_prefix(query):
+    """Returns the normalized digits of the query if it looks like a phone
+    number.
+    """
+    query = normalize(query)
+    if PHONE_QUERY_RE.match(query):
+        return normalize_phone(query)
+
+def get_terms(doc):
+    """Returns the terms used to index a member.
+
+    The doc is a dict with name, email and phone.
+    """
+    terms = set(normalize(doc.get('name')).split())
+    email = normalize(doc.get('email'))
+    if email:
+        terms.add(email)
+    phone = normalize_phone(doc.get('phone'))
+    if phone:
+        terms.add(phone)
+    return terms
+
+def _encode(text):
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+    return text
+
+def get_entries(member_id, doc):
+    return [_encode(u"{}\0{}\0{}".format(term, doc['place_id'], member_id)) for term in get_terms(doc)]
+
+def parse_entry(entry):
+    """Returns (term, place_id, member_id) of an entry in the sorted set.
+    """
+    term, place_id, member_id = entry.rsplit("\0", 2)
+    return term.decode("utf-8"), int(place_id), int(member_id)
+
+def get_doc(member):
+    return dict(name=member.name, email=member.email, phone=member.phone, place_id=member.place_id)
+
+def matches(doc, query):
+    """Returns True if every word of the query is a prefix of a term of
+    the member.
+    """
+    terms = get_terms(doc)
+    digits = get_phone_prefix(query)
+    if digits:
+        return any(t.startswith(digits) for t in terms)
+    return all(any(t.startswith(word) for t in terms) for word in normalize(query).split())
+
+def _add(pipe, member_id, doc):
+    entries = get_entries(member_id, doc)
+    if entries:
+        args = []
+        for e in entries:
+            args += [e, 0]
+        pipe.zadd(TERMS_KEY, *args)
+    pipe.hset(DOCS_KEY, member_id, json.dumps(doc))
+
+def _remove(pipe, member_id, doc):
+    entries = get_entries(member_id, doc)
+    if entries:
+        pipe.zrem(TERMS_KEY, *entries)
+    pipe.hdel(DOCS_KEY, member_id)
+
+def save_many(docs):
+    """Adds, replaces or removes many members in the index at once.
+
+    The docs is a dict from member id to a dict with name, email, phone
+    and place_id as returned by get_doc, or None to remove the member.
+    The old docs are read with a single command and all the changes are
+    written in a single transaction.
+    """
+    if not docs:
+        return
+    ids = list(docs)
+
+    def f(redis):
+        old_docs = redis.hmget(DOCS_KEY, ids)
+        with redisclient.pipeline(redis, transaction=True) as pipe:
+            for member_id, data in zip(ids, old_docs):
+                if data:
+                    _remove(pipe, member_id, json.loads(data))
+                if docs[member_id] is not None:
+                    _add(pipe, member_id, docs[member_id])
+    _call(f)
+
+def save(member_id, doc):
+    """Adds or replaces a member in the index. The doc is a dict with
+    name, email, phone and place_id as returned by get_doc.
+    """
+    save_many({member_id: doc})
+
+def update(member):
+    """Updates the index after the name, email, phone or place of the
+    member is changed.
+    """
+    save(member.id, get_doc(member))
+
+def remove(member_id):
+    """Removes a member from the index.
+    """
+    save_many({member_id: None})
+
+def search(place_id, query, limit=10):
+    """Returns up to limit members at or below the place matching the
+    query, as dicts with id, name, email and phone.
+
+    The members are looked up by the first word of the query and checked
+    against the other words. Members with a term equal to the first word
+    come first as the entries are sorted by term.
+
+    Returns None if the index can't answer the query.
+    """
+    words = normalize(query).split()
+    if not words:
+        return []
+    prefix = _encode(get_phone_prefix(query) or words[0])
+
+    def f(redis):
+        if not redis.get(READY_KEY):
+            return None
+
+        index = placeindex.get_index()
+        results = []
+        seen = set()
+        for start in range(0, MAX_SCAN, SCAN_BATCH_SIZE):
+            entries = redis.zrangebylex(TERMS_KEY, "[" + prefix, "[" + prefix + "\xff", start, SCAN_BATCH_SIZE)
+            candidates = []
+            for e in entries:
+                term, member_place_id, member_id = parse_entry(e)
+                if member_id not in seen and index.is_within(member_place_id, place_id):
+                    seen.add(member_id)
+                    candidates.append(member_id)
+
+            docs = candidates and redis.hmget(DOCS_KEY, candidates)
+            for member_id, data in zip(candidates, docs or []):
+                doc = data and json.loads(data)
+                if doc and matches(doc, query):
+                    results.append(dict(id=member_id, name=doc['name'], email=doc['email'], phone=doc['phone']))
+                    if len(results) == limit:
+                        return results
+
+            if len(entries) < SCAN_BATCH_SIZE:
+                return results
+        # too many entries with this prefix outside the place
+        return None
+    return _call(f)
+
+def rebuild(batch_size=1000):
+    """Rebuilds the whole index from the member table.
+    """
+    from ..models import db
+    redis = cache.get_redis_connection()
+    if redis is None:
+        raise Exception("redis is not configured")
+
+    redis.delete(READY_KEY, TERMS_KEY, DOCS_KEY)
+    result = db.engine.execution_options(stream_results=True).execute(
+        "SELECT id, name, email, phone, place_id FROM member")
+    count = 0
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        with redisclient.pipeline(redis) as pipe:
+            for id, name, email, phone, place_id in rows:
+                _add(pipe, id, dict(name=name, email=email, phone=phone, place_id=place_id))
+        count += len(rows)
+        logger.info("indexed %d members", count)
+    redis.set(READY_KEY, "1")
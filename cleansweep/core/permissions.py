@@ -13,8 +13,17 @@ define_permission function.
 Permisison Groups are created from the admin center of the website and they
 are used to specify permissions for various roles.
 """
+import hashlib
+import json
+import uuid
 from collections import namedtuple
-from ..models import Document, db
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+from ..app import app
+from ..models import Document, Member, db
+from . import cache, rbac
+from .docregistry import DocumentRegistry
 
 Permission = namedtuple("Permission", "name, description")
 
@@ -70,9 +79,13 @@ class PermissionGroup(object):
 
 	def save(self):
 		self.doc.save()
+		_registry.invalidate()
+		invalidate_user_permissions()
 
 	def delete(self):
 		self.doc.delete()
+		_registry.invalidate()
+		invalidate_user_permissions()
 
 	@staticmethod
 	def new():
@@ -85,13 +98,137 @@ class PermissionGroup(object):
 	@staticmethod
 	def find(key):
 		"""Returns the PermissionGroup with specified key.
+
+		The returned object is read-only, use load to modify it.
+		"""
+		doc = _registry.get(key)
+		return doc and PermissionGroup(doc)
+
+	@staticmethod
+	def load(key):
+		"""Loads the PermissionGroup with specified key from the database.
 		"""
 		doc = Document.find(key, type="permission-group")
 		return doc and PermissionGroup(doc)
 
+	@staticmethod
+	def find_many(keys):
+		"""Returns a dict from key to PermissionGroup for all the given keys.
+		Keys without a PermissionGroup are ignored.
+		"""
+		groups = (PermissionGroup.find(key) for key in set(keys))
+		return dict((g.key, g) for g in groups if g)
+
 	@staticmethod
 	def all():
 		"""Returns all PermissionGroup objects.
 		"""
-		docs = Document.search(type="permission-group")
-		return [PermissionGroup(doc) for doc in docs]
+		return [PermissionGroup(doc) for doc in _registry.all()]
+
+_registry = DocumentRegistry(PermissionGroup.type)
+
+
+class UserPermissionsCache(object):
+	"""Cache of the permissions of users, used by rbac.get_permission_index.
+
+	The compiled permissions are remembered in flask.g for the rest of the request
+	and, when PERMISSIONS_CACHE_TTL is set, in redis for that many seconds.
+
+	The redis keys include a version number, so that the permissions of all
+	the users can be invalidated together by changing the version, and a
+	hash of ADMIN_USERS, so that changing that setting takes effect without
+	waiting for the entries to expire.
+	"""
+	VERSION_KEY = "permissions.version"
+
+	def _get_local(self):
+		if not has_app_context():
+			return {}
+		if getattr(g, "user_permissions", None) is None:
+			g.user_permissions = {}
+		return g.user_permissions
+
+	def _get_ttl(self):
+		return app.config.get("PERMISSIONS_CACHE_TTL")
+
+	def _get_key(self, user_id):
+		version = cache.get(self.VERSION_KEY) or "0"
+		admins = hashlib.md5(json.dumps(sorted(app.config['ADMIN_USERS']))).hexdigest()[:8]
+		return "permissions/{0}/{1}/{2}".format(version, admins, user_id)
+
+	def get(self, user):
+		user_id = getattr(user, "id", None)
+		if user_id is None:
+			return None
+
+		local = self._get_local()
+		if user_id not in local and self._get_ttl():
+			value = cache.get(self._get_key(user_id))
+			if value:
+				local[user_id] = rbac.PermissionIndex(json.loads(value))
+		return local.get(user_id)
+
+	def set(self, user, permission_index):
+		user_id = getattr(user, "id", None)
+		if user_id is None:
+			return
+
+		self._get_local()[user_id] = permission_index
+		ttl = self._get_ttl()
+		if ttl:
+			value = json.dumps(permission_index.permissions)
+			cache.set(self._get_key(user_id), value, expiry=ttl)
+
+	def invalidate(self, user=None):
+		if user is None:
+			self._get_local().clear()
+			cache.set(self.VERSION_KEY, uuid.uuid4().hex)
+		elif user.id is not None:
+			self.invalidate_ids([user.id])
+
+	def invalidate_ids(self, user_ids):
+		local = self._get_local()
+		for user_id in user_ids:
+			local.pop(user_id, None)
+			cache.delete(self._get_key(user_id))
+
+_user_permissions_cache = UserPermissionsCache()
+rbac.set_permissions_cache(_user_permissions_cache)
+
+def invalidate_user_permissions(user=None):
+	"""Invalidates the cached permissions of the given user.
+
+	The permissions of all the users are invalidated when user is None.
+	This must be called whenever the roles of a user or the permissions
+	of a role are changed.
+	"""
+	_user_permissions_cache.invalidate(user)
+
+# Columns of member used by the role providers
+MEMBER_ROLE_COLUMNS = ["place_id", "place", "email"]
+MEMBER_ROLE_CHANGES_KEY = "permissions.changed_members"
+
+@event.listens_for(Session, "after_flush")
+def _record_member_role_changes(session, flush_context):
+	"""Remembers the members whose place or email is changed, as their
+	volunteer and admin roles depend on those, irrespective of where the
+	change is made.
+	"""
+	changed = session.info.setdefault(MEMBER_ROLE_CHANGES_KEY, set())
+	for obj in session.dirty:
+		if isinstance(obj, Member) and any(
+				attributes.get_history(obj, name).has_changes() for name in MEMBER_ROLE_COLUMNS):
+			changed.add(obj.id)
+	for obj in session.deleted:
+		if isinstance(obj, Member):
+			changed.add(obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_member_permissions(session):
+	changed = session.info.pop(MEMBER_ROLE_CHANGES_KEY, None)
+	if changed:
+		_user_permissions_cache.invalidate_ids(changed)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_member_role_changes(session):
+	session.info.pop(MEMBER_ROLE_CHANGES_KEY, None)
@@ -0,0 +1,251 @@
+"""In-process index of the place hierarchy.
+
+Finding the parents of a place through the place_parents table costs a
+few queries on every request. The tree itself changes very rarely, so
+this module keeps a compact snapshot of it in memory: the id, key, type
+and immediate parent of every place. Ancestor, descendant and type
+lookups are answered from that snapshot without going to the database.
+
+The snapshot is immutable. When the tree changes, it is invalidated by
+calling invalidate() and a new one is loaded on the next access. The
+invalidation is shared with other worker processes by storing a version
+number in the cache. When redis is not configured, the other processes
+can't see the invalidation and reload the snapshot every MAX_AGE seconds
+instead.
+
+    index = placeindex.get_index()
+    index.get_id("DL/AC001")
+    index.get_ancestor_ids(place.id)
+"""
+import time
+import uuid
+from array import array
+from . import cache
+
+# cache key used to share the index version between worker processes
+VERSION_KEY = "placeindex.version"
+
+# Number of seconds to wait before checking the shared version again
+CHECK_INTERVAL = 10
+
+# Number of seconds after which the index is reloaded when the version
+# can't be shared as redis is not configured
+MAX_AGE = 300
+
+class PlaceIndex(object):
+    """Immutable snapshot of the place tree.
+
+    Places are stored in compact arrays, sorted by id. Each place is
+    referred internally by its position in these arrays and the parent
+    of every place is stored as the position of the parent. That makes
+    walking up the tree O(depth) without creating any objects.
+    """
+    def __init__(self, places, types, version=None):
+        """Creates a new index.
+
+        :param places: iterable of (id, key, type_id, iparent_id) rows
+        :param types: iterable of (id, short_name) rows
+        :param version: the version of the data used to build the index
+        """
+        places = sorted(places)
+        self.version = version
+
+        self._ids = array('i', [row[0] for row in places])
+        self._keys = [row[1] for row in places]
+        self._type_ids = array('i', [row[2] for row in places])
+
+        self._positions = dict((id, i) for i, id in enumerate(self._ids))
+        self._key_positions = dict((key, i) for i, key in enumerate(self._keys))
+
+        # position of the immediate parent, -1 for the top-level places
+        self._parents = array('i', [self._positions.get(row[3], -1) for row in places])
+
+        self._type_names = dict(types)
+        self._type_ids_by_name = dict((name, id) for id, name in self._type_names.items())
+
+        self._build_children()
+
+    def _build_children(self):
+        """Builds the list of immediate children of every place.
+
+        The children are stored in a single array, grouped by parent.
+        The children of place at position i are in the slice
+        self._children[self._child_offsets[i]:self._child_offsets[i+1]].
+        """
+        n = len(self._ids)
+        offsets = array('i', [0]) * (n + 1)
+        for p in self._parents:
+            if p >= 0:
+                offsets[p + 1] += 1
+        for i in xrange(n):
+            offsets[i + 1] += offsets[i]
+
+        children = array('i', [0]) * offsets[n]
+        cursor = array('i', offsets)
+        for i, p in enumerate(self._parents):
+            if p >= 0:
+                children[cursor[p]] = i
+                cursor[p] += 1
+
+        self._child_offsets = offsets
+        self._children = children
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, id):
+        return id in self._positions
+
+    def _walk_up(self, pos):
+        """Yields positions of all the ancestors of place at pos,
+        nearest first, including pos itself.
+        """
+        # guard against cycles in bad data
+        for i in xrange(len(self._ids)):
+            if pos < 0:
+                break
+            yield pos
+            pos = self._parents[pos]
+
+    def get_id(self, key):
+        """Returns the id of the place with given key or None.
+        """
+        pos = self._key_positions.get(key)
+        if pos is not None:
+            return self._ids[pos]
+
+    def get_key(self, id):
+        pos = self._positions.get(id)
+        if pos is not None:
+            return self._keys[pos]
+
+    def get_type_id(self, id):
+        pos = self._positions.get(id)
+        if pos is not None:
+            return self._type_ids[pos]
+
+    def get_type_name(self, id):
+        """Returns short_name of the type of the place with given id.
+        """
+        return self._type_names.get(self.get_type_id(id))
+
+    def get_type_id_by_name(self, short_name):
+        return self._type_ids_by_name.get(short_name)
+
+    def get_parent_id(self, id):
+        """Returns the id of the immediate parent of the place.
+        """
+        pos = self._positions.get(id)
+        if pos is not None and self._parents[pos] >= 0:
+            return self._ids[self._parents[pos]]
+
+    def get_ancestor_ids(self, id):
+        """Returns ids of all the ancestors of the place, starting from
+        the top-level place. The place itself is not included.
+        """
+        pos = self._positions.get(id)
+        if pos is None:
+            return []
+        ids = [self._ids[p] for p in self._walk_up(pos)][1:]
+        ids.reverse()
+        return ids
+
+    def get_ancestor_keys(self, id):
+        """Returns keys of all the ancestors of the place, starting from
+        the top-level place. The place itself is not included.
+        """
+        pos = self._positions.get(id)
+        if pos is None:
+            return []
+        keys = [self._keys[p] for p in self._walk_up(pos)][1:]
+        keys.reverse()
+        return keys
+
+    def get_ancestor_id_of_type(self, id, type_id):
+        """Returns the id of the nearest place of the given type at or
+        above the given place.
+        """
+        pos = self._positions.get(id)
+        if pos is None:
+            return None
+        for p in self._walk_up(pos):
+            if self._type_ids[p] == type_id:
+                return self._ids[p]
+
+    def is_within(self, id, ancestor_id):
+        """Returns True if the place is same as the ancestor or below it.
+        """
+        pos = self._positions.get(id)
+        target = self._positions.get(ancestor_id)
+        if pos is None or target is None:
+            return False
+        return any(p == target for p in self._walk_up(pos))
+
+    def get_child_ids(self, id):
+        """Returns ids of the immediate children of the place.
+        """
+        pos = self._positions.get(id)
+        if pos is None:
+            return []
+        begin, end = self._child_offsets[pos], self._child_offsets[pos + 1]
+        return [self._ids[c] for c in self._children[begin:end]]
+
+    def get_descendant_ids(self, id, type_id=None):
+        """Returns ids of all places below the given place.
+
+        The place itself is not included. If type_id is specified,
+        only places of that type are returned.
+        """
+        pos = self._positions.get(id)
+        if pos is None:
+            return []
+        ids = []
+        stack = [pos]
+        while stack:
+            p = stack.pop()
+            begin, end = self._child_offsets[p], self._child_offsets[p + 1]
+            for c in self._children[begin:end]:
+                if type_id is None or self._type_ids[c] == type_id:
+                    ids.append(self._ids[c])
+                stack.append(c)
+        return ids
+
+
+_index = None
+_last_check = 0
+_loaded_at = 0
+
+def _load(version):
+    # imported here to avoid circular import as models depends on core
+    from ..models import db
+    places = db.engine.execute("SELECT id, key, type_id, iparent_id FROM place").fetchall()
+    types = db.engine.execute("SELECT id, short_name FROM place_type").fetchall()
+    return PlaceIndex(places, types, version=version)
+
+def get_index():
+    """Returns the place index, loading it if required.
+    """
+    global _index, _last_check, _loaded_at
+    now = time.time()
+    if _index is not None and now - _last_check < CHECK_INTERVAL:
+        return _index
+    _last_check = now
+
+    # The version is read before loading the places so that a change
+    # that happens while loading is noticed in the next check.
+    version = cache.get(VERSION_KEY)
+    shared = cache.get_redis_connection() is not None
+    if (_index is None or _index.version != version
+            or (not shared and now - _loaded_at > MAX_AGE)):
+        _index = _load(version)
+        _loaded_at = now
+    return _index
+
+def invalidate():
+    """Invalidates the index in this process and all other processes.
+
+    This must be called whenever places are added, moved or removed.
+    """
+    global _index
+    _index = None
+    cache.set(VERSION_KEY, uuid.uuid4().hex)
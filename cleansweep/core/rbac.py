@@ -13,17 +13,22 @@ NOTE: This may later be moved into an independent library with a more liberal li
 import functools
 import collections
 
+# the place used in permissions to indicate all places
+ANY_PLACE = ""
+
 _role_providers = []
 _permisison_providers = []
+_permissions_cache = None
 
 def _reset():
     """Resets all the global permisison state.
 
     Used for resetting the state before running each test case.
     """
-    global _role_providers, _permisison_providers
+    global _role_providers, _permisison_providers, _permissions_cache
     _role_providers = []
     _permisison_providers = []
+    _permissions_cache = None
     MetaPermission.permission_tree.clear()
     MetaPermission.permission_mapping.clear()
 
@@ -65,6 +70,18 @@ def permission_provider(func):
     return func
 
 
+def set_permissions_cache(cache):
+    """Sets the cache used to remember the permissions of users.
+
+    Computing the permissions of a user calls all the role and permission
+    providers, which usually query the database. The cache object must
+    provide get(user), returning the cached PermissionIndex or None, and
+    set(user, permission_index) methods.
+    """
+    global _permissions_cache
+    _permissions_cache = cache
+
+
 def get_user_roles(user):
     """Returns all roles of a user.
     """
@@ -75,9 +92,62 @@ def get_user_roles(user):
     return roles
 
 
+class PermissionIndex(object):
+    """Permissions of a user compiled for fast lookups.
+
+    The permissions are stored as a dict from place key to the frozenset
+    of permissions the user has at that place. Checking a permission at
+    a place is a set lookup at the place and each of its parents.
+    """
+    def __init__(self, permissions):
+        self.permissions = permissions
+
+        d = collections.defaultdict(set)
+        for p in permissions:
+            d[p['place']].add(p['permission'])
+        self._index = dict((place, frozenset(perms)) for place, perms in d.items())
+
+    def get_permissions(self, place_keys):
+        """Returns the set of permissions available at any of the places.
+        """
+        perms = set()
+        for key in place_keys:
+            perms.update(self._index.get(key, ()))
+        return perms
+
+    def can(self, action, place_keys):
+        """Tells if the action is permitted at any of the places.
+
+        The permission "*" permits every action.
+        """
+        for key in place_keys:
+            perms = self._index.get(key)
+            if perms and (action in perms or '*' in perms):
+                return True
+        return False
+
+
+def get_permission_index(user):
+    """Returns the PermissionIndex of the user.
+    """
+    cache = _permissions_cache
+    if cache is None:
+        return PermissionIndex(_compute_user_permissions(user))
+
+    index = cache.get(user)
+    if index is None:
+        index = PermissionIndex(_compute_user_permissions(user))
+        cache.set(user, index)
+    return index
+
+
 def get_user_permissions(user):
     """Returns all permissions of given user.
     """
+    return get_permission_index(user).permissions
+
+
+def _compute_user_permissions(user):
     roles = get_user_roles(user)
     permissions = []
 
@@ -96,6 +166,16 @@ def match_permission(perm, action):
     return perm['permission'] == action
 
 
+def get_place_keys(place):
+    """Returns the keys of the place and all its parents.
+    """
+    # use parent_keys when available as it is cheaper than parents
+    parent_keys = getattr(place, "parent_keys", None)
+    if parent_keys is None:
+        parent_keys = [p.key for p in place.parents]
+    return [place.key] + list(parent_keys)
+
+
 def can(user, action, resource):
     """Tells if the given user can perform the specified action on a resource.
 
@@ -107,14 +187,6 @@ def can(user, action, resource):
     @param resource: place object at which the action is being tried
     """
     place = resource
-    # place and all parents of the place
-    place_keys = [place.key] + [p.key for p in place.parents]
-
-    # empty string is used to indicate any place
-    place_keys.append("")
-
-    perms = get_user_permissions(user)
-    return any(match_permission(p, action)
-                for p in perms
-                if p['place'] in place_keys)
-
+    # place, all parents of the place and any place
+    place_keys = get_place_keys(place) + [ANY_PLACE]
+    return get_permission_index(user).can(action, place_keys)
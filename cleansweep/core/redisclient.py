@@ -0,0 +1,83 @@
+"""Shared redis clients.
+
+Creating a new Redis object for every cache access opens a new connection
+every time. This module keeps one client per redis server with a pool of
+connections, shared by the cache, the job queue and anything else that
+talks to redis in the process.
+
+    redis = redisclient.get_client()
+    if redis:
+        redis.get("foo")
+
+    with redisclient.pipeline() as p:
+        p.set("a", 1)
+        p.set("b", 2)
+
+The size of the pool is limited by the REDIS_MAX_CONNECTIONS config.
+When all the connections are in use, a caller waits up to
+REDIS_POOL_TIMEOUT seconds for one to be free.
+"""
+import contextlib
+import logging
+from redis import Redis, BlockingConnectionPool, RedisError
+from ..app import app
+
+logger = logging.getLogger(__name__)
+
+# clients by (host, port, socket_timeout)
+_clients = {}
+
+# marker to use the REDIS_SOCKET_TIMEOUT config
+DEFAULT_TIMEOUT = object()
+
+def get_client(host=None, port=None, socket_timeout=DEFAULT_TIMEOUT):
+    """Returns the shared client of the given redis server.
+
+    When host and port are not specified, the server is taken from the
+    REDIS_HOST and REDIS_PORT config. Returns None if they are not set.
+
+    The socket timeout defaults to REDIS_SOCKET_TIMEOUT, which is meant
+    for the web requests. Clients that block on redis, like the queue
+    worker, must pass a longer timeout or None to wait forever.
+    """
+    if host is None and port is None:
+        host = app.config.get('REDIS_HOST')
+        port = app.config.get('REDIS_PORT')
+        if not host or not port:
+            return None
+    if socket_timeout is DEFAULT_TIMEOUT:
+        socket_timeout = app.config.get('REDIS_SOCKET_TIMEOUT', 5)
+
+    key = (host, port, socket_timeout)
+    if key not in _clients:
+        pool = BlockingConnectionPool(
+            host=host,
+            port=port,
+            max_connections=app.config.get('REDIS_MAX_CONNECTIONS', 50),
+            timeout=app.config.get('REDIS_POOL_TIMEOUT', 5),
+            socket_timeout=socket_timeout)
+        _clients[key] = Redis(connection_pool=pool)
+    return _clients[key]
+
+def check_health(client=None):
+    """Returns True if the redis server is reachable.
+    """
+    client = client or get_client()
+    if client is None:
+        return False
+    try:
+        return client.ping()
+    except RedisError:
+        logger.warn("redis server is not reachable", exc_info=True)
+        return False
+
+@contextlib.contextmanager
+def pipeline(client=None, transaction=False):
+    """Context manager to send multiple commands in a single round trip.
+
+    The commands are executed when the block exits without an error.
+    """
+    client = client or get_client()
+    p = client.pipeline(transaction=transaction)
+    yield p
+    p.execute()
@@ -0,0 +1,121 @@
+from redis import ConnectionError
+from .. import cache
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        return self.data.get(key)
+
+    def mget(self, keys):
+        self.calls += 1
+        return [self.data.get(k) for k in keys]
+
+class BrokenRedis:
+    calls = 0
+    def get(self, key):
+        self.calls += 1
+        raise ConnectionError("connection refused")
+
+def test_get_many(monkeypatch):
+    redis = FakeRedis()
+    redis.data = {"a": "1", "c": "3"}
+    monkeypatch.setattr(cache.redisclient, "get_client", lambda: redis)
+    assert cache.get_many(["a", "b", "c"]) == ["1", None, "3"]
+    assert redis.calls == 1
+    assert cache.get_many([]) == []
+
+def test_not_configured(monkeypatch):
+    monkeypatch.setattr(cache.redisclient, "get_client", lambda: None)
+    assert cache.get("a") is None
+    assert cache.get_many(["a", "b"]) == [None, None]
+
+def test_skip_on_error(monkeypatch):
+    redis = BrokenRedis()
+    monkeypatch.setattr(cache.redisclient, "get_client", lambda: redis)
+    monkeypatch.setattr(cache, "_retry_after", 0)
+    assert cache.get("a") is None
+    assert cache.get("a") is None
+    # redis is not tried again until the retry interval
+    assert redis.calls == 1
+    assert cache.get_redis_connection() is None
+
+class TestCached:
+    def init(self, monkeypatch):
+        self.data = {}
+        self.calls = []
+        monkeypatch.setattr(cache, "get", self.data.get)
+        monkeypatch.setattr(cache, "set", lambda key, value, expiry=None: self.data.__setitem__(key, value))
+        monkeypatch.setattr(cache, "delete", lambda key: self.data.pop(key, None))
+
+        @cache.cached(ttl=60, key="{0}", namespace="test")
+        def count(name):
+            self.calls.append(name)
+            return len(self.calls) - 1
+        return count
+
+    def test_cached(self, monkeypatch):
+        count = self.init(monkeypatch)
+        # zero is a valid value and must not be recomputed
+        assert count("a") == 0
+        assert count("a") == 0
+        assert self.calls == ["a"]
+        assert "cache/test/a" in self.data
+
+        assert count("b") == 1
+        assert self.calls == ["a", "b"]
+
+    def test_redis_tier(self, monkeypatch):
+        count = self.init(monkeypatch)
+        monkeypatch.setattr(cache, "_should_refresh", lambda expires, delta, now: False)
+        count("a")
+        # value from redis is used when it is not in the local cache
+        count.local_cache.clear()
+        assert count("a") == 0
+        assert self.calls == ["a"]
+
+    def test_early_refresh(self, monkeypatch):
+        count = self.init(monkeypatch)
+        count("a")
+        count.local_cache.clear()
+        monkeypatch.setattr(cache, "_should_refresh", lambda expires, delta, now: True)
+        assert count("a") == 1
+
+    def test_invalidate(self, monkeypatch):
+        count = self.init(monkeypatch)
+        count("a")
+        count.invalidate("a")
+        assert self.data == {}
+        assert count("a") == 1
+        assert count.refresh("a") == 2
+        assert count("a") == 2
+
+def test_should_refresh(monkeypatch):
+    monkeypatch.setattr(cache.random, "random", lambda: 0.5)
+    now = 1000
+    assert not cache._should_refresh(now + 60, 1, now)
+    assert cache._should_refresh(now + 60, 100, now)
+    assert cache._should_refresh(now, 0, now)
+
+def test_lru():
+    lru = cache.LRUCache(2)
+    lru.set("a", None, 100)
+    lru.set("b", 2, 100)
+    assert lru.get("a", now=10) == (None,)
+    lru.set("c", 3, 100)
+    # b is the least recently used
+    assert lru.get("b", now=10) is None
+    assert lru.get("a", now=10) == (None,)
+    assert lru.get("c", now=200) is None
+
+def test_client_timeouts():
+    from .. import redisclient
+    web = redisclient.get_client("localhost", 6379)
+    worker = redisclient.get_client("localhost", 6379, socket_timeout=None)
+    assert web is redisclient.get_client("localhost", 6379)
+    assert worker is not web
+    assert web.connection_pool.connection_kwargs['socket_timeout'] == 5
+    assert worker.connection_pool.connection_kwargs['socket_timeout'] is None
@@ -0,0 +1,54 @@
+from .. import docregistry
+
+class TestDocumentRegistry:
+    def setup_method(self, method):
+        self.cache = {}
+        self.loads = 0
+        self.docs = [("north", {"name": "North"}), ("south", {"name": "South"})]
+
+    def make_registry(self, monkeypatch):
+        def incr(key):
+            self.cache[key] = str(int(self.cache.get(key) or 0) + 1)
+
+        monkeypatch.setattr(docregistry.cache, "get", self.cache.get)
+        monkeypatch.setattr(docregistry.cache, "incr", incr)
+
+        registry = docregistry.DocumentRegistry("division")
+        def load():
+            self.loads += 1
+            return docregistry.OrderedDict((k, dict(v)) for k, v in self.docs)
+        registry._load = load
+        return registry
+
+    def test_get(self, monkeypatch):
+        registry = self.make_registry(monkeypatch)
+        assert registry.get("north").data == {"name": "North"}
+        assert registry.get("north").type == "division"
+        assert registry.get("east") is None
+        assert [d.key for d in registry.all()] == ["north", "south"]
+        assert self.loads == 1
+
+    def test_copies(self, monkeypatch):
+        registry = self.make_registry(monkeypatch)
+        registry.get("north").data['name'] = "foo"
+        assert registry.get("north").data == {"name": "North"}
+
+    def test_invalidate(self, monkeypatch):
+        registry = self.make_registry(monkeypatch)
+        registry.all()
+        self.docs.append(("east", {"name": "East"}))
+        registry.invalidate()
+        assert [d.key for d in registry.all()] == ["north", "south", "east"]
+        assert self.loads == 2
+
+    def test_version_change(self, monkeypatch):
+        # change in another process is noticed after CHECK_INTERVAL
+        monkeypatch.setattr(docregistry, "CHECK_INTERVAL", 0)
+        registry = self.make_registry(monkeypatch)
+        registry.all()
+        registry.all()
+        assert self.loads == 1
+
+        self.cache[registry.version_key] = "42"
+        registry.all()
+        assert self.loads == 2
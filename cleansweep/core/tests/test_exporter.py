@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import datetime
+import zipfile
+from cStringIO import StringIO
+from .. import exporter
+
+HEADERS = ["Name", "Phone", "Date"]
+ROWS = [
+    [u"Alice", "9876543210", datetime.date(2015, 1, 2)],
+    [u"बॉब", None, 42],
+]
+
+def test_batches():
+    assert list(exporter.batches(xrange(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(exporter.batches([], 2)) == []
+
+def test_csv():
+    data = "".join(exporter.iter_csv(HEADERS, iter(ROWS)))
+    assert data.startswith('\xef\xbb\xbf')
+    assert data[3:].splitlines() == [
+        "Name,Phone,Date",
+        "Alice,9876543210,2015-01-02",
+        u"बॉब,,42".encode("utf-8")
+    ]
+
+def test_csv_chunks(monkeypatch):
+    monkeypatch.setattr(exporter, "CHUNK_SIZE", 10)
+    rows = [["x" * 8]] * 5
+    chunks = list(exporter.iter_csv(["a"], iter(rows)))
+    assert len(chunks) > 1
+    assert "".join(chunks) == '\xef\xbb\xbfa\r\n' + 'xxxxxxxx\r\n' * 5
+
+def test_column_name():
+    assert exporter._column_name(0) == "A"
+    assert exporter._column_name(25) == "Z"
+    assert exporter._column_name(26) == "AA"
+    assert exporter._column_name(27 * 26) == "AAA"
+
+def test_xlsx():
+    f = StringIO()
+    exporter.write_xlsx(f, HEADERS, iter(ROWS), title="Volunteers/All")
+    z = zipfile.ZipFile(StringIO(f.getvalue()))
+    assert "[Content_Types].xml" in z.namelist()
+    assert 'name="Volunteers All"' in z.read("xl/workbook.xml")
+
+    sheet = z.read("xl/worksheets/sheet1.xml").decode("utf-8")
+    assert sheet.count("<row ") == 3
+    assert u'<c r="A3" t="inlineStr"><is><t xml:space="preserve">बॉब</t></is></c>' in sheet
+    assert '<c r="C3"><v>42</v></c>' in sheet
+    assert '2015-01-02' in sheet
+
+def test_write():
+    f = StringIO()
+    exporter.write(f, "csv", ["a"], [["<b>"]])
+    assert f.getvalue() == '\xef\xbb\xbfa\r\n<b>\r\n'
@@ -0,0 +1,116 @@
+import os
+from .. import exportjobs
+
+class FakeQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue(self, f, *a, **kw):
+        self.jobs.append((f, a))
+
+class TestExportJobs:
+    def setup_method(self, method):
+        self.cache = {}
+        self.queue = FakeQueue()
+
+    def init(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(exportjobs.cache, "get", self.cache.get)
+        monkeypatch.setattr(exportjobs.cache, "set", lambda key, value, expiry=None: self.cache.__setitem__(key, value))
+        monkeypatch.setattr(exportjobs, "get_queue", lambda: self.queue)
+        monkeypatch.setattr(exportjobs, "get_exports_dir", lambda: str(tmpdir.join("exports")))
+        monkeypatch.setattr(exportjobs, "PROGRESS_INTERVAL", 2)
+
+        @exportjobs.register("numbers")
+        def export_numbers(n):
+            return ["n"], ([i] for i in range(n))
+
+    def run_jobs(self):
+        for f, args in self.queue.jobs:
+            f(*args)
+        self.queue.jobs = []
+
+    def test_export(self, monkeypatch, tmpdir):
+        self.init(monkeypatch, tmpdir)
+        status = exportjobs.start("numbers", dict(n=5), "csv", filename="numbers", place="KA", permission="read")
+        assert status['state'] == 'queued'
+        assert len(self.queue.jobs) == 1
+
+        self.run_jobs()
+        status = exportjobs.get_status(status['id'])
+        assert status['state'] == 'finished'
+        assert status['rows'] == 5
+        assert status['place'] == "KA"
+
+        path = exportjobs.get_path(status)
+        assert open(path).read() == '\xef\xbb\xbfn\r\n0\r\n1\r\n2\r\n3\r\n4\r\n'
+
+    def test_reuse(self, monkeypatch, tmpdir):
+        self.init(monkeypatch, tmpdir)
+        s1 = exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        s2 = exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        assert s1['id'] == s2['id']
+        assert len(self.queue.jobs) == 1
+
+        self.run_jobs()
+        exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        assert len(self.queue.jobs) == 0
+
+        # a different export
+        s3 = exportjobs.start("numbers", dict(n=5), "xlsx", filename="numbers")
+        assert s3['id'] != s1['id']
+        assert len(self.queue.jobs) == 1
+
+        # the export is started again when the file is gone
+        self.run_jobs()
+        os.remove(exportjobs.get_path(s1))
+        exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        assert len(self.queue.jobs) == 1
+
+    def test_stale(self, monkeypatch, tmpdir):
+        self.init(monkeypatch, tmpdir)
+        status = exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        self.queue.jobs = []
+
+        # the worker died while running the job
+        status['state'] = 'running'
+        status['started'] = status['created']
+        exportjobs._save_status(status)
+        exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        assert len(self.queue.jobs) == 0
+
+        status['started'] -= exportjobs.JOB_TIMEOUT + 1
+        exportjobs._save_status(status)
+        status = exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        assert status['state'] == 'queued'
+        assert len(self.queue.jobs) == 1
+
+        # the job is lost before it is picked by a worker
+        self.queue.jobs = []
+        status['created'] -= exportjobs.JOB_TIMEOUT + 1
+        exportjobs._save_status(status)
+        exportjobs.start("numbers", dict(n=5), "csv", filename="numbers")
+        assert len(self.queue.jobs) == 1
+
+    def test_cleanup(self, monkeypatch, tmpdir):
+        self.init(monkeypatch, tmpdir)
+        monkeypatch.setattr(exportjobs, "get_ttl", lambda: 60)
+        root = tmpdir.mkdir("exports")
+        old = root.join("old.csv")
+        old.write("x")
+        running = root.join("running.csv.tmp")
+        running.write("x")
+        t = os.path.getmtime(str(old)) - 120
+        os.utime(str(old), (t, t))
+        os.utime(str(running), (t, t))
+
+        # the file is already deleted by another worker
+        getmtime = os.path.getmtime
+        def racy_getmtime(path):
+            if path.endswith("gone.csv"):
+                raise OSError(2, "No such file or directory")
+            return getmtime(path)
+        root.join("gone.csv").write("x")
+        monkeypatch.setattr(exportjobs.os.path, "getmtime", racy_getmtime)
+
+        exportjobs.cleanup()
+        assert sorted(os.listdir(str(root))) == ["gone.csv", "running.csv.tmp"]
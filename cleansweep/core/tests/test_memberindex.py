@@ -0,0 +1,177 @@
+import bisect
+from .. import memberindex, placeindex
+from ..placeindex import PlaceIndex
+
+class FakeRedis:
+    """Implements just enough of redis for the member index.
+    """
+    def __init__(self):
+        self.data = {}
+        self.hashes = {}
+        self.zsets = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def hget(self, name, key):
+        return self.hashes.get(name, {}).get(str(key))
+
+    def hmget(self, name, keys):
+        self.round_trips += 1
+        return [self.hget(name, k) for k in keys]
+
+    def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[str(key)] = value
+
+    def hdel(self, name, key):
+        self.hashes.get(name, {}).pop(str(key), None)
+
+    def zadd(self, name, *args):
+        zset = self.zsets.setdefault(name, [])
+        for value in args[::2]:
+            if value not in zset:
+                bisect.insort(zset, value)
+
+    def zrem(self, name, *values):
+        zset = self.zsets.get(name, [])
+        for value in values:
+            if value in zset:
+                zset.remove(value)
+
+    def zrangebylex(self, name, min, max, start, num):
+        assert min[0] == "[" and max[0] == "["
+        values = [v for v in self.zsets.get(name, []) if min[1:] <= v <= max[1:]]
+        return values[start:start + num]
+
+class FakePipeline:
+    """Queues the commands and runs them on the FakeRedis on execute.
+    """
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        self.redis.round_trips += 1
+        for name, args in self.commands:
+            getattr(self.redis, name)(*args)
+
+class Member:
+    def __init__(self, id, name, email, phone, place_id):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.phone = phone
+        self.place_id = place_id
+
+# KA(1) -> AC001(2), AC002(3)
+PLACES = [
+    (1, "KA", 1, None),
+    (2, "KA/AC001", 2, 1),
+    (3, "KA/AC002", 2, 1),
+]
+TYPES = [(1, "STATE"), (2, "AC")]
+
+class TestMemberIndex:
+    def init(self, monkeypatch):
+        self.redis = FakeRedis()
+        self.redis.data[memberindex.READY_KEY] = "1"
+        monkeypatch.setattr(memberindex.cache, "get_redis_connection", lambda: self.redis)
+        monkeypatch.setattr(placeindex, "get_index", lambda: PlaceIndex(PLACES, TYPES))
+
+        memberindex.update(Member(1, u"Ravi Kumar", "ravi@example.com", "98450-12345", 2))
+        memberindex.update(Member(2, u"Kumar Ravi", "kumar@example.com", "9845099999", 2))
+        memberindex.update(Member(3, u"Ravindra", "ravindra@example.com", "+91 99000 12345", 3))
+
+    def ids(self, place_id, query, limit=10):
+        return [m['id'] for m in memberindex.search(place_id, query, limit=limit)]
+
+    def test_search(self, monkeypatch):
+        self.init(monkeypatch)
+        # members with the exact term come first
+        assert self.ids(1, "ravi") == [1, 2, 3]
+        assert self.ids(1, "RAV", limit=2) == [1, 2]
+        assert self.ids(1, "ravi kum") == [1, 2]
+        assert self.ids(1, "ravind") == [3]
+        assert self.ids(1, "ravi@") == [1]
+        assert self.ids(1, "xyz") == []
+        assert memberindex.search(1, " ") == []
+
+    def test_subtree(self, monkeypatch):
+        self.init(monkeypatch)
+        assert self.ids(2, "ravi") == [1, 2]
+        assert self.ids(3, "ravi") == [3]
+
+    def test_phone(self, monkeypatch):
+        self.init(monkeypatch)
+        assert self.ids(1, "98450") == [1, 2]
+        assert self.ids(1, "98450 123") == [1]
+        assert self.ids(1, "12345") == []
+
+        # the country code and the leading zeros are ignored
+        assert self.ids(1, "+91 98450") == [1, 2]
+        assert self.ids(1, "+919845012345") == [1]
+        assert self.ids(1, "0 98450 12345") == [1]
+        assert self.ids(1, "99000") == [3]
+        assert self.ids(1, "919900012345") == [3]
+
+    def test_normalize_phone(self):
+        assert memberindex.normalize_phone("+91 98450-12345") == "9845012345"
+        assert memberindex.normalize_phone("0091 98450 12345") == "9845012345"
+        assert memberindex.normalize_phone("919845012345") == "9845012345"
+        assert memberindex.normalize_phone("09845012345") == "9845012345"
+        # a prefix that may be the start of a number
+        assert memberindex.normalize_phone("9198") == "9198"
+        assert memberindex.normalize_phone(None) == ""
+
+    def test_update_and_remove(self, monkeypatch):
+        self.init(monkeypatch)
+        memberindex.update(Member(1, u"Suresh", "suresh@example.com", "98450-12345", 2))
+        assert self.ids(1, "ravi") == [2, 3]
+        assert self.ids(1, "sur") == [1]
+
+        memberindex.remove(2)
+        assert self.ids(1, "ravi") == [3]
+        assert self.ids(1, "kumar") == []
+
+        # removing a member that is not in the index
+        memberindex.remove(2)
+        memberindex.save(4, dict(name=u"Ravi", email=None, phone=None, place_id=3))
+        assert self.ids(3, "ravi") == [4, 3]
+
+    def test_save_many(self, monkeypatch):
+        self.init(monkeypatch)
+        self.redis.round_trips = 0
+        memberindex.save_many({
+            1: dict(name=u"Suresh", email=None, phone=None, place_id=2),
+            2: None,
+            4: dict(name=u"Ravi", email=None, phone=None, place_id=3),
+            5: None,
+        })
+        # one command to read the old docs and one to write the changes
+        assert self.redis.round_trips == 2
+        memberindex.save_many({})
+        assert self.redis.round_trips == 2
+
+        assert self.ids(1, "ravi") == [4, 3]
+        assert self.ids(1, "sur") == [1]
+        assert self.ids(1, "kumar") == []
+
+    def test_not_available(self, monkeypatch):
+        self.init(monkeypatch)
+        monkeypatch.setattr(memberindex, "MAX_SCAN", 2)
+        monkeypatch.setattr(memberindex, "SCAN_BATCH_SIZE", 1)
+        # too many entries to scan for the place
+        assert memberindex.search(3, "ravi") is None
+
+        del self.redis.data[memberindex.READY_KEY]
+        assert memberindex.search(1, "ravi") is None
+
+        monkeypatch.setattr(memberindex.cache, "get_redis_connection", lambda: None)
+        assert memberindex.search(1, "ravi") is None
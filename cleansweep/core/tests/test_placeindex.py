@@ -0,0 +1,87 @@
+from ..placeindex import PlaceIndex
+
+TYPES = [(1, "STATE"), (2, "AC"), (3, "PB")]
+
+PLACES = [
+    (1, "KA", 1, None),
+    (2, "KA/AC001", 2, 1),
+    (3, "KA/AC002", 2, 1),
+    (4, "KA/AC001/PB0001", 3, 2),
+    (5, "KA/AC001/PB0002", 3, 2),
+    (6, "KA/AC002/PB0001", 3, 3),
+    (7, "DL", 1, None),
+]
+
+class TestPlaceIndex:
+    def setup_method(self, method):
+        self.index = PlaceIndex(PLACES, TYPES, version="v1")
+
+    def test_lookup(self):
+        index = self.index
+        assert len(index) == 7
+        assert index.version == "v1"
+        assert 4 in index
+        assert 8 not in index
+
+        assert index.get_id("KA/AC001/PB0002") == 5
+        assert index.get_id("KA/AC003") is None
+        assert index.get_key(3) == "KA/AC002"
+        assert index.get_type_id(6) == 3
+        assert index.get_type_name(2) == "AC"
+        assert index.get_type_id_by_name("PB") == 3
+
+    def test_ancestors(self):
+        index = self.index
+        assert index.get_parent_id(4) == 2
+        assert index.get_parent_id(1) is None
+        assert index.get_ancestor_ids(4) == [1, 2]
+        assert index.get_ancestor_keys(6) == ["KA", "KA/AC002"]
+        assert index.get_ancestor_ids(1) == []
+        assert index.get_ancestor_ids(100) == []
+
+        assert index.get_ancestor_id_of_type(5, 2) == 2
+        assert index.get_ancestor_id_of_type(5, 3) == 5
+        assert index.get_ancestor_id_of_type(2, 3) is None
+
+    def test_is_within(self):
+        index = self.index
+        assert index.is_within(4, 1)
+        assert index.is_within(4, 2)
+        assert index.is_within(4, 4)
+        assert not index.is_within(4, 3)
+        assert not index.is_within(1, 4)
+        assert not index.is_within(4, 7)
+
+    def test_descendants(self):
+        index = self.index
+        assert index.get_child_ids(1) == [2, 3]
+        assert index.get_child_ids(4) == []
+        assert sorted(index.get_descendant_ids(1)) == [2, 3, 4, 5, 6]
+        assert sorted(index.get_descendant_ids(1, type_id=3)) == [4, 5, 6]
+        assert index.get_descendant_ids(7) == []
+
+    def test_unknown_parent(self):
+        # places with missing parent are treated as top-level places
+        index = PlaceIndex([(1, "KA", 1, 42)], TYPES)
+        assert index.get_parent_id(1) is None
+        assert index.get_ancestor_ids(1) == []
+
+def test_get_index_without_redis(monkeypatch):
+    from .. import placeindex
+    now = [1000.0]
+    loads = []
+    monkeypatch.setattr(placeindex.time, "time", lambda: now[0])
+    monkeypatch.setattr(placeindex.cache, "get", lambda key: None)
+    monkeypatch.setattr(placeindex.cache, "get_redis_connection", lambda: None)
+    monkeypatch.setattr(placeindex, "_load", lambda version: loads.append(version) or PlaceIndex(PLACES, TYPES))
+    monkeypatch.setattr(placeindex, "_index", None)
+
+    index = placeindex.get_index()
+    now[0] += placeindex.CHECK_INTERVAL + 1
+    assert placeindex.get_index() is index
+    assert len(loads) == 1
+
+    # reloaded after MAX_AGE as other processes can't share invalidations
+    now[0] += placeindex.MAX_AGE
+    assert placeindex.get_index() is not index
+    assert len(loads) == 2
@@ -4,6 +4,7 @@ class TestRBAC:
     def setup_method(self, method):
         rbac._role_providers = []
         rbac._permission_providers = []
+        rbac._permissions_cache = None
 
     def test_get_user_roles(self):
         roles = {
@@ -49,6 +50,46 @@ class TestRBAC:
         user = "alice"
         assert rbac.get_user_permissions(user) == [{"place": "place1", "permission": "add-volunteer"}]
 
+    def test_permissions_cache(self):
+        calls = []
+
+        @rbac.role_provider
+        def simple_roles(user):
+            calls.append(user)
+            return [{"role": "role1", "place": "place1"}]
+
+        class Cache(dict):
+            def set(self, user, permissions):
+                self[user] = permissions
+
+        cache = Cache()
+        rbac.set_permissions_cache(cache)
+        perms = rbac.get_user_permissions("alice")
+        assert cache["alice"].permissions == perms
+        assert rbac.get_user_permissions("alice") == perms
+        assert calls == ["alice"]
+
+        # empty index is a valid cached value
+        cache["bob"] = rbac.PermissionIndex([])
+        assert rbac.get_user_permissions("bob") == []
+        assert calls == ["alice"]
+
+    def test_permission_index(self):
+        index = rbac.PermissionIndex([
+            {"place": "DL", "permission": "read"},
+            {"place": "DL/AC001", "permission": "write"},
+            {"place": "DL/AC001", "permission": "read"},
+            {"place": "KA", "permission": "*"},
+        ])
+        assert index.get_permissions(["DL/AC001", "DL"]) == set(["read", "write"])
+        assert index.get_permissions(["DL/AC002", "DL"]) == set(["read"])
+        assert index.get_permissions(["MH"]) == set()
+
+        assert index.can("write", ["DL/AC001/PB0001", "DL/AC001", "DL"])
+        assert not index.can("write", ["DL/AC002", "DL"])
+        assert index.can("anything", ["KA/AC001", "KA"])
+        assert not index.can("read", [])
+
     def test_can(self, monkeypatch):
         def mock_get_user_permissions(user):
             if user == "alice":
@@ -56,7 +97,7 @@ class TestRBAC:
             elif user == "bob":
                 return [{"place": "DL/AC002", "permission": "add-volunteer"}]
 
-        monkeypatch.setattr(rbac, "get_user_permissions", mock_get_user_permissions)
+        monkeypatch.setattr(rbac, "_compute_user_permissions", mock_get_user_permissions)
 
         AC001 = MockPlace("DL/AC001", ["DL", "DL/DT01"])
         AC001_PB0001 = MockPlace("DL/AC001/PB0001", ["DL", "DL/DT01", "DL/AC001"])
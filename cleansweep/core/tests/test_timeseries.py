@@ -0,0 +1,39 @@
+import os
+import time
+from datetime import date
+from .. import timeseries
+
+ROWS = [
+    dict(date=date(2016, 1, 3), count=1),
+    dict(date=date(2016, 1, 1), count=2),
+    dict(date=date(2015, 12, 1), count=5),
+]
+
+def test_daterange():
+    assert timeseries.daterange(date(2016, 1, 30), date(2016, 2, 1)) == [
+        date(2016, 1, 30), date(2016, 1, 31), date(2016, 2, 1)]
+    assert timeseries.daterange(date(2016, 1, 2), date(2016, 1, 1)) == []
+
+def test_densify():
+    start, end = date(2016, 1, 1), date(2016, 1, 4)
+    assert timeseries.densify(ROWS, start, end) == [2, 0, 1, 0]
+    assert timeseries.densify(ROWS, start, end, cumulative=True) == [2, 2, 3, 3]
+    assert timeseries.densify([], start, end) == [0, 0, 0, 0]
+    assert timeseries.densify(ROWS, end, start) == []
+
+def test_graph_data():
+    data = timeseries.get_graph_data(ROWS, date(2016, 1, 1), date(2016, 1, 2), cumulative=True)
+    t0 = time.mktime(date(2016, 1, 1).timetuple()) * 1000
+    t1 = time.mktime(date(2016, 1, 2).timetuple()) * 1000
+    assert data == [[t0, 2], [t1, 2]]
+
+def test_timestamps_dst(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/London")
+    time.tzset()
+    try:
+        # clocks go forward by an hour on 27 March 2016
+        ts = timeseries.get_timestamps(date(2016, 3, 26), 3)
+        assert [t - ts[0] for t in ts] == [0, 24 * 3600 * 1000, 47 * 3600 * 1000]
+    finally:
+        monkeypatch.undo()
+        time.tzset()
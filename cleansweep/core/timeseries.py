@@ -0,0 +1,59 @@
+"""Utilities to work with daily timeseries.
+
+The stats and the campaign data are stored as sparse (date, count) rows,
+with no rows for the days without any data. The graphs need a value for
+every day in the range. The densify function fills in the missing days
+and optionally computes the running total:
+
+    >>> rows = [dict(date=date(2016, 1, 1), count=2), dict(date=date(2016, 1, 3), count=1)]
+    >>> densify(rows, date(2016, 1, 1), date(2016, 1, 4), cumulative=True)
+    [2, 2, 3, 3]
+
+The rows are placed at their offset from the start date in a single
+pass, so this is linear in the number of days and rows.
+"""
+import datetime
+import time
+
+def daterange(start, end):
+    """Returns the list of all dates from start to end, both inclusive.
+    """
+    return [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+def densify(rows, start, end, cumulative=False):
+    """Returns the list of counts for every day from start to end.
+
+    The rows must have date and count fields. Rows outside the range are
+    ignored. When cumulative is True, the running total is returned.
+    """
+    n = (end - start).days + 1
+    if n <= 0:
+        return []
+    values = [0] * n
+    for row in rows:
+        i = (row['date'] - start).days
+        if 0 <= i < n:
+            values[i] += row['count'] or 0
+    if cumulative:
+        total = 0
+        for i, v in enumerate(values):
+            total += v
+            values[i] = total
+    return values
+
+def get_timestamps(start, n):
+    """Returns the timestamps in milliseconds of n days starting from
+    start, at midnight in the local timezone.
+
+    Each day is converted separately as the days are not always 24 hours
+    apart in timezones with daylight saving.
+    """
+    days = (start + datetime.timedelta(days=i) for i in range(n))
+    return [int(time.mktime(d.timetuple())) * 1000 for d in days]
+
+def get_graph_data(rows, start, end, cumulative=False):
+    """Returns the rows as a list of [timestamp in ms, value] pairs for
+    every day from start to end, as expected by the graphs.
+    """
+    values = densify(rows, start, end, cumulative=cumulative)
+    return [list(pair) for pair in zip(get_timestamps(start, len(values)), values)]
@@ -47,6 +47,30 @@ TRUSTED_APPS = [
 
 ENABLE_MOCKDOWN = False
 
+# Directory to store the files exported in background jobs. This must be
+# shared by the web app and the workers.
+EXPORTS_DIR = "/tmp/cleansweep-exports"
+
+# Number of seconds an exported file is reused for identical exports
+EXPORTS_TTL = 3600
+
+# Number of seconds to cache the permissions of a user in redis.
+# Set it to 0 to compute the permissions on every request.
+PERMISSIONS_CACHE_TTL = 300
+
+# Maximum number of redis connections per process. When all of them are
+# in use, a caller waits REDIS_POOL_TIMEOUT seconds for a free one.
+REDIS_MAX_CONNECTIONS = 50
+REDIS_POOL_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 5
+
+# Number of seconds to skip the cache after redis is found unreachable
+REDIS_RETRY_INTERVAL = 30
+
+# Number of threads used to compute the stats of a place in parallel.
+# Each thread uses a database connection, keep it below the pool size.
+STATS_THREADS = 4
+
 LOGGER_NAME = "cleansweep"
 
 # Specify the list of admin users here.
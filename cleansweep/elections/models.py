@@ -1,5 +1,6 @@
-from ..models import db, Place, PlaceType, Member, place_parents
+from ..models import db, Place, PlaceType, Member, PlaceCounters, DailyRollup, place_parents
 from ..plugins.committees.models import Committee, CommitteeMember, CommitteeType, CommitteeRole
+from ..core import timeseries
 from collections import defaultdict
 from sqlalchemy.sql.expression import func
 from sqlalchemy.dialects.postgresql import JSON
@@ -214,12 +215,13 @@ class CampaignDataTable:
 
         d = self.get_data_dict() or {today: 0}
         mindate = min(min(d.keys()), weekago)
-        return [{"date": date.isoformat(), "count": d.get(date, 0)} for date in self.daterange(mindate, today)]
+        rows = [dict(date=date, count=count) for date, count in d.items()]
+        counts = timeseries.densify(rows, mindate, today)
+        dates = self.daterange(mindate, today)
+        return [{"date": date.isoformat(), "count": count} for date, count in zip(dates, counts)]
 
     def daterange(self, start, end):
-        while start <= end:
-            yield start
-            start = start + datetime.timedelta(days=1)
+        return timeseries.daterange(start, end)
 
 class BoothAgent(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -372,6 +374,9 @@ class BoothAgentReport:
                             voterid=row['voterid'])
             member.add_details('booth-agent-notes', row['notes'])
             member.add_details('address', row['address'])
+            PlaceCounters.increment(booth.id, members=1)
+            # created is set only on insert
+            DailyRollup.increment(booth.id, "members", datetime.date.today())
             role = row['role'] or "Booth Volunteer"
             committee = booth.get_committee("booth-committee")
             committee.add_member(role, member)
@@ -399,8 +404,12 @@ class BoothAgentReport:
             committee_member.role = committee_member.committee.type.get_role(role)
             db.session.add(committee_member)
         else:
+            m = committee_member.member
+            PlaceCounters.increment(m.place_id, members=-1)
+            if m.created:
+                DailyRollup.increment(m.place_id, "members", m.created.date(), -1)
             db.session.delete(committee_member)
-            db.session.delete(committee_member.member)
+            db.session.delete(m)
 
     def has_value(self, d, key):
         return d.get(key) and str(d[key]).strip()
@@ -46,12 +46,24 @@ def json_encode(value):
 
 
 def get_current_user():
-    if session.get('user'):
-        return Member.find(email=session['user'])
+    """Returns the logged in user.
+
+    The user is remembered in flask.g for the rest of the request as this
+    is called many times while processing a request.
+    """
+    email = session.get('user')
+    cached = getattr(g, "current_user", None)
+    if cached and cached[0] == email:
+        return cached[1]
+
+    if email:
+        user = Member.find(email=email)
     else:
         # Hack for allowing authentication using API keys
         from .views import account
-        return account.get_api_user()
+        user = account.get_api_user()
+    g.current_user = (email, user)
+    return user
 
 def get_site_title():
     place = getattr(g, "place", None)
@@ -94,7 +106,17 @@ def initiaze_default_permissions():
 
 def get_permissions(user, place):
     """Returns the list of permissions the user has at the given place.
+
+    The result is remembered in flask.g for the rest of the request.
     """
+    key = (user and user.id, place and place.key)
+    if getattr(g, "place_permissions", None) is None:
+        g.place_permissions = {}
+    if key not in g.place_permissions:
+        g.place_permissions[key] = _get_permissions(user, place)
+    return g.place_permissions[key]
+
+def _get_permissions(user, place):
     perms = []
     # ADMIN_USERS have all the permissions
     if user and user.email in app.config['ADMIN_USERS']:
@@ -104,9 +126,8 @@ def get_permissions(user, place):
     if place is None:
         perms += []
     else:
-        place_keys = [place.key] + [p.key for p in place.parents]
-        perm_dicts = rbac.get_user_permissions(user)
-        perms += [p['permission'] for p in perm_dicts if p['place'] in place_keys]
+        place_keys = rbac.get_place_keys(place)
+        perms += rbac.get_permission_index(user).get_permissions(place_keys)
     return perms
 
 def has_permission(permission, place=None):
@@ -191,6 +212,7 @@ def helpers():
         "sidebar_entries": sidebar_entries,
         "get_stats": stats.get_stats,
         "get_stat": stats.get_stat,
+        "compute_stats": stats.compute_all,
         "today": datetime.datetime.today(),
         "yesterday": datetime.datetime.today() - datetime.timedelta(days=1),
         "get_site_title": get_site_title,
@@ -9,28 +9,46 @@ following files as input.
 * pb.txt - TSV file containing AC code, PB code and PB name for each Polling Booth in the state.
 """
 import os, sys
+import datetime
 import re
 import logging
-from .models import db, Place, PlaceType, Member
+import hashlib
+import multiprocessing
+import time
+from cStringIO import StringIO
+from .models import (db, Place, PlaceType, Member, Document, PlaceCounters, DailyRollup,
+                     rebuild_place_parents, check_place_parents)
+from .core import placeindex
 
 logger = logging.getLogger("cleansweep.loaddata")
 
 
 class Loader:
     """Utility to load places from cleansweep data dir.
+
+    When diff is True, a snapshot of every file loaded is stored in the
+    document store with the hash of the file and of each row. A file that
+    has not changed since the last load is skipped and, for the others,
+    only the rows that are new or changed are loaded. This assumes that
+    the places are not modified in the database by other means.
     """
-    def __init__(self, root):
+    def __init__(self, root, diff=False):
         self.root = root
+        self.diff = diff
         self.place_cache = {}
 
     def is_valid_file(self, filename):
         return "-" in filename and filename.endswith(".txt")
 
-    def load(self):
+    def load(self, jobs=1):
         """Loads all places specified in the data.
+
+        The places of the sub directories of the root, usually one per
+        state, are loaded in parallel using jobs processes.
         """
         self.load_levels()
-        self.load_dir(self.root)
+        self.load_dir(self.root, jobs=jobs)
+        self.check()
 
     def load_levels(self, path=None):
         """Loads the levels from level.txt file.
@@ -48,8 +66,11 @@ class Loader:
             logger.info("adding level %s", t.name)
         db.session.commit()
 
-    def load_dir(self, dir):
+    def load_dir(self, dir, jobs=1):
         """Loads all files from the given dir.
+
+        The files of a directory are loaded in order, before the sub
+        directories as they have the parents of the places in there.
         """
         logger.info("loading dir %s", dir)
 
@@ -58,8 +79,40 @@ class Loader:
             self.load_file(os.path.join(dir, f))
 
         dirs = sorted(f for f in os.listdir(dir) if os.path.isdir(os.path.join(dir, f)))
-        for d in dirs:
-            self.load_dir(os.path.join(dir, d))
+        dirs = [os.path.join(dir, d) for d in dirs]
+        if jobs > 1 and len(dirs) > 1:
+            self.load_dirs_parallel(dirs, jobs)
+        else:
+            for d in dirs:
+                self.load_dir(d)
+
+    def load_dirs_parallel(self, dirs, jobs):
+        """Loads the dirs in parallel, each in a separate process.
+        """
+        # The workers must not share the database connections of this process
+        db.session.remove()
+        db.engine.dispose()
+
+        logger.info("loading %d dirs using %d processes", len(dirs), jobs)
+        start = time.time()
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker)
+        tasks = [(self.__class__, self.root, self.diff, d) for d in dirs]
+        try:
+            for i, d in enumerate(pool.imap_unordered(_load_dir_in_worker, tasks), 1):
+                logger.info("[%d/%d] loaded %s (%.1f seconds elapsed)", i, len(dirs), d, time.time() - start)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def check(self):
+        """Verifies that the place_parents table matches the hierarchy.
+        """
+        errors = check_place_parents()
+        if errors['missing'] or errors['extra']:
+            logger.error("place_parents is inconsistent, %(missing)d rows missing and %(extra)d extra rows", errors)
+        else:
+            logger.info("place_parents is consistent")
+        return errors
 
     def find_place_type(self, path):
         """Finds place type from path.
@@ -98,14 +151,30 @@ class Loader:
         self.place_cache.clear()
         place_type = self.find_place_type(path)
 
-        for rows in self.group(self.read_file(path), 1000):
-            self.load_places(place_type, rows)
+        if not self.diff:
+            self.load_rows(place_type, self.read_file(path))
+            return
+
+        snapshot = Snapshot(path)
+        if not snapshot.is_modified():
+            logger.info("%s is not modified since the last load, skipping", path)
+            return
+        rows = list(self.read_file(path))
+        changed_rows = snapshot.get_changed_rows(rows)
+        logger.info("%d of %d rows are new or changed", len(changed_rows), len(rows))
+        self.load_rows(place_type, changed_rows)
+        snapshot.save(rows)
+
+    def load_rows(self, place_type, rows):
+        for batch in self.group(rows, 1000):
+            self.load_places(place_type, batch)
 
     def load_places(self, place_type, rows):
         parent_keys = set(row[0] for row in rows)
         parents = self.get_places(parent_keys)
         places = self.get_places([row[1] for row in rows])
 
+        moved = []
         for parent_key, key, name in rows:
             if parent_key == "-":
                 parent = None
@@ -113,18 +182,23 @@ class Loader:
                 parent = parents[parent_key]
             place = places.get(key)
             if place:
-                logger.info("updating %r %r - %r", place_type.short_name, key, name)
                 if place.name != name:
+                    logger.info("renaming %r %r - %r", place_type.short_name, key, name)
                     place.name = name
                 if place.iparent != parent:
-                    logger.info("updating parent of %s to %s", key, parent.key)
-                    parent.add_place(place)
+                    logger.info("updating parent of %s to %s", key, parent_key)
+                    place.iparent = parent
+                    moved.append(place)
             else:
                 logger.info("adding %r %r - %r", place_type.short_name, key, name)
                 place = Place(key=key, name=name, type=place_type)
+                if parent:
+                    parent.add_place(place)
             db.session.add(place)
-            if parent:
-                parent.add_place(place)
+
+        # The places below the moved places get new parents too
+        db.session.flush()
+        rebuild_place_parents([p.id for p in moved])
         db.session.commit()
 
     def get_parent_place(self, key):
@@ -137,6 +211,132 @@ class Loader:
             self.place_cache[key] = place
         return self.place_cache[key]
 
+def _init_worker():
+    db.session.remove()
+    db.engine.dispose()
+
+def _load_dir_in_worker(args):
+    loader_class, root, diff, dir = args
+    try:
+        loader_class(root, diff=diff).load_dir(dir)
+    finally:
+        db.session.remove()
+    return dir
+
+class Snapshot:
+    """Snapshot of a data file when it was last loaded.
+
+    The snapshot is stored in the document store with the hash of the
+    file and the hash of each row by key.
+    """
+    TYPE = "loaddata-snapshot"
+
+    def __init__(self, path):
+        self.path = path
+        self.doc = Document.find("loaddata:" + os.path.abspath(path), type=self.TYPE)
+        self.data = self.doc.data if self.doc else {}
+        with open(path) as f:
+            self.sha1 = hashlib.sha1(f.read()).hexdigest()
+
+    def is_modified(self):
+        return self.data.get("sha1") != self.sha1
+
+    def _hash_row(self, row):
+        return hashlib.sha1(u"\t".join(row).encode("utf-8")).hexdigest()[:16]
+
+    def get_changed_rows(self, rows):
+        """Returns the rows that are new or changed since the snapshot.
+        """
+        hashes = self.data.get("rows", {})
+        return [row for row in rows if hashes.get(row[1]) != self._hash_row(row)]
+
+    def save(self, rows):
+        doc = self.doc or Document("loaddata:" + os.path.abspath(self.path), self.TYPE)
+        doc.data = {
+            "sha1": self.sha1,
+            "rows": dict((row[1], self._hash_row(row)) for row in rows)
+        }
+        doc.save()
+
+class BulkLoader(Loader):
+    """Loader that loads each file using a few SQL statements.
+
+    The rows of the file are copied to a temporary table using COPY and
+    the places and their place_parents rows are added from there with
+    set-based statements, instead of adding the places one by one using
+    the ORM.
+
+    The parents of the places in a file must be loaded before loading
+    that file, which is the case when the files are loaded level by level.
+    """
+    def load_rows(self, place_type, rows):
+        self.load_places(place_type, rows)
+        db.session.commit()
+        placeindex.invalidate()
+
+    def _escape(self, value):
+        # escape the special characters of the COPY text format
+        for c, replacement in [("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r")]:
+            value = value.replace(c, replacement)
+        return value
+
+    def copy_rows(self, rows):
+        """Copies the rows to a temporary table place_staging.
+        """
+        db.session.execute(
+            "CREATE TEMPORARY TABLE place_staging (parent_key text, key text, name text)"
+            + " ON COMMIT DROP")
+        f = StringIO()
+        for row in rows:
+            line = u"\t".join(self._escape(v) for v in row) + u"\n"
+            f.write(line.encode("utf-8"))
+        f.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert("COPY place_staging (parent_key, key, name) FROM STDIN", f)
+        db.session.execute("ANALYZE place_staging")
+
+    def load_places(self, place_type, rows):
+        self.copy_rows(rows)
+
+        missing = db.session.execute(
+            "SELECT DISTINCT s.parent_key FROM place_staging s"
+            + " WHERE s.parent_key != '-'"
+            + "   AND NOT EXISTS (SELECT 1 FROM place WHERE place.key=s.parent_key)"
+            + " LIMIT 10").fetchall()
+        if missing:
+            raise ValueError("Places not found: " + ", ".join(row[0] for row in missing))
+
+        result = db.session.execute(
+            "UPDATE place SET name=s.name"
+            + " FROM place_staging s"
+            + " WHERE place.key=s.key AND place.name != s.name")
+        logger.info("renamed %d places", result.rowcount)
+
+        # places whose parent has changed
+        moved = db.session.execute(
+            "UPDATE place SET iparent_id=parent.id"
+            + " FROM place_staging s LEFT JOIN place parent ON parent.key=s.parent_key"
+            + " WHERE place.key=s.key AND place.iparent_id IS DISTINCT FROM parent.id"
+            + " RETURNING place.id").fetchall()
+        logger.info("moved %d places", len(moved))
+        rebuild_place_parents([row[0] for row in moved])
+
+        # add the new places along with their place_parents rows, which are
+        # the place itself and all the parents of its parent.
+        result = db.session.execute(
+            "WITH new_place AS ("
+            + "     INSERT INTO place (key, name, type_id, iparent_id)"
+            + "     SELECT s.key, s.name, :type_id, parent.id"
+            + "     FROM place_staging s LEFT JOIN place parent ON parent.key=s.parent_key"
+            + "     WHERE NOT EXISTS (SELECT 1 FROM place WHERE place.key=s.key)"
+            + "     RETURNING id, iparent_id)"
+            + " INSERT INTO place_parents (parent_id, child_id)"
+            + " SELECT id, id FROM new_place"
+            + " UNION ALL"
+            + " SELECT pp.parent_id, n.id FROM new_place n JOIN place_parents pp ON pp.child_id=n.iparent_id",
+            dict(type_id=place_type.id))
+        logger.info("added %d place_parents rows", result.rowcount)
+
 cache = {}
 def find_place(key):
     """Cached implementation of Place.find.
@@ -152,22 +352,26 @@ def add_member(place_key, name, email, phone):
         sys.exit(1)
 
     place.add_member(name, email, phone)
+    PlaceCounters.increment(place.id, members=1)
+    DailyRollup.increment(place.id, "members", datetime.date.today())
     db.session.commit()
 
-def main(root_dir):
-    FORMAT = "%(asctime)-15s [%(levelname)s] %(message)s"
+def main(root_dir, bulk=False, diff=False, jobs=1):
+    FORMAT = "%(asctime)-15s [%(process)d] [%(levelname)s] %(message)s"
     logging.basicConfig(level=logging.INFO, format=FORMAT)
 
     db.create_all()
-    loader = Loader(root_dir)
-    loader.load()
+    loader_class = BulkLoader if bulk else Loader
+    loader = loader_class(root_dir, diff=diff)
+    loader.load(jobs=jobs)
 
-def main_loadfiles(filenames):
+def main_loadfiles(filenames, bulk=False, diff=False):
     FORMAT = "%(asctime)-15s [%(levelname)s] %(message)s"
     logging.basicConfig(level=logging.INFO, format=FORMAT)
 
     db.create_all()
-    loader = Loader(None)
+    loader_class = BulkLoader if bulk else Loader
+    loader = loader_class(None, diff=diff)
     for f in filenames:
         loader.load_file(f)
 
@@ -194,16 +398,6 @@ def read_user_info():
     phone = xinput("Phone number (10 digits)", "^[0-9]+$")
     return name, email, phone
 
-def update_parents(key):
-    """Updates parents of all places below the specified key.
-
-    This is used when parents are not in sync for whatever reason.
-    This is really a quick fix rather than a utility.
-    """
-    place = Place.find(key=key)
-    place.update_parents_of_all_children()
-    db.session.commit()
-
 def init():
     # create database tables
     db.create_all()
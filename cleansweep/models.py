@@ -1,14 +1,18 @@
+import base64
 import datetime
 import hashlib
 import itertools
+import json
+import re
 from collections import defaultdict
 from flask.ext.sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSON, JSONB
 from sqlalchemy.sql.expression import func
-from sqlalchemy import text
+from sqlalchemy import text, event, DDL
+from sqlalchemy.orm import Session, attributes, contains_eager
 from sqlalchemy.orm.attributes import flag_modified
 from .app import app
-from .core import cache
+from .core import placeindex, memberindex
 import uuid
 
 db = SQLAlchemy(app)
@@ -35,6 +39,140 @@ class ComparableMixin:
   def __le__(self, other):
     return not other<self
 
+class Page(list):
+    """A page of rows returned by keyset pagination.
+
+    Behaves like a list of rows. The `next` attribute is an opaque cursor
+    to get the next page, or None when this is the last page. The `after`
+    attribute is the cursor that was used to get this page.
+    """
+    def __init__(self, rows, next=None, after=None):
+        list.__init__(self, rows)
+        self.next = next
+        self.after = after
+
+def encode_cursor(value):
+    """Encodes the value of the sort key as an opaque cursor string.
+    """
+    return base64.urlsafe_b64encode(json.dumps(value)).rstrip("=")
+
+def decode_cursor(cursor):
+    """Decodes the cursor created by encode_cursor.
+
+    Returns None if the cursor is not valid.
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        value = json.loads(base64.urlsafe_b64decode(str(cursor) + padding))
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if isinstance(value, (int, long, basestring)):
+        return value
+
+def paginate(query, column, limit, after=None, descending=False, offset=0):
+    """Returns a Page of rows from the query, ordered by the column.
+
+    Instead of using offset, the rows are picked after the cursor, which
+    is the value of the column in the last row of the previous page. The
+    column must be unique, like the primary key. With an index on it,
+    every page is equally fast to get, irrespective of how deep it is.
+
+    The offset is supported only for compatibility with older callers.
+    """
+    value = decode_cursor(after) if after else None
+    if value is not None:
+        query = query.filter(column < value if descending else column > value)
+
+    order = column.desc() if descending else column
+    query = query.order_by(order)
+    if offset:
+        query = query.offset(offset)
+
+    # fetch one extra row to find if there is a next page
+    rows = query.limit(limit + 1).all()
+    next = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next = encode_cursor(getattr(rows[-1], column.key))
+    return Page(rows, next=next, after=after)
+
+def count_by_parent(place_id_column, parent_ids, *criteria):
+    """Counts the rows at or below each of the given places in a single
+    query.
+
+    The place_id_column is the place column of the table to count, like
+    Member.place_id. Additional filter criteria can be passed. Returns a
+    dict with the count for each of the parent_ids.
+
+        count_by_parent(Member.place_id, [p.id for p in place.child_places])
+    """
+    counts = dict.fromkeys(parent_ids, 0)
+    if parent_ids:
+        q = (db.session.query(place_parents.c.parent_id, func.count(place_id_column))
+            .filter(
+                place_parents.c.child_id == place_id_column,
+                place_parents.c.parent_id.in_(parent_ids),
+                *criteria)
+            .group_by(place_parents.c.parent_id))
+        counts.update(q.all())
+    return counts
+
+def stream(query, batch_size=1000):
+    """Returns an iterator over the results of the query.
+
+    The rows are fetched in batches of batch_size using a server-side
+    cursor. So the whole result is read using a single query, without
+    holding all the rows in memory at once.
+
+    The session must not be committed while the iteration is in progress
+    as that closes the cursor.
+    """
+    return iter(query.yield_per(batch_size))
+
+
+# a query made of only these characters is treated as a phone number
+PHONE_QUERY_RE = re.compile(r"^\+?[0-9 ()-]+$")
+
+def _escape_like(value):
+    # backslash is the default escape character of LIKE in postgres
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search_members_query(place_id, query):
+    """Returns a query to search the members at or below a place by name,
+    email or phone number, best matches first.
+
+    The name and email are matched anywhere in the normalized (lowercase)
+    value. A query that looks like a phone number is matched as a prefix
+    of the phone number, ignoring anything other than the digits. All the
+    three are served by the trigram indexes on the normalized columns.
+
+    The members whose name starts with the query come first, then the
+    ones with the most similar name or email.
+    """
+    q = query.strip().lower()
+    name = func.lower(Member.name)
+    email = func.lower(Member.email)
+    pattern = "%" + _escape_like(q) + "%"
+    conditions = [name.like(pattern), email.like(pattern)]
+    order = []
+
+    digits = re.sub(r"[^0-9]", "", q)
+    if len(digits) >= 3 and PHONE_QUERY_RE.match(q):
+        phone = func.regexp_replace(Member.phone, "[^0-9]", "", "g")
+        conditions.append(phone.like(digits + "%"))
+        order.append((phone == digits).desc())
+
+    order += [
+        name.like(_escape_like(q) + "%").desc(),
+        func.greatest(func.similarity(name, q), func.similarity(email, q)).desc(),
+        Member.id]
+    return (Member.query
+        .filter(
+            place_parents.c.child_id == Member.place_id,
+            place_parents.c.parent_id == place_id,
+            db.or_(*conditions))
+        .order_by(*order))
+
 class PlaceType(db.Model, ComparableMixin):
     """There are different types of places in the hierarchy like
     country, state, region etc. This table captures that.
@@ -89,11 +227,88 @@ class PlaceType(db.Model, ComparableMixin):
 # The place_parents table stores the parent-child relation
 # of places. For convenience, we also store a place as parent of it self.
 # That makes it easier to run queries over the subtree, including that place.
+# The primary key serves the subtree queries (parent_id=X joined on child_id)
+# from the index alone and the other index does the same for the ancestors.
 place_parents = db.Table('place_parents',
-    db.Column('parent_id', db.Integer, db.ForeignKey('place.id'), index=True),
-    db.Column('child_id', db.Integer, db.ForeignKey('place.id'), index=True)
+    db.Column('parent_id', db.Integer, db.ForeignKey('place.id'), primary_key=True),
+    db.Column('child_id', db.Integer, db.ForeignKey('place.id'), primary_key=True),
+    db.Index('ix_place_parents_child_id_parent_id', 'child_id', 'parent_id')
 )
 
+# Maximum depth followed by the recursive queries over iparent_id. The
+# hierarchy is only a few levels deep, this only stops the queries from
+# running forever when the data has a cycle.
+MAX_PLACE_DEPTH = 100
+
+def place_closure_ctes(roots=None):
+    """Returns the WITH clause of the recursive queries over the hierarchy.
+
+    It defines subtree(id), the places selected by the roots query and all
+    the places below them, or all the places when roots is None, and
+    closure(parent_id, child_id), the place_parents rows expected for the
+    places in subtree. The rows may be repeated when the hierarchy has a
+    cycle.
+    """
+    if roots is None:
+        subtree = "subtree(id) AS (SELECT id FROM place)"
+    else:
+        subtree = ("subtree(id, depth) AS ("
+            + "     SELECT id, 0 FROM place WHERE id IN (" + roots + ")"
+            + "     UNION ALL"
+            + "     SELECT p.id, s.depth + 1 FROM place p JOIN subtree s ON p.iparent_id=s.id"
+            + "     WHERE s.depth < {})".format(MAX_PLACE_DEPTH))
+    return ("WITH RECURSIVE " + subtree + ","
+        + " closure(parent_id, child_id, depth) AS ("
+        + "     SELECT id, id, 0 FROM subtree"
+        + "     UNION ALL"
+        + "     SELECT p.iparent_id, c.child_id, c.depth + 1 FROM closure c JOIN place p ON p.id=c.parent_id"
+        + "     WHERE p.iparent_id IS NOT NULL AND c.depth < {})".format(MAX_PLACE_DEPTH))
+
+def rebuild_place_parents(place_ids):
+    """Recomputes the place_parents rows of the given places and all the
+    places below them from the iparent_id column.
+
+    This is used after changing the parent of places using SQL. The caller
+    is responsible to call db.session.commit().
+    """
+    if not place_ids:
+        return
+    ctes = place_closure_ctes("SELECT id FROM place WHERE id IN :place_ids")
+    params = dict(place_ids=tuple(place_ids))
+    db.session.execute(
+        ctes + " DELETE FROM place_parents WHERE child_id IN (SELECT id FROM subtree)",
+        params)
+    db.session.execute(
+        "INSERT INTO place_parents (parent_id, child_id) "
+        + ctes + " SELECT DISTINCT parent_id, child_id FROM closure",
+        params)
+
+def check_place_parents(root_id=None):
+    """Compares the place_parents table with the hierarchy computed from
+    the iparent_id column, for all the places or only the places in the
+    subtree of root_id.
+
+    Returns a dict with the number of missing and extra rows in the
+    place_parents table.
+    """
+    if root_id is None:
+        ctes = place_closure_ctes()
+    else:
+        ctes = place_closure_ctes("SELECT CAST(:root_id AS integer)")
+    q = (ctes
+        + " SELECT"
+        + "   (SELECT count(*) FROM ("
+        + "       SELECT parent_id, child_id FROM closure"
+        + "       EXCEPT SELECT parent_id, child_id FROM place_parents"
+        + "              WHERE child_id IN (SELECT id FROM subtree)) missing),"
+        + "   (SELECT count(*) FROM ("
+        + "       SELECT parent_id, child_id FROM place_parents"
+        + "       WHERE child_id IN (SELECT id FROM subtree)"
+        + "       EXCEPT SELECT parent_id, child_id FROM closure) extra)")
+    missing, extra = db.session.execute(q, dict(root_id=root_id)).fetchone()
+    return dict(missing=missing, extra=extra)
+
+
 class Place(db.Model, Mixable):
     __tablename__ = "place"
 
@@ -133,7 +348,21 @@ class Place(db.Model, Mixable):
 
     @staticmethod
     def find(key):
-        return Place.query.filter_by(key=key).first()
+        # The key column is not indexed. Use the place index to find
+        # the id and get the place by primary key.
+        id = placeindex.get_index().get_id(key)
+        place = id and Place.query.get(id)
+        return place or Place.query.filter_by(key=key).first()
+
+    @staticmethod
+    def get_many(ids):
+        """Returns places with the given ids, in the same order.
+        """
+        if not ids:
+            return []
+        places = Place.query.filter(Place.id.in_(ids)).all()
+        d = dict((p.id, p) for p in places)
+        return [d[id] for id in ids if id in d]
 
     @staticmethod
     def get_toplevel_places():
@@ -170,42 +399,37 @@ class Place(db.Model, Mixable):
     def get_member_count(self):
         return self.get_all_members_query().count()
 
-    def get_all_members(self, limit=100, offset=0):
+    def get_all_members(self, limit=100, offset=0, after=None):
         """Returns all members any this place or any place below this place.
+
+        The members are ordered by id. The returned value is a Page and
+        its next attribute can be passed as after to get the next page.
         """
-        return self.get_all_members_query().limit(limit).offset(offset).all()
+        q = self.get_all_members_query()
+        return paginate(q, Member.id, limit, after=after, offset=offset)
 
-    def get_all_members_iter(self):
+    def get_all_members_iter(self, batch_size=1000):
         """Returns all members any this place as an iterator.
+
+        All the members are read using a single query on a server-side
+        cursor, ordered by id. The place of each member is loaded in the
+        same query.
         """
-        limit = 1000
-        offset = 0
-        size = limit
-        while size == limit:
-            members = self.get_all_members(limit=limit, offset=offset)
-            size = len(members)
-            offset = offset + size
-            for m in members:
-                yield m
+        q = (self.get_all_members_query()
+                .join(Member.place)
+                .options(contains_eager(Member.place))
+                .order_by(Member.id))
+        return stream(q, batch_size)
 
 
     def search_members(self, q, limit=10):
-        """Searches for members from this place with given query string
-        matching either name, email or phone number.
-        """
-        q = q.lower()
-        # SQLAlchemy I hate you
-        sql = text("""SELECT member.* FROM member
-            JOIN place_parents ON place_parents.child_id = member.place_id
-            JOIN place ON place.id = place_parents.parent_id
-            WHERE member.place_id = place.id
-                AND
-                    (lower(member.name) LIKE :q || :percent
-                    OR lower(member.email) LIKE :q || :percent
-                    OR lower(member.phone) LIKE :q || :percent)
-            LIMIT 10
-            """)
-        return db.engine.execute(sql, q=q, percent='%')
+        """Searches for members at or below this place with given query
+        string matching either name, email or phone number.
+
+        Used by the autocomplete. See search_members_query for how the
+        members are matched and ranked.
+        """
+        return search_members_query(self.id, q).limit(limit).all()
 
     def search_all_members(self, query, limit=10):
         """
@@ -213,18 +437,34 @@ class Place(db.Model, Mixable):
         :param query: search query
         :return: List of object Member
         """
-        like_q = "%{0}%".format(query.lower())
-        q1 = Member.query.filter(
-            place_parents.c.child_id == Member.place_id,
-            place_parents.c.parent_id == self.id,
-            (func.lower(Member.name).like(like_q) | Member.phone.like(like_q) | func.lower(Member.email).like(
-                like_q))).limit(limit)
-        return q1.all()
+        return search_members_query(self.id, query).limit(limit).all()
 
     @property
     def parents(self):
         # return all parents except self
-        return [p for p in self._parents if self.id != p.id]
+        index = placeindex.get_index()
+        if self.id not in index:
+            # not yet in the index, may be added very recently
+            return [p for p in self._parents if self.id != p.id]
+
+        # The templates access parents many times in a request. Remember
+        # them as long as the index doesn't change.
+        cached = getattr(self, "_cached_parents", None)
+        if cached is None or cached[0] is not index:
+            cached = (index, Place.get_many(index.get_ancestor_ids(self.id)))
+            self._cached_parents = cached
+        return list(cached[1])
+
+    @property
+    def parent_keys(self):
+        """Keys of all parents, starting from the top-level place.
+
+        Unlike parents, this doesn't query the database.
+        """
+        index = placeindex.get_index()
+        if self.id not in index:
+            return [p.key for p in self.parents]
+        return index.get_ancestor_keys(self.id)
 
     def get_parent_names_by_type(self):
         """Returns names of all parents, including self mapping to their type.
@@ -239,8 +479,14 @@ class Place(db.Model, Mixable):
                 "PB": "PB0001 - yyy"
             }
         """
-        parents = self.parents + [self]
-        return {p.type.short_name: p.name for p in parents}
+        index = placeindex.get_index()
+        if self.id not in index:
+            parents = self.parents + [self]
+            return {p.type.short_name: p.name for p in parents}
+
+        ids = index.get_ancestor_ids(self.id) + [self.id]
+        rows = db.session.query(Place.id, Place.name).filter(Place.id.in_(ids)).all()
+        return {index.get_type_name(id): name for id, name in rows}
 
     @staticmethod
     def bulkload_parent_names(place_ids):
@@ -285,6 +531,15 @@ class Place(db.Model, Mixable):
     def get_parent(self, type):
         """Returns parent place of given type.
         """
+        index = placeindex.get_index()
+        if self.id in index:
+            if isinstance(type, basestring):
+                type_id = index.get_type_id_by_name(type)
+            else:
+                type_id = type and type.id
+            parent_id = index.get_ancestor_id_of_type(self.id, type_id)
+            return parent_id and Place.query.get(parent_id)
+
         if isinstance(type, basestring):
             type = PlaceType.get(type)
         try:
@@ -293,6 +548,9 @@ class Place(db.Model, Mixable):
             return None
 
     def has_parent(self, parent):
+        index = placeindex.get_index()
+        if self.id in index and parent.id in index:
+            return index.is_within(self.id, parent.id)
         return parent in self._parents
 
     def get_places(self, type=None):
@@ -323,12 +581,41 @@ class Place(db.Model, Mixable):
 
     def update_parents_of_all_children(self):
         """Updates the parents of all locations below this place.
+
+        The place_parents rows of this place and all the places below it
+        are recomputed from iparent_id using SQL, without loading the
+        places.
+
+        The caller is responsible to call db.session.commit().
+        """
+        db.session.flush()
+        rebuild_place_parents([self.id])
+
+    def move_to(self, parent):
+        """Moves this place, along with all the places below it, to be an
+        immediate child of the given parent.
+
+        The caller is responsible to call db.session.commit().
+        """
+        if parent.id == self.id or parent.has_parent(self):
+            raise ValueError("Can't move {} below itself".format(self.key))
+        self.iparent = parent
+        db.session.add(self)
+        db.session.flush()
+        rebuild_place_parents([self.id])
+        # the _parents loaded in the session are outdated now
+        db.session.expire(self, ["_parents"])
+        self._cached_parents = None
+
+    def verify_parents(self):
+        """Verifies the place_parents rows of this place and all the places
+        below it.
+
+        Returns a dict with the number of missing and extra rows, which
+        are both zero when the rows are correct.
         """
-        child_places = self.get_all_child_places(None)
-        for p in child_places:
-            print "** updating", p.key
-            p._parents = self._parents + [p]
-            db.session.add(p)
+        db.session.flush()
+        return check_place_parents(self.id)
 
     def get_siblings(self):
         parents = sorted(self.parents, key=lambda p: p.type.level)
@@ -377,19 +664,16 @@ class Place(db.Model, Mixable):
         db.session.add(pending_member)
         return pending_member
 
-    def get_pending_members(self, status='pending', limit=100, offset=0):
-        """Returns all the pending signups below this place.
+    def get_pending_members(self, status='pending', limit=100, offset=0, after=None):
+        """Returns all the pending signups below this place, latest first.
         """
-        return (PendingMember
+        q = (PendingMember
                 .query
                 .filter_by(status=status)
                 .filter(
                     PendingMember.place_id==place_parents.c.child_id,
-                    place_parents.c.parent_id==self.id)
-                .order_by(PendingMember.timestamp.desc())
-                .limit(limit)
-                .offset(offset)
-                .all())
+                    place_parents.c.parent_id==self.id))
+        return paginate(q, PendingMember.id, limit, after=after, descending=True, offset=offset)
 
     def get_pending_members_count(self, status='pending'):
         """Returns all the pending signups count below this place.
@@ -417,11 +701,13 @@ class Place(db.Model, Mixable):
         db.session.add_all(contacts)
         return contacts
 
-    def get_contacts(self, limit=100, offset=0):
-        return (Contact.query.filter(
+    def get_contacts(self, limit=100, offset=0, after=None):
+        """Returns a Page of contacts at or below this place, ordered by id.
+        """
+        q = Contact.query.filter(
                     place_parents.c.child_id==Contact.place_id,
                     place_parents.c.parent_id==self.id)
-                .limit(limit).offset(offset).all())
+        return paginate(q, Contact.id, limit, after=after, offset=offset)
 
     def get_contact(self, contact_id):
         return (Contact.query.filter(
@@ -435,18 +721,22 @@ class Place(db.Model, Mixable):
                     place_parents.c.child_id==Contact.place_id,
                     place_parents.c.parent_id==self.id).count()
 
-    def get_contacts_iter(self):
-        """Returns all members any this place as an iterator.
+    def get_contacts_iter(self, batch_size=1000):
+        """Returns all contacts any this place as an iterator.
+
+        All the contacts are read using a single query on a server-side
+        cursor, ordered by id. The place of each contact is loaded in the
+        same query, so that Contact.dict() doesn't need another query for
+        the key.
         """
-        limit = 1000
-        offset = 0
-        size = limit
-        while size == limit:
-            contacts = self.get_contacts(limit=limit, offset=offset)
-            size = len(contacts)
-            offset = offset + size
-            for c in contacts:
-                yield c
+        q = (Contact.query
+                .join(Contact.place)
+                .options(contains_eager(Contact.place))
+                .filter(
+                    place_parents.c.child_id==Contact.place_id,
+                    place_parents.c.parent_id==self.id)
+                .order_by(Contact.id))
+        return stream(q, batch_size)
 
     def add_door2door_entry(self, name, voters_in_family, phone, town, donation=None, created=None, **details):
         """
@@ -456,23 +746,31 @@ class Place(db.Model, Mixable):
         db.session.add(entry)
         return entry
 
-    def get_door2door_entries(self, limit=100, offset=0):
-        return Door2DoorEntry.query.filter(place_parents.c.child_id == Door2DoorEntry.place_id,
-                                           place_parents.c.parent_id == self.id).order_by(
-            Door2DoorEntry.created.desc()).limit(
-            limit).offset(offset).all()
+    def get_door2door_entries(self, limit=100, offset=0, after=None):
+        """Returns a Page of door2door entries below this place, latest first.
+
+        The entries are ordered by id as the created column is not always
+        filled and can not be used as a cursor.
+        """
+        q = Door2DoorEntry.query.filter(place_parents.c.child_id == Door2DoorEntry.place_id,
+                                        place_parents.c.parent_id == self.id)
+        return paginate(q, Door2DoorEntry.id, limit, after=after, descending=True, offset=offset)
 
     def get_door2door_count(self):
         return Door2DoorEntry.query.filter(place_parents.c.child_id == Door2DoorEntry.place_id,
                                            place_parents.c.parent_id == self.id).count()
 
-    def get_door2door_count_cached(self, force_update=False):
-        key = "get_door2door_count.{}".format(self.key)
-        value = cache.get(key)
-        if not value or force_update:
-            value = self.get_door2door_count()
-            cache.set(key, value, expiry=360)
-        return value
+    @property
+    def counters(self):
+        """The PlaceCounters of this place.
+        """
+        return PlaceCounters.get(self)
+
+    def get_pending_signups_count(self):
+        """Returns the number of pending signups below this place, from the
+        counters.
+        """
+        return self.counters.pending_signups
 
     def __eq__(self, other):
         return isinstance(other, Place) and self.id == other.id
@@ -496,6 +794,223 @@ class Place(db.Model, Mixable):
         }
 
 
+# Columns of place used by the place index
+PLACE_INDEX_COLUMNS = ["key", "iparent_id", "iparent", "type_id", "type"]
+PLACE_INDEX_KEY = "placeindex.invalidate"
+
+@event.listens_for(Session, "after_flush")
+def _record_place_changes(session, flush_context):
+    """Marks the place index for invalidation when places are added,
+    removed or moved, or when their key or type is changed. Other changes
+    like renames don't affect the index.
+    """
+    def is_modified(obj):
+        if isinstance(obj, PlaceType):
+            return True
+        return isinstance(obj, Place) and any(
+            attributes.get_history(obj, name).has_changes() for name in PLACE_INDEX_COLUMNS)
+
+    if (any(isinstance(obj, (Place, PlaceType)) for obj in session.new)
+            or any(isinstance(obj, (Place, PlaceType)) for obj in session.deleted)
+            or any(is_modified(obj) for obj in session.dirty)):
+        session.info[PLACE_INDEX_KEY] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_place_index(session):
+    if session.info.pop(PLACE_INDEX_KEY, False):
+        placeindex.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_place_changes(session):
+    session.info.pop(PLACE_INDEX_KEY, None)
+
+
+class PlaceCounters(db.Model):
+    """Number of members, contacts, door2door entries and pending signups
+    at a place and all the places below it.
+
+    Counting them every time requires a join over place_parents, which is
+    slow for large places. The counters are incremented using increment
+    whenever the records are added or deleted, and the dashboard reads
+    them by primary key.
+
+    There is a row for every place having any records, the places without
+    a row have all the counters as zero. The rows are created by increment
+    in the same transaction as the change of the records, so that the
+    counters are committed or rolled back along with it. They must be
+    rebuilt using `manage.py rebuild-counters` after modifying the records
+    directly in the database.
+    """
+    __tablename__ = "place_counters"
+
+    NAMES = ["members", "contacts", "door2door", "pending_signups"]
+
+    place_id = db.Column(db.Integer, db.ForeignKey("place.id"), primary_key=True)
+    members = db.Column(db.Integer, nullable=False, default=0)
+    contacts = db.Column(db.Integer, nullable=False, default=0)
+    door2door = db.Column(db.Integer, nullable=False, default=0)
+    pending_signups = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def get(cls, place):
+        """Returns the counters of the given place.
+        """
+        return cls.query.get(place.id) or cls._zero(place.id)
+
+    @classmethod
+    def get_many(cls, places):
+        """Returns the counters of all the given places as a dict by place
+        id.
+        """
+        ids = [p.id for p in places]
+        if not ids:
+            return {}
+        counters = dict((c.place_id, c) for c in cls.query.filter(cls.place_id.in_(ids)))
+        return dict((id, counters.get(id) or cls._zero(id)) for id in ids)
+
+    @classmethod
+    def _zero(cls, place_id):
+        # not added to the session, the row is created by increment
+        return cls(place_id=place_id, **dict.fromkeys(cls.NAMES, 0))
+
+    @classmethod
+    def increment(cls, place_id, **deltas):
+        """Increments the counters of the place and all its parents.
+
+            PlaceCounters.increment(place.id, members=1, pending_signups=-1)
+
+        The counters are updated in the current transaction. The caller is
+        responsible to call db.session.commit() along with the change of
+        the records.
+        """
+        deltas = dict((name, delta) for name, delta in deltas.items() if delta)
+        if not deltas:
+            return
+        params = dict.fromkeys(cls.NAMES, 0)
+        params.update(deltas)
+        params['place_id'] = place_id
+        # a single upsert, so that the first increment of a place doesn't
+        # fail with a duplicate key when there are concurrent increments
+        db.session.execute(
+            "INSERT INTO place_counters (place_id, members, contacts, door2door, pending_signups)"
+            + " SELECT parent_id, :members, :contacts, :door2door, :pending_signups"
+            + " FROM place_parents WHERE child_id=:place_id"
+            + " ON CONFLICT (place_id) DO UPDATE SET "
+            + ", ".join("{0} = place_counters.{0} + EXCLUDED.{0}".format(name) for name in sorted(deltas)),
+            params)
+
+    @classmethod
+    def increment_many(cls, name, objects, delta=1):
+        """Increments the counter name for each of the given objects, at
+        the place of that object.
+        """
+        counts = defaultdict(int)
+        for obj in objects:
+            counts[obj.place.id] += delta
+        for place_id, count in counts.items():
+            cls.increment(place_id, **{name: count})
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes the counters of all the places in a single statement.
+        """
+        q = ("INSERT INTO place_counters (place_id, members, contacts, door2door, pending_signups)"
+            + " SELECT place.id,"
+            + "     coalesce(m.count, 0), coalesce(c.count, 0), coalesce(d.count, 0), coalesce(s.count, 0)"
+            + " FROM place"
+            + " LEFT JOIN ({}) m ON m.parent_id=place.id".format(cls._count_query("member"))
+            + " LEFT JOIN ({}) c ON c.parent_id=place.id".format(cls._count_query("contact"))
+            + " LEFT JOIN ({}) d ON d.parent_id=place.id".format(cls._count_query("door2door_entry"))
+            + " LEFT JOIN ({}) s ON s.parent_id=place.id".format(
+                cls._count_query("pending_member", "status='pending'")))
+        db.session.execute("DELETE FROM place_counters")
+        db.session.execute(q)
+        db.session.commit()
+
+    @staticmethod
+    def _count_query(table, condition="true"):
+        return ("SELECT p.parent_id, count(*) as count"
+            + " FROM {0}, place_parents p"
+            + " WHERE {0}.place_id=p.child_id AND {1}"
+            + " GROUP BY p.parent_id").format(table, condition)
+
+
+class DailyRollup(db.Model):
+    """Number of records added per day at a place and all the places
+    below it, for each metric.
+
+    This is used to draw the timeseries graphs of stats without grouping
+    the records of the whole subtree on every request. The rows are
+    updated using increment whenever a record is added or deleted and can
+    be recomputed using `manage.py rebuild-rollups`.
+    """
+    __tablename__ = "daily_rollup"
+
+    place_id = db.Column(db.Integer, db.ForeignKey("place.id"), primary_key=True)
+    metric = db.Column(db.Text, primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # metric -> (table, date expression, condition) used to rebuild the rollups
+    METRICS = {
+        "members": ("member", "member.created::date", "member.created IS NOT NULL"),
+        "door2door": ("door2door_entry", "door2door_entry.created_date", "door2door_entry.created_date IS NOT NULL"),
+    }
+
+    @classmethod
+    def get_timeseries(cls, place, metric):
+        """Returns the counts of the metric per day as a list of dicts with
+        date and count, ordered by date.
+        """
+        q = (db.session.query(cls.date, cls.count)
+            .filter_by(place_id=place.id, metric=metric)
+            .order_by(cls.date))
+        return [dict(date=date, count=count) for date, count in q]
+
+    @classmethod
+    def increment(cls, place_id, metric, date, delta=1):
+        """Adds delta to the count of the metric on the given date at the
+        place and all its parents.
+
+        The caller is responsible to call db.session.commit().
+        """
+        if not date or not delta:
+            return
+        # a single upsert, so that concurrent increments of a new day
+        # don't fail with a duplicate key
+        db.session.execute(
+            "INSERT INTO daily_rollup (place_id, metric, date, count)"
+            + " SELECT parent_id, :metric, :date, :delta"
+            + " FROM place_parents WHERE child_id=:place_id"
+            + " ON CONFLICT (place_id, metric, date)"
+            + " DO UPDATE SET count = daily_rollup.count + EXCLUDED.count",
+            dict(place_id=place_id, metric=metric, date=date, delta=delta))
+
+    @classmethod
+    def increment_many(cls, metric, items, delta=1):
+        """Increments the metric for each of the (place_id, date) items.
+        """
+        counts = defaultdict(int)
+        for place_id, date in items:
+            counts[place_id, date] += delta
+        for (place_id, date), count in counts.items():
+            cls.increment(place_id, metric, date, count)
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes the rollups of all the metrics.
+        """
+        db.session.execute("DELETE FROM daily_rollup")
+        for metric, (table, date, condition) in cls.METRICS.items():
+            q = ("INSERT INTO daily_rollup (place_id, metric, date, count)"
+                + " SELECT p.parent_id, :metric, {1}, count(*)"
+                + " FROM {0}, place_parents p"
+                + " WHERE {0}.place_id=p.child_id AND {2}"
+                + " GROUP BY p.parent_id, {1}").format(table, date, condition)
+            db.session.execute(q, dict(metric=metric))
+        db.session.commit()
+
+
 class Stats(db.Model):
     """Model for storing stats for a place.
 
@@ -522,9 +1037,15 @@ class Member(db.Model):
     email = db.Column(db.Text)
     phone = db.Column(db.Text)
     voterid = db.Column(db.Text)
-    details = db.Column(JSON)
+    details = db.Column(JSONB)
     created = db.Column(db.DateTime, default=datetime.datetime.now)
 
+    # supports the containment queries on details, like finding by access token
+    __table_args__ = (
+        db.Index('member_details_idx', 'details', postgresql_using='gin', postgresql_ops={'details': 'jsonb_path_ops'}),
+        db.Index('ix_member_place_id_created', 'place_id', 'created'),
+    )
+
     def __init__(self, place, name, email, phone, voterid, details=None):
         self.name = name
         self.email = email
@@ -563,7 +1084,15 @@ class Member(db.Model):
         db.session.add(self)
 
     def has_access_token(self, token):
-        return self.details.get("access_token") == token
+        return bool(self.details) and self.details.get("access_token") == token
+
+    @staticmethod
+    def find_by_access_token(token):
+        """Returns the member with the given access token or None.
+        """
+        if not token:
+            return None
+        return Member.query.filter(Member.details.contains({"access_token": token})).first()
 
     def dict(self, include_details=False, include_place=False):
         d = {
@@ -601,6 +1130,44 @@ class Member(db.Model):
         key = str(self.id) + app.config['SECRET_KEY']
         return hashlib.md5(key).hexdigest()[:7]
 
+# The member index is updated after the commit with the values of the
+# members as of the flush. The models_committed signal of flask-sqlalchemy
+# can't be used here as it keeps only one change per primary key across all
+# the models.
+MEMBER_CHANGES_KEY = "memberindex.changes"
+
+@event.listens_for(Session, "after_flush")
+def _record_member_changes(session, flush_context):
+    changes = session.info.setdefault(MEMBER_CHANGES_KEY, {})
+    for obj in session.new:
+        if isinstance(obj, Member):
+            changes[obj.id] = memberindex.get_doc(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Member) and session.is_modified(obj):
+            changes[obj.id] = memberindex.get_doc(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Member):
+            changes[obj.id] = None
+
+@event.listens_for(Session, "after_commit")
+def _update_member_index(session):
+    changes = session.info.pop(MEMBER_CHANGES_KEY, None)
+    if changes:
+        memberindex.save_many(changes)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_member_changes(session):
+    session.info.pop(MEMBER_CHANGES_KEY, None)
+
+# Trigram indexes for search_members_query. These can't be specified in
+# __table_args__ as they are on expressions.
+event.listen(Member.__table__, "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+for _ddl in [
+        "CREATE INDEX member_name_trgm_idx ON member USING gin (lower(name) gin_trgm_ops)",
+        "CREATE INDEX member_email_trgm_idx ON member USING gin (lower(email) gin_trgm_ops)",
+        "CREATE INDEX member_phone_trgm_idx ON member USING gin (regexp_replace(phone, '[^0-9]', '', 'g') gin_trgm_ops)"]:
+    event.listen(Member.__table__, "after_create", DDL(_ddl).execute_if(dialect="postgresql"))
 
 class PendingMember(db.Model):
     __tablename__ = "pending_member"
@@ -665,6 +1232,11 @@ class Contact(db.Model):
     phone = db.Column(db.Text, index=True)
     voterid = db.Column(db.Text, index=True)
 
+    # contacts don't have a created column and are paged by id
+    __table_args__ = (
+        db.Index('ix_contact_place_id_id', 'place_id', 'id'),
+    )
+
     def __init__(self, place, name, email, phone, voterid):
         self.place = place
         self.name = name
@@ -697,7 +1269,12 @@ class Door2DoorEntry(db.Model):
     created_date = db.Column(db.Date, default=datetime.date.today, index=True)
 
     # any other optional details
-    details = db.Column(JSON)
+    details = db.Column(JSONB)
+
+    __table_args__ = (
+        db.Index('door2door_entry_details_idx', 'details', postgresql_using='gin', postgresql_ops={'details': 'jsonb_path_ops'}),
+        db.Index('ix_door2door_entry_place_id_created', 'place_id', 'created'),
+    )
 
     def __init__(self, place, name, voters_in_family, phone, town, donation, created, details=None):
         self.place = place
@@ -714,6 +1291,18 @@ class Door2DoorEntry(db.Model):
     def find(**kw):
         return Door2DoorEntry.query.filter_by(**kw).first()
 
+    @staticmethod
+    def campaign_filter(campaign_id):
+        """Returns a filter condition to select the entries of a campaign.
+
+        The campaign_id comes from the imported data, so it may have been
+        stored either as a string or as a number.
+        """
+        condition = Door2DoorEntry.details.contains({"campaign_id": campaign_id})
+        if campaign_id.isdigit():
+            condition = condition | Door2DoorEntry.details.contains({"campaign_id": int(campaign_id)})
+        return condition
+
     def get_hash(self):
         key = str(self.id) + app.config['SECRET_KEY']
         return hashlib.md5(key).hexdigest()[:7]
@@ -771,10 +1360,12 @@ class Document(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.Text, nullable=False, unique=True)
-    type = db.Column(db.Text, nullable=False)
+    type = db.Column(db.Text, nullable=False, index=True)
+    data = db.Column(JSONB)
 
-    # TODO: switch to JSONB and index on this column
-    data = db.Column(JSON)
+    __table_args__ = (
+        db.Index('document_data_idx', 'data', postgresql_using='gin', postgresql_ops={'data': 'jsonb_path_ops'}),
+    )
 
     def __init__(self, key, type, data=None):
         """Creates a new Document with specified key and type.
@@ -819,11 +1410,35 @@ class Document(db.Model):
         specified by keyword arguments.
 
             Document.search("user", email="alice@example.com")
+
+        A value matches when its text is the same, irrespective of whether
+        it is stored as a string or not, so 1 and "1" match each other.
         """
         q = Document.query.filter_by(type=type)
         for name, value in kw.items():
-            q = q.filter(Document.data[name].astext == value)
+            q = q.filter(db.or_(*[Document.data.contains({name: v})
+                                  for v in Document._get_json_values(value)]))
         return q.all()
 
+    @staticmethod
+    def _get_json_values(value):
+        """Returns the JSON values having the same text as value.
+
+        The @> operator used by search, unlike comparing the text, is
+        strict about the type of the value, but it can use the index on
+        data.
+        """
+        if not isinstance(value, basestring):
+            value = json.dumps(value)
+        values = [value]
+        try:
+            v = json.loads(value)
+        except ValueError:
+            pass
+        else:
+            if not isinstance(v, (basestring, list, dict)):
+                values.append(v)
+        return values
+
     def __repr__(self):
         return "<Document({!r})>".format(self.key)
@@ -1,7 +1,7 @@
 """Models to support audit trail.
 """
-from ...models import db, Place, place_parents
-from sqlalchemy.dialects.postgresql import JSON
+from ...models import db, Place, place_parents, paginate
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import desc, func
 import datetime
 
@@ -25,11 +25,15 @@ class Audit(db.Model):
     person_id = db.Column(db.Integer, db.ForeignKey('member.id'), index=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.now)
     url = db.Column(db.Text)
-    data = db.Column(JSON)
+    data = db.Column(JSONB)
 
     place = db.relationship('Place', backref=db.backref('audit_records', lazy='dynamic'), foreign_keys=[place_id])
     user = db.relationship('Member', backref=db.backref('activity', lazy='dynamic'), foreign_keys=[user_id])
 
+    __table_args__ = (
+        db.Index('ix_audit_place_id_timestamp', 'place_id', 'timestamp'),
+    )
+
     def __init__(self, action, user, place, person, timestamp, url, data):
         self.action = action
         self.user = user
@@ -41,7 +45,11 @@ class Audit(db.Model):
 
 @Place.mixin
 class AuditPlaceMixin(object):
-    def get_audit_records(self, action=None, limit=100, offset=0):
+    def get_audit_records(self, action=None, limit=100, offset=0, after=None):
+        """Returns a Page of audit records below this place, latest first.
+
+        The records are ordered by id as the timestamp is not always filled.
+        """
         q = Audit.query.filter(
                     place_parents.c.child_id==Audit.place_id,
                     place_parents.c.parent_id==self.id)
@@ -49,10 +57,7 @@ class AuditPlaceMixin(object):
         if action:
             q = q.filter_by(action=action)
 
-        return (q.order_by(desc(Audit.timestamp))
-                 .limit(limit)
-                 .offset(offset)
-                 .all())
+        return paginate(q, Audit.id, limit, after=after, descending=True, offset=offset)
 
     def get_audit_record_counts(self):
         q = (db.session.query(Audit.action, func.count(Audit.action))
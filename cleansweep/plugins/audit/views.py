@@ -18,14 +18,10 @@ def audit_trail(place):
     audit_counts = place.get_audit_record_counts()
 
     action = request.args.get("action")
-    page = h.safeint(request.args.get("page", 1), default=1, minvalue=1)
-    perpage = 100
-    offset = (page-1)*perpage
-    audit_records = place.get_audit_records(action=action, offset=offset, limit=perpage)
+    after = request.args.get("after")
+    audit_records = place.get_audit_records(action=action, after=after, limit=100)
     return render_template("audit.html",
             place=place,
             audit_records=audit_records,
             action=action,
-            page=page,
-            perpage=perpage,
             audit_counts=audit_counts)
\ No newline at end of file
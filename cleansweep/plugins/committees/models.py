@@ -379,6 +379,29 @@ class CommitteeMember(db.Model):
         self.role = role
         self.member = member
 
+    @staticmethod
+    def get_roles_of_member(member):
+        """Returns all the committee roles of the member as rows of
+        (place_key, committee_slug, role_id, role, permission).
+
+        Everything required to compute the roles is fetched in a single
+        query instead of loading the committee, place, role and committee
+        type of every membership separately.
+        """
+        return (db.session.query(
+                    Place.key,
+                    CommitteeType.slug,
+                    CommitteeRole.id,
+                    CommitteeRole.role,
+                    CommitteeRole.permission)
+                .select_from(CommitteeMember)
+                .join(Committee, CommitteeMember.committee_id == Committee.id)
+                .join(Place, Committee.place_id == Place.id)
+                .join(CommitteeType, Committee.type_id == CommitteeType.id)
+                .join(CommitteeRole, CommitteeMember.role_id == CommitteeRole.id)
+                .filter(CommitteeMember.member_id == member.id)
+                .all())
+
 
 @Place.mixin
 class CommitteePlaceMixin:
@@ -2,14 +2,15 @@ import json
 
 from ...plugin import Plugin
 from ...core import rbac
-from ...models import db, Member, PlaceType, Place
-from .models import CommitteeRole, CommitteeType
+from ...core.permissions import PermissionGroup, invalidate_user_permissions
+from ...models import db, Member, PlaceType, Place, stream
+from .models import CommitteeRole, CommitteeType, CommitteeMember
 from flask import (flash, request, Response, make_response, render_template, redirect, url_for, abort, jsonify)
 from . import forms
 from . import signals, notifications, audits
-from ...view_helpers import require_permission
+from ...view_helpers import require_permission, export_response, export_download
+from ...core import exporter, exportjobs
 from collections import defaultdict
-import tablib
 
 plugin = Plugin("committees", __name__, template_folder="templates")
 
@@ -33,19 +34,30 @@ def init_app(app):
 
 @rbac.role_provider
 def get_user_roles(user):
-    """Returns permission of a role.
+    """Returns roles of the user from the committees the user is member of.
+
+    The permissions of each role are resolved here, using one query for
+    all the memberships and one for all the permission groups, so that
+    get_role_permission doesn't need to query again for every role.
     """
     if not user:
-        return
-    committee_member_objects = user.committees.all()
-    for cm in committee_member_objects:
-        place = cm.committee.place
-        yield {
-            "place": place.key,
-            "role": cm.role.role,
-            "role-id": cm.role.id,
-            "committee": cm.committee.type.slug
-        }
+        return []
+
+    rows = CommitteeMember.get_roles_of_member(user)
+    groups = PermissionGroup.find_many(row.permission for row in rows if row.permission)
+
+    roles = []
+    for place_key, slug, role_id, role_name, permission in rows:
+        pgroup = groups.get(permission)
+        roles.append({
+            "place": place_key,
+            "role": role_name,
+            "role-id": role_id,
+            "committee": slug,
+            "permission-group": permission,
+            "permissions": [p.name for p in pgroup.permissions] if pgroup else []
+        })
+    return roles
 
 @rbac.permission_provider
 def get_role_permission(role):
@@ -53,9 +65,24 @@ def get_role_permission(role):
     """
     if 'role-id' not in role:
         return []
-    roleobj = CommitteeRole.query.filter_by(id=role['role-id']).first()
-    pgroup = roleobj.get_permission_group()
-    return [{"place": role['place'], "permission": p.name} for p in pgroup.permissions]
+    if 'permissions' in role:
+        names = role['permissions']
+    else:
+        roleobj = CommitteeRole.query.filter_by(id=role['role-id']).first()
+        pgroup = roleobj and roleobj.get_permission_group()
+        names = [p.name for p in pgroup.permissions] if pgroup else []
+    return [{"place": role['place'], "permission": name} for name in names]
+
+@signals.committee_add_member.connect
+@signals.committee_remove_member.connect
+def on_committee_membership_changed(committee, member, role):
+    # the member gets or loses the permissions of the role
+    invalidate_user_permissions(member)
+
+@signals.committee_structure_modified.connect
+def on_committee_structure_modified(committee_type, old):
+    # the permission groups of the roles may have been changed
+    invalidate_user_permissions()
 
 @plugin.route("/<place:place>/committees")
 @require_permission("committees.view")
@@ -80,46 +107,54 @@ def explore_committees(place):
                             committee_types=d)
 
 
-def export_committees_as_dataset(committees, title="Committee Members"):
-    """Exports the given list of committees to a tablib dataset.
+def export_committees(committees):
+    """Exports the given committees as headers and an iterator over rows.
+
+    The committees are processed in batches and the parent names of all
+    the committees in a batch are loaded in a single query.
     """
     place_types = PlaceType.all()
     place_levels = [t.name for t in place_types]
 
-    def get_locations(place):
+    def get_locations(parents, place_id):
         """Returns all locations in the hierarchy to identify this location.
         """
-        d = place.get_parent_names_by_type()
+        d = parents.get(place_id) or {}
         return [d.get(t.short_name, '-') for t in place_types]
 
+    def get_rows():
+        for batch in exporter.batches(committees, 100):
+            parents = Place.bulkload_parent_names([c.place_id for c in batch])
+            for c in batch:
+                row0 = get_locations(parents, c.place_id)
+                for role, members in c.get_members():
+                    for m in members:
+                        yield row0 + [c.type.name, role.role, m.name, m.email, m.phone]
+
     headers = place_levels + ['Committee Name', 'Role', 'Name', 'E-mail', 'Phone']
-    dataset = tablib.Dataset(headers=headers, title=title)
-    for c in committees:
-        row0 = get_locations(c.place)
-        for role, members in c.get_members():
-            for m in members:
-                row = row0 + [c.type.name, role.role, m.name, m.email, m.phone]
-                dataset.append(row)
-    return dataset
-
-
-def export_committees_as_response(committees, title, filename):
-    dataset = export_committees_as_dataset(committees, title=title)
-    response = Response(dataset.xls, content_type='application/vnd.ms-excel; charset=utf-8')
-    response.headers['Content-Disposition'] = "attachment; filename='{0}'".format(filename.encode('utf-8'))
-    return response
+    return headers, get_rows()
+
+
+def export_committees_as_response(committees, title, filename, format):
+    headers, rows = export_committees(committees)
+    return export_response(filename, format, headers, rows, title=title)
 
 
 @plugin.route("/<place:place>/committees/<slug>.xls", methods=["GET"])
+def download_committee_xls(place, slug):
+    # old URL, the downloads are now available only as xlsx and csv
+    return redirect(url_for(".download_committee", place=place, slug=slug, format="xlsx"))
+
+@plugin.route("/<place:place>/committees/<slug>.<any(xlsx, csv):format>", methods=["GET"])
 @require_permission("committees.view-contact-details")
-def download_committee(place, slug):
+def download_committee(place, slug, format):
     committee = place.get_committee(slug)
     if not committee:
         abort(404)
 
     title = committee.type.name
-    filename = u"{}--{}.xls".format(place.key.replace("/", "-"), title.replace(" ", "-"))
-    return export_committees_as_response([committee], title=title, filename=filename)
+    filename = u"{}--{}".format(place.key.replace("/", "-"), title.replace(" ", "-"))
+    return export_committees_as_response([committee], title=title, filename=filename, format=format)
 
 @plugin.route("/<place:place>/committees/<slug>", methods=["GET"])
 @require_permission("committees.view")
@@ -157,8 +192,8 @@ def edit_committee(place, slug):
             role = CommitteeRole.query.filter_by(id=role_id).first()
             member = Member.find(id=member_id)
             committee.remove_member(role, member)
-            signals.committee_remove_member.send(committee, member=member, role=role)
             db.session.commit()
+            signals.committee_remove_member.send(committee, member=member, role=role)
             flash("{} has been removed as {}".format(member.name, role.role))
 
     return render_template("edit_committee.html", place=place, committee=committee)
@@ -223,18 +258,28 @@ def edit_committee_structure(slug):
 def download_members_of_committee_type(slug):
     place = Place.get_toplevel_place()
     committee_type = CommitteeType.find(place, slug)
+    format = request.args.get("format", "xlsx")
+    if not committee_type or format not in exporter.FORMATS:
+        abort(404)
+
+    return export_download("committee-members", dict(place_key=place.key, slug=slug), format,
+        filename="{}-{}-all-members".format(place.key, slug),
+        title="Committee Members",
+        place=place,
+        permission="admin.committee-structures.download-members")
 
-    # using export_committees_as_dataset for exporting the data
+@exportjobs.register("committee-members")
+def export_members_of_committee_type(place_key, slug):
+    place = Place.find(place_key)
+    committee_type = CommitteeType.find(place, slug)
+
+    # using export_committees for exporting the data
     # instead of using CommitteeType.get_all_members() as the earlier one
     # already takes care of listing all place levels.
     # The latter one is more effient.
     # TODO: switch the implemenatation to use CommitteeType.get_all_members()
-    dataset = export_committees_as_dataset(committee_type.committees.all())
-    filename = "{}-{}-all-members.xls".format(place.key, slug)
-
-    response = Response(dataset.xls, content_type='application/vnd.ms-excel;charset=utf-8')
-    response.headers['Content-Disposition'] = "attachment; filename='{0}'".format(filename)
-    return response
+    committees = stream(committee_type.committees, batch_size=100)
+    return export_committees(committees)
 
 
 @plugin.route("/admin/committee-structures/export", methods=['GET'])
@@ -1,5 +1,5 @@
 import datetime
-from cleansweep.models import db, Door2DoorEntry, place_parents
+from cleansweep.models import db, Door2DoorEntry, PlaceCounters, place_parents, count_by_parent
 from cleansweep.stats import Stats, register_stats
 from flask import request
 
@@ -9,9 +9,14 @@ class Door2DoorStats(Stats):
     TYPE = "timeseries"
     TITLE = "Door2Door"
     MESSAGE = "#door2door entries over time"
+    ROLLUP_METRIC = "door2door"
     cummulative = True
 
     def get_timeseries_data(self, place):
+        # The rollups are not available per campaign
+        if 'campaign_id' not in request.args:
+            return Stats.get_timeseries_data(self, place)
+
         # Anand: Querying only for 90-day window to make the query faster.
         # For some reason, pg planner seems to be using the index only when
         # queried with date bounds. Otherwise it is doing seqscan.
@@ -25,28 +30,31 @@ class Door2DoorStats(Stats):
                 place_parents.c.parent_id==place.id,
                 place_parents.c.child_id==Door2DoorEntry.place_id,
                 Door2DoorEntry.created_date > begin_date,
-                Door2DoorEntry.created_date <= end_date
+                Door2DoorEntry.created_date <= end_date,
+                Door2DoorEntry.campaign_filter(request.args['campaign_id'])
             ).group_by(Door2DoorEntry.created_date)
-
-
-        if 'campaign_id' in request.args:
-            q = q.filter(Door2DoorEntry.details['campaign_id'].astext == request.args['campaign_id'])
         return [row._asdict() for row in q.all()]
 
     def get_total(self, place):
-        print "get_total", place.id
+        if 'campaign_id' not in request.args:
+            return place.counters.door2door
+
         q = db.session.query(
                 db.func.count(Door2DoorEntry.id).label("count")
             ).filter(
                 place_parents.c.parent_id==place.id,
-                place_parents.c.child_id==Door2DoorEntry.place_id
+                place_parents.c.child_id==Door2DoorEntry.place_id,
+                Door2DoorEntry.campaign_filter(request.args['campaign_id'])
             )
+        return q.first()[0]
 
+    def get_totals(self, place, children):
         if 'campaign_id' in request.args:
-            q = q.filter(Door2DoorEntry.details['campaign_id'].astext == request.args['campaign_id'])
+            return count_by_parent(Door2DoorEntry.place_id, [p.id for p in children],
+                                   Door2DoorEntry.campaign_filter(request.args['campaign_id']))
 
-        #return db.engine.execute(q).fetchone()[0]
-        return q.first()[0]
+        counters = PlaceCounters.get_many(children)
+        return dict((id, c.door2door) for id, c in counters.items())
 
     def get_stats(self, place):
         pass
@@ -1,15 +1,25 @@
 from cleansweep import forms
-from cleansweep.models import db, Place, Door2DoorEntry, PlaceType
+from cleansweep.models import db, Place, Door2DoorEntry, PlaceType, PlaceCounters, DailyRollup
 from cleansweep.plugin import Plugin
 from cleansweep.view_helpers import require_permission
 import cleansweep.helpers as h
 from flask import render_template, request, redirect, url_for, jsonify, abort, flash
 from . import signals, notifications, stats
-from flask.ext.paginate import Pagination
 
 plugin = Plugin("door2door", __name__, template_folder="templates")
 
 
+def update_counters(entries, delta=1):
+    """Updates the counters and rollups after adding or deleting entries.
+
+    This must be called before committing the change, so that the
+    counters are committed along with it.
+    """
+    # created_date of the new entries is set on insert
+    db.session.flush()
+    PlaceCounters.increment_many("door2door", entries, delta)
+    DailyRollup.increment_many("door2door", [(e.place_id, e.created_date) for e in entries], delta)
+
 plugin.define_permission(
     name='door2door.view',
     description='Permission to view door to door entries'
@@ -52,13 +62,8 @@ def door2door_entry_redirect():
 @plugin.route("/<place:place>/door2door", methods=['GET'])
 @require_permission("door2door.view")
 def door2door(place):
-    page = h.safeint(request.args.get('page', 1), default=1, minvalue=1)
-    total = place.get_door2door_count()
-    limit = 50
-    pagination = Pagination(total=total, page=page, per_page=limit, bs_version=3, prev_label="&laquo; Prev",
-                            next_label="Next &raquo;")
-    entries = place.get_door2door_entries(limit=limit, offset=(page - 1) * limit)
-    return render_template("door2door.html", place=place, entries=entries, pagination=pagination)
+    entries = place.get_door2door_entries(limit=50, after=request.args.get('after'))
+    return render_template("door2door.html", place=place, entries=entries)
 
 
 @plugin.route("/<place:place>/door2door/add", methods=['GET', 'POST'])
@@ -73,6 +78,7 @@ def make_entry(place):
             phone=form.phone.data,
             town=form.town.data,
         )
+        update_counters([entry])
         db.session.commit()
         signals.door2door_import.send([entry])
         return redirect(url_for(".door2door", place=place))
@@ -85,6 +91,7 @@ def delete_entry(place, id, hash):
     entry = Door2DoorEntry.find(id=id)
     if not entry and entry.get_hash() != hash:
         abort(404)
+    update_counters([entry], -1)
     db.session.delete(entry)
     db.session.commit()
     signals.door2door_delete.send(entry, place=place)
@@ -92,12 +99,12 @@ def delete_entry(place, id, hash):
     return redirect(url_for(".door2door", place=place))
 
 
-@plugin.route("/<place:place>/door2door/<page>/entry/<id>-<hash>")
-def details(place, page, id, hash):
+@plugin.route("/<place:place>/door2door/entry/<id>-<hash>")
+def details(place, id, hash):
     entry = Door2DoorEntry.find(id=id)
     if not entry and entry.get_hash() != hash:
         abort(404)
-    return render_template("details.html", place=place, entry=entry, page=page)
+    return render_template("details.html", place=place, entry=entry, after=request.args.get('after'))
 
 
 
@@ -158,6 +165,7 @@ def bulk_import(place):
         print("adding", row)
         entry = ac.add_door2door_entry(**row)
         entries.append(entry)
+    update_counters(entries)
     db.session.commit()
     signals.door2door_import.send(entries)
 
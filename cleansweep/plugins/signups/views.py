@@ -1,6 +1,7 @@
+import datetime
 from cleansweep.core import voter_lookup
 from ...plugin import Plugin
-from ...models import db, Member, PendingMember, Place
+from ...models import db, Member, PendingMember, Place, PlaceCounters, DailyRollup
 from flask import (flash, request, session, render_template, redirect, url_for)
 from ...core import signals
 from ...view_helpers import require_permission
@@ -12,7 +13,8 @@ plugin = Plugin("signups", __name__, template_folder="templates")
 def init_app(app):
     plugin.init_app(app)
     plugin.add_sidebar_entry("Signups", endpoint="signups", permission="write",
-                             counter_func="get_pending_members_count")
+                             counter_func="get_pending_signups_count")
+
 
 @plugin.route("/account/signup", methods=["GET", "POST"])
 def signup():
@@ -50,6 +52,7 @@ def signup():
         place = Place.find(place_key)
         pending_member = place.add_pending_member(name=form.name.data, email=userdata['email'], phone=form.phone.data,
                                                   voterid=voter_id, details=userdata)
+        PlaceCounters.increment(place.id, pending_signups=1)
         db.session.commit()
         signals.volunteer_signup.send(pending_member)
         return render_template("signup_complete.html", person=pending_member)
@@ -71,12 +74,17 @@ def signups(place, status=None):
         if pmember and (pmember.place == place or pmember.place.has_parent(place)):
             if action == 'approve-member':
                 m = pmember.approve()
+                PlaceCounters.increment(pmember.place_id, pending_signups=-1)
+                PlaceCounters.increment(m.place.id, members=1)
+                # created is set on insert
+                DailyRollup.increment(m.place.id, "members", datetime.date.today())
                 db.session.commit()
                 signals.volunteer_signup_approved.send(pmember, member=m)
                 flash('Successfully approved {} as a volunteer.'.format(pmember.name))
                 return redirect(url_for(".signups", place=place))
             elif action == 'reject-member':
                 pmember.reject()
+                PlaceCounters.increment(pmember.place_id, pending_signups=-1)
                 db.session.commit()
                 signals.volunteer_signup_rejected.send(pmember)
                 flash('Successfully rejected {}.'.format(pmember.name))
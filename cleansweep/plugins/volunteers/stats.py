@@ -1,4 +1,4 @@
-from ...models import db
+from ...models import PlaceCounters
 from ...stats import Stats, register_stats
 
 @register_stats
@@ -7,18 +7,12 @@ class VolunteerStats(Stats):
     TYPE = "timeseries"
     TITLE = "Volunteers"
     MESSAGE = "#volunteers over time"
+    ROLLUP_METRIC = "members"
     cummulative = True
 
-    def get_timeseries_data(self, place):
-        q = (
-            "SELECT created::date as date, count(*) as count" +
-            " FROM member, place_parents p" +
-            " WHERE place_id=p.child_id" +
-            "   AND p.parent_id=%s" +
-            " GROUP BY 1" +
-            " ORDER BY 1 desc")
-        result = db.engine.execute(q, [place.id])
-        return list(result)
-
     def get_total(self, place):
-        return place.get_member_count()
\ No newline at end of file
+        return place.counters.members
+
+    def get_totals(self, place, children):
+        counters = PlaceCounters.get_many(children)
+        return dict((id, c.members) for id, c in counters.items())
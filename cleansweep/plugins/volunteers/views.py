@@ -1,18 +1,30 @@
-from flask.ext.paginate import Pagination
 from ...plugin import Plugin
 from flask import (flash, request, render_template, redirect, url_for, abort, make_response, jsonify)
-from ...models import db, Place, Member, PendingMember
+from ...models import db, Place, Member, PendingMember, PlaceCounters, DailyRollup
 from ... import helpers as h
 from ... import forms
 from ...voterlib import voterdb
 from . import signals, notifications, audits, stats
 from ..audit.models import Audit
-from ...view_helpers import require_permission
-
-import tablib
+from ...view_helpers import require_permission, export_download
+from ...core import exporter, exportjobs, memberindex
 
 plugin = Plugin("volunteers", __name__, template_folder="templates")
 
+def update_counters(volunteer, delta=1):
+    """Updates the counters and rollups after adding or deleting a
+    volunteer.
+
+    This must be called before committing the change, so that the
+    counters are committed along with it.
+    """
+    # created of a new volunteer is set on insert
+    db.session.flush()
+    PlaceCounters.increment(volunteer.place_id, members=delta)
+    # legacy members don't have created and are not in the rollups
+    if volunteer.created:
+        DailyRollup.increment(volunteer.place_id, "members", volunteer.created.date(), delta)
+
 plugin.define_permission(
     name='volunteers.view',
     description='Permission to view volunteers at a place'
@@ -68,18 +80,14 @@ def init_app(app):
 @plugin.route("/<place:place>/volunteers", methods = ['GET', 'POST'])
 @require_permission("volunteers.view")
 def volunteers(place):
-    page = h.safeint(request.args.get('page', 1), default=1, minvalue=1)
-    total_count = place.get_member_count()
     limit = 50
     search_query = request.args.get("q")
     if search_query is None:
-        pagination = Pagination(total=total_count, page=page, per_page=limit,
-                                bs_version=3, prev_label="&laquo; Prev", next_label="Next &raquo;")
-        volunteers_per_page = place.get_all_members(limit=limit, offset=(page - 1) * limit)
+        volunteers_per_page = place.get_all_members(limit=limit, after=request.args.get("after"))
     else:
-        pagination = None  # It will not exceed the per page limit so no point of having pagination
+        # It will not exceed the per page limit so no point of having pagination
         volunteers_per_page = place.search_all_members(search_query, limit)
-    return render_template("volunteers.html", place=place, pagination=pagination, volunteers=volunteers_per_page,
+    return render_template("volunteers.html", place=place, volunteers=volunteers_per_page,
                            search_query=search_query, limit=limit)
 
 
@@ -100,6 +108,7 @@ def add_volunteer(place):
             email=form.email.data or None,
             phone=form.phone.data or None,
             voterid=form.voterid.data or None, details=details)
+        update_counters(volunteer)
         db.session.commit()
         signals.add_new_volunteer.send(volunteer)
         flash(u"Added {} as volunteer to {}.".format(form.name.data, p.name))
@@ -120,6 +129,7 @@ def api_add_volunteer(place):
         email=data['email'],
         phone=data['phone'],
         voterid=data.get('voterid'))
+    update_counters(volunteer)
     db.session.commit()
     signals.add_new_volunteer.send(volunteer)
 
@@ -135,36 +145,54 @@ def api_add_volunteer(place):
 def volunteers_autocomplete(place):
     q = request.args.get('q')
     if q:
-        matches = place.search_members(q)
-        matches = [dict(name=m.name, email=m.email, phone=m.phone, id=m.id) for m in matches]
+        # the index can't answer when redis is down or the prefix is too common
+        matches = memberindex.search(place.id, q)
+        if matches is None:
+            matches = place.search_members(q)
+            matches = [dict(name=m.name, email=m.email, phone=m.phone, id=m.id) for m in matches]
     else:
         matches = []
     return jsonify({"matches": matches})
 
 @plugin.route("/<place:place>/volunteers.xls")
+def download_volunteer_xls(place):
+    # old URL, the downloads are now available only as xlsx and csv
+    return redirect(url_for(".download_volunteer", place=place, format="xlsx"))
+
+@plugin.route("/<place:place>/volunteers.<any(xlsx, csv):format>")
 @require_permission("volunteers.download")
-def download_volunteer(place):
+def download_volunteer(place, format):
+    signals.download_volunteers_list.send(place)
+    return export_download("volunteers", dict(place_key=place.key), format,
+        filename=place.key + "-volunteers",
+        title="Volunteers",
+        place=place,
+        permission="volunteers.download")
+
+@exportjobs.register("volunteers")
+def export_volunteers(place_key):
+    """Returns headers and rows for exporting all the volunteers in the
+    subtree of the given place.
+    """
     def get_location_columns():
         return ['State', 'District', 'Assembly Constituency', 'Ward', 'Booth']
 
-    def get_locations(place):
+    def get_locations(parents, place_id):
         """Returns all locations in the hierarchy to identify this location.
         """
-        d = parents.get(place.id) or {}
+        d = parents.get(place_id) or {}
         return [d.get('STATE', '-'), d.get('DISTRICT', '-'), d.get('AC', '-'), d.get('WARD', '-'), d.get('PB', '-')]
 
-    members = place.get_all_members(limit=10000)
-    parents = Place.bulkload_parent_names([m.place_id for m in members])
+    def get_rows():
+        members = place.get_all_members_iter()
+        for batch in exporter.batches(members, 1000):
+            parents = Place.bulkload_parent_names([m.place_id for m in batch])
+            for m in batch:
+                yield [m.name, m.phone, m.email, m.voterid, m.created] + get_locations(parents, m.place_id)
 
+    place = Place.find(place_key)
     headers = ['Name', "Phone", 'Email', 'Voter ID', 'Date'] + get_location_columns()
-    data = tablib.Dataset(headers=headers, title="Volunteers")
-    for m in members:
-        data.append([m.name, m.phone, m.email, m.voterid, m.created.isoformat()] + get_locations(m.place))
-    response = make_response(data.xls)
-    response.headers['Content-Type'] = 'application/vnd.ms-excel;charset=utf-8'
-    response.headers['Content-Disposition'] = "attachment; filename='{0}-volunteers.xls'".format(place.key)
-    signals.download_volunteers_list.send(place)
-    return response
+    return headers, get_rows()
 
 
 @plugin.route("/people/<id>-<hash>", methods=["GET", "POST"])
@@ -190,6 +218,7 @@ def profile(id, hash):
             Audit.query.filter_by(user_id=m.id).delete()
             if pending_member is not None:
                 db.session.delete(pending_member)
+            update_counters(m, -1)
             db.session.delete(m)
             db.session.commit()
             signals.delete_volunteer.send(m, place=place)
@@ -209,12 +238,9 @@ def edit_profile(id, hash):
     if request.method == "POST":
         action = request.form.get('action')
         if action == 'update':
-            name=request.form.get('name'),
-            email=request.form.get('email'),
-            phone=request.form.get('phone'),
-            m.name = name
-            m.email = email
-            m.phone = phone
+            m.name = request.form.get('name')
+            m.email = request.form.get('email')
+            m.phone = request.form.get('phone')
             db.session.add(m)
             db.session.commit()
             flash(u"Updated {} as volunteer.".format(m.name))
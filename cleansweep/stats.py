@@ -1,12 +1,38 @@
-import time
+"""Stats shown on the stats page of a place.
+
+Each stats is a subclass of Stats registered using register_stats. The
+registry keeps a single instance of every stats class, the instances
+must not keep any per-request state.
+
+The stats page computes all the stats at once using compute_all, which
+runs their queries in parallel on a thread pool so that the page takes
+as long as the slowest stats and not the sum of all of them.
+"""
 import datetime
+import threading
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from flask import copy_current_request_context, has_request_context
 from . import widgets
+from .app import app
+from .core import timeseries
+from .models import DailyRollup, Place
 
 STATS = []
 
+# instances of the registered stats classes by class name
+_registry = OrderedDict()
+
+_pool = None
+_pool_lock = threading.Lock()
+
 class Stats(object):
     cummulative = False
 
+    # Name of the DailyRollup metric of this stats. When specified, the
+    # timeseries data is read from the rollups.
+    ROLLUP_METRIC = None
+
     @property
     def classname(self):
         return self.__class__.__name__
@@ -30,13 +56,35 @@ class Stats(object):
         raise NotImplementedError()
 
     def get_timeseries_data(self, place):
+        if self.ROLLUP_METRIC:
+            return DailyRollup.get_timeseries(place, self.ROLLUP_METRIC)
         raise NotImplementedError()
 
     def get_total(self, place):
         raise NotImplementedError()
 
-    def render(self, place):
-        return widgets.render_widget("Stats", place=place, stats=self)
+    def get_totals(self, place, children):
+        """Returns the totals of the child places of place as a dict by
+        place id.
+
+        Subclasses should override this to compute all the totals in a
+        single query.
+        """
+        return dict((p.id, self.get_total(p)) for p in children)
+
+    def compute(self, place):
+        """Computes the data required to render this stats.
+        """
+        if self.type == "timeseries":
+            return dict(data=self.get_timeseries_data_for_graph(place))
+        else:
+            return dict(total=self.get_total(place))
+
+    def render(self, place, result=None):
+        """Renders the stats widget. The result of compute is used when
+        passed, the data is computed while rendering otherwise.
+        """
+        return widgets.render_widget("Stats", place=place, stats=self, result=result)
 
     def get_timeseries_data_for_graph(self, place):
         return self.prepare_data_for_graph(self.get_timeseries_data(place))
@@ -51,34 +99,48 @@ class Stats(object):
         mindate = min(rows[0]['date'], yday)
         maxdate = max(rows[-1]['date'], today)
 
-        d = dict((row['date'], row['count']) for row in rows)
-        x = []
-        count = 0
-        for date in self.daterange(mindate, maxdate):
-            v = d.get(date, 0)
-            if self.cummulative:
-                count += v
-                value = count
-            else:
-                value = v
-            x.append([time.mktime(date.timetuple()) * 1000, value])
-        return x
+        return timeseries.get_graph_data(rows, mindate, maxdate, cumulative=self.cummulative)
 
     def daterange(self, start, end):
-        date = start
-        while date <= end:
-            yield date
-            date += datetime.timedelta(days=1)        
+        return timeseries.daterange(start, end)
 
 def register_stats(cls=None):
     STATS.append(cls)
+    _registry[cls.__name__] = cls()
     return cls
 
 def get_stats(place):
-    return [s() for s in STATS if s().is_enabled_for(place)]
+    return [s for s in _registry.values() if s.is_enabled_for(place)]
 
 def get_stat(place, name):
-    for cls in STATS:
-        s = cls()
-        if cls.__name__ == name and s.is_enabled_for(place):
-            return s
\ No newline at end of file
+    s = _registry.get(name)
+    if s and s.is_enabled_for(place):
+        return s
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(app.config.get("STATS_THREADS", 4))
+    return _pool
+
+def _compute(stats, place_id):
+    # The place is loaded again as the objects of the request's db session
+    # can not be used from other threads.
+    return stats.compute(Place.query.get(place_id))
+
+def compute_all(place):
+    """Computes all the stats enabled for the place in parallel.
+
+    Returns a list of (stats, result) pairs. Each stats is computed in a
+    copy of the current request context, with its own db session and
+    connection from the pool.
+    """
+    stats_list = get_stats(place)
+    if not has_request_context() or len(stats_list) < 2:
+        return [(s, s.compute(place)) for s in stats_list]
+
+    pool = _get_pool()
+    results = [pool.apply_async(copy_current_request_context(_compute), (s, place.id))
+               for s in stats_list]
+    return [(s, r.get()) for s, r in zip(stats_list, results)]
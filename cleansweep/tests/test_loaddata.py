@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+from .test_models import DBTestCase
+from ..models import db, Place
+from ..loaddata import Loader, BulkLoader
+
+class BulkLoaderTest(DBTestCase):
+    def setUp(self):
+        DBTestCase.setUp(self)
+        self.root = tempfile.mkdtemp()
+        self.write("level.txt", "STATE State\nAC Assembly Constituency\nPB Polling Booth\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        DBTestCase.tearDown(self)
+
+    def write(self, path, text):
+        path = os.path.join(self.root, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(text)
+
+    def get_parent_keys(self, key):
+        return sorted(p.key for p in Place.find(key)._parents)
+
+    def test_load(self):
+        self.write("1-state.txt", "-\tKA\tKarnataka\n")
+        self.write("KA/2-ac.txt", "KA\tKA/AC001\tAC001 - One\nKA\tKA/AC002\tAC002 - Two\n")
+        self.write("KA/3-pb.txt", "KA/AC001\tKA/AC001/PB0001\tPB0001 - Booth\n")
+        BulkLoader(self.root).load()
+
+        self.assertEquals(Place.find("KA/AC002").name, "AC002 - Two")
+        self.assertEquals(Place.find("KA/AC001/PB0001").iparent.key, "KA/AC001")
+        self.assertEquals(self.get_parent_keys("KA/AC001/PB0001"),
+                          ["KA", "KA/AC001", "KA/AC001/PB0001"])
+
+        # reload with a rename and a move
+        self.write("KA/2-ac.txt", "KA\tKA/AC001\tAC001 - First\nKA\tKA/AC002\tAC002 - Two\n")
+        self.write("KA/3-pb.txt", "KA/AC002\tKA/AC001/PB0001\tPB0001 - Booth\n")
+        BulkLoader(self.root).load()
+        db.session.expire_all()
+
+        self.assertEquals(Place.find("KA/AC001").name, "AC001 - First")
+        self.assertEquals(self.get_parent_keys("KA/AC001/PB0001"),
+                          ["KA", "KA/AC001/PB0001", "KA/AC002"])
+        self.assertEquals(Place.query.count(), 4)
+
+    def test_diff(self):
+        self.write("1-state.txt", "-\tKA\tKarnataka\n")
+        self.write("KA/2-ac.txt", "KA\tKA/AC001\tAC001 - One\nKA\tKA/AC002\tAC002 - Two\n")
+        self.write("KA/3-pb.txt", "KA/AC001\tKA/AC001/PB0001\tPB0001 - Booth\n")
+        loader = Loader(self.root, diff=True)
+        loader.load()
+        self.assertEquals(loader.check(), dict(missing=0, extra=0))
+
+        # changes made directly in the database are not seen by the diff
+        Place.find("KA/AC002").name = "changed"
+        db.session.commit()
+
+        self.write("KA/3-pb.txt", "KA/AC002\tKA/AC001/PB0001\tPB0001 - Booth\n")
+        Loader(self.root, diff=True).load()
+        db.session.expire_all()
+
+        self.assertEquals(Place.find("KA/AC002").name, "changed")
+        self.assertEquals(self.get_parent_keys("KA/AC001/PB0001"),
+                          ["KA", "KA/AC001/PB0001", "KA/AC002"])
+        self.assertEquals(loader.check(), dict(missing=0, extra=0))
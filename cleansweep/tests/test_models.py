@@ -1,6 +1,8 @@
+import datetime
 from flask.ext.testing import TestCase
 from ..main import app
-from ..models import db, Place, PlaceType, Member, Document
+from ..models import (db, Place, PlaceType, Member, Document, PlaceCounters, DailyRollup, count_by_parent,
+                      check_place_parents, rebuild_place_parents)
 from ..plugins.committees.models import CommitteeType
 
 class DBTestCase(TestCase):
@@ -115,6 +117,97 @@ class PlaceTest(DBTestCase):
         self.assertEquals(LC24.iparent, KA)
         self.assertEquals(AC158.iparent, LC24)
 
+    def test_parents(self):
+        KA = self.add_place("KA", "Karnataka", self.STATE)
+        LC24 = self.add_place('KA/LC24', 'Bangalore North', self.LC, parent=KA)
+        AC158 = self.add_place('KA/AC158', 'Hebbal', self.AC, parent=LC24)
+        AC159 = self.add_place('KA/AC159', 'Pulakeshinagar', self.AC, parent=KA)
+
+        self.assertEquals(AC158.parents, [KA, LC24])
+        self.assertEquals(AC158.get_parent('LC'), LC24)
+        self.assertEquals(AC158.get_parent(self.STATE), KA)
+        self.assertEquals(AC159.get_parent('LC'), None)
+        self.assertTrue(AC158.has_parent(KA))
+        self.assertTrue(AC158.has_parent(AC158))
+        self.assertFalse(AC158.has_parent(AC159))
+        self.assertEquals(AC158.get_parent_names_by_type(), {
+            "STATE": "Karnataka",
+            "LC": "Bangalore North",
+            "AC": "Hebbal"
+        })
+        self.assertEquals(Place.find('KA/AC158'), AC158)
+        self.assertEquals(Place.find('KA/AC999'), None)
+
+    def test_move_to(self):
+        KA = self.add_place("KA", "Karnataka", self.STATE)
+        LC24 = self.add_place('KA/LC24', 'Bangalore North', self.LC, parent=KA)
+        LC25 = self.add_place('KA/LC25', 'Bangalore Central', self.LC, parent=KA)
+        AC158 = self.add_place('KA/AC158', 'Hebbal', self.AC, parent=LC24)
+        W001 = self.add_place('KA/AC158/W001', 'Ward 1', self.WARD, parent=AC158)
+
+        AC158.move_to(LC25)
+        db.session.commit()
+        db.session.expire_all()
+
+        self.assertEquals(AC158.iparent, LC25)
+        self.assertEquals(sorted(p.key for p in W001._parents),
+                          ['KA', 'KA/AC158', 'KA/AC158/W001', 'KA/LC25'])
+        self.assertEquals(KA.verify_parents(), dict(missing=0, extra=0))
+        self.assertRaises(ValueError, KA.move_to, W001)
+
+    def test_update_parents_of_all_children(self):
+        KA = self.add_place("KA", "Karnataka", self.STATE)
+        LC24 = self.add_place('KA/LC24', 'Bangalore North', self.LC, parent=KA)
+        AC158 = self.add_place('KA/AC158', 'Hebbal', self.AC, parent=LC24)
+        W001 = self.add_place('KA/AC158/W001', 'Ward 1', self.WARD, parent=AC158)
+
+        # the parents of the ward are out of sync, outside and inside LC24
+        for parent in [KA, AC158]:
+            db.session.execute("DELETE FROM place_parents WHERE child_id=:id AND parent_id=:parent_id",
+                               dict(id=W001.id, parent_id=parent.id))
+        db.session.commit()
+        self.assertEquals(KA.verify_parents(), dict(missing=2, extra=0))
+
+        LC24.update_parents_of_all_children()
+        db.session.commit()
+        self.assertEquals(KA.verify_parents(), dict(missing=0, extra=0))
+
+    def test_check_place_parents_with_cycle(self):
+        KA = self.add_place("KA", "Karnataka", self.STATE)
+        LC24 = self.add_place('KA/LC24', 'Bangalore North', self.LC, parent=KA)
+        db.session.execute("UPDATE place SET iparent_id=:a WHERE id=:b", dict(a=LC24.id, b=KA.id))
+        db.session.commit()
+        # KA is now expected as a child of LC24 too
+        self.assertEquals(check_place_parents(), dict(missing=1, extra=0))
+        rebuild_place_parents([KA.id])
+        self.assertEquals(check_place_parents(KA.id), dict(missing=0, extra=0))
+
+    def test_check_hierarchy(self):
+        from ..core.hierarchy import HierarchyChecker
+        KA = self.add_place("KA", "Karnataka", self.STATE)
+        LC24 = self.add_place('KA/LC24', 'Bangalore North', self.LC, parent=KA)
+        AC158 = self.add_place('KA/AC158', 'Hebbal', self.AC, parent=LC24)
+        W001 = self.add_place('KA/AC158/W001', 'Ward 1', self.WARD, parent=AC158)
+
+        # a missing row, a missing self row and an extra row.
+        # duplicate rows are not possible with the primary key.
+        db.session.execute("DELETE FROM place_parents WHERE child_id=:id AND parent_id=:parent_id",
+                           dict(id=W001.id, parent_id=KA.id))
+        db.session.execute("DELETE FROM place_parents WHERE child_id=:id AND parent_id=:id", dict(id=AC158.id))
+        db.session.execute("INSERT INTO place_parents (parent_id, child_id) VALUES (:a, :b)",
+                           dict(a=W001.id, b=LC24.id))
+        db.session.commit()
+
+        checker = HierarchyChecker(batch_size=1)
+        try:
+            counts = checker.check()
+            self.assertEquals(counts, dict(missing=2, self=1, extra=1, duplicate=0, null=0))
+            checker.repair()
+            self.assertEquals(checker.check(), dict(missing=0, self=0, extra=0, duplicate=0, null=0))
+        finally:
+            checker.close()
+        self.assertEquals(KA.verify_parents(), dict(missing=0, extra=0))
+
     def test_search_members(self):
         KA = self.add_place("KA", "Karnataka", self.STATE)
         KA.add_member("Evalu Ator", "eval@ator.com", "0001234500")
@@ -147,6 +240,60 @@ class PlaceTest(DBTestCase):
         result = KA.search_all_members("asdf")
         assert len(result) == 0
 
+    def test_member_index_updates(self):
+        from ..core import memberindex
+        calls = []
+        save, remove = memberindex.save, memberindex.remove
+        memberindex.save = lambda member_id, doc: calls.append(("save", member_id, doc['name']))
+        memberindex.remove = lambda member_id: calls.append(("remove", member_id))
+        try:
+            KA = self.add_place("KA", "Karnataka", self.STATE)
+            db.session.commit()
+            m = KA.add_member("Evalu Ator", "eval@ator.com", "0001234500")
+            db.session.commit()
+            self.assertEquals(calls, [("save", m.id, "Evalu Ator")])
+
+            m.name = "Foo"
+            db.session.commit()
+            self.assertEquals(calls[-1], ("save", m.id, "Foo"))
+
+            # rolled back changes are not indexed
+            m.name = "Bar"
+            db.session.flush()
+            db.session.rollback()
+            self.assertEquals(len(calls), 2)
+
+            id = m.id
+            db.session.delete(m)
+            db.session.commit()
+            self.assertEquals(calls[-1], ("remove", id))
+        finally:
+            memberindex.save, memberindex.remove = save, remove
+
+    def test_search_members_ranking(self):
+        KA = self.add_place("KA", "Karnataka", self.STATE)
+        AC001 = self.add_place('KA/AC001', 'One', self.AC, parent=KA)
+        AC002 = self.add_place('KA/AC002', 'Two', self.AC, parent=KA)
+        m1 = AC001.add_member("Ravi Kumar", "ravi@example.com", "98450-12345")
+        m2 = AC001.add_member("Kumar Ravi", "kumar@example.com", "9845099999")
+        m3 = AC002.add_member("Ravindra", "ravindra@example.com", "9900012345")
+        db.session.commit()
+
+        # restricted to the subtree
+        self.assertEquals([m.id for m in AC002.search_members("ravi")], [m3.id])
+        self.assertEquals(len(AC001.search_members("ravi", limit=1)), 1)
+
+        # names starting with the query come first
+        self.assertEquals([m.id for m in AC001.search_members("ravi")], [m1.id, m2.id])
+
+        # phone numbers are matched as prefix, ignoring the formatting
+        self.assertEquals([m.id for m in KA.search_all_members("98450")], [m1.id, m2.id])
+        self.assertEquals([m.id for m in KA.search_all_members("9845012345")], [m1.id])
+        self.assertEquals(KA.search_all_members("12345"), [])
+
+        # like wildcards are not special
+        self.assertEquals(KA.search_all_members("r%"), [])
+
 
     def test_bulkload_parent_names(self):
         KA = self.add_place("KA", "Karnataka", self.STATE)
@@ -172,6 +319,91 @@ class PlaceTest(DBTestCase):
         }
 
 
+class PlaceCountersTest(DBTestCase):
+    setup_place_types = True
+    setup_places = True
+
+    def test_counters(self):
+        # places without a row have zero counters
+        self.assertEquals(self.KA.counters.members, 0)
+        self.assertEquals(PlaceCounters.query.count(), 0)
+
+        self.W001.add_member("Alice", "alice@example.com", "1234567890")
+        PlaceCounters.increment(self.W001.id, members=1)
+        db.session.commit()
+        self.assertEquals(self.KA.counters.members, 1)
+        self.assertEquals(self.W001.counters.members, 1)
+        self.assertEquals(self.W001.counters.contacts, 0)
+
+        self.AC001.add_member("Bob", "bob@example.com", "1234567891")
+        PlaceCounters.increment(self.AC001.id, members=1, contacts=0)
+        db.session.commit()
+        db.session.expire_all()
+        self.assertEquals(self.KA.counters.members, 2)
+        self.assertEquals(self.AC001.counters.members, 2)
+        self.assertEquals(self.W001.counters.members, 1)
+
+    def test_increment_rollback(self):
+        PlaceCounters.increment(self.W001.id, members=1)
+        db.session.rollback()
+        self.assertEquals(self.KA.counters.members, 0)
+
+    def test_rebuild(self):
+        self.W001.add_member("Alice", "alice@example.com", "1234567890")
+        self.W001.add_contacts([["Bob", "bob@example.com", "1234567891", None]])
+        db.session.commit()
+        PlaceCounters.rebuild()
+        self.assertEquals(PlaceCounters.query.get(self.LC01.id).members, 1)
+        self.assertEquals(PlaceCounters.query.get(self.LC01.id).contacts, 1)
+        self.assertEquals(PlaceCounters.query.get(self.KA.id).door2door, 0)
+
+    def test_get_many(self):
+        AC002 = self.add_place("KA/AC002", "Two", self.AC, parent=self.LC01)
+        PlaceCounters.increment(self.W001.id, members=1)
+        db.session.commit()
+
+        counters = PlaceCounters.get_many([self.KA, self.LC01, AC002])
+        self.assertEquals(sorted((id, c.members) for id, c in counters.items()),
+                          [(self.KA.id, 1), (self.LC01.id, 1), (AC002.id, 0)])
+        # the missing counters are not saved
+        self.assertEquals(PlaceCounters.query.get(AC002.id), None)
+        self.assertEquals(PlaceCounters.get_many([]), {})
+
+    def test_count_by_parent(self):
+        self.W001.add_member("Alice", "alice@example.com", "1234567890")
+        self.AC001.add_member("Bob", "bob@example.com", "1234567891")
+        db.session.commit()
+        self.assertEquals(count_by_parent(Member.place_id, [self.KA.id, self.W001.id, self.LC01.id]),
+                          {self.KA.id: 2, self.W001.id: 1, self.LC01.id: 2})
+        self.assertEquals(count_by_parent(Member.place_id, []), {})
+
+class DailyRollupTest(DBTestCase):
+    setup_place_types = True
+    setup_places = True
+
+    def test_increment(self):
+        d1 = datetime.date(2016, 1, 1)
+        d2 = datetime.date(2016, 1, 2)
+        DailyRollup.increment(self.W001.id, "members", d1)
+        DailyRollup.increment(self.AC001.id, "members", d1)
+        DailyRollup.increment(self.W001.id, "members", d2, 2)
+        db.session.commit()
+
+        self.assertEquals(DailyRollup.get_timeseries(self.KA, "members"), [
+            dict(date=d1, count=2),
+            dict(date=d2, count=2)])
+        self.assertEquals(DailyRollup.get_timeseries(self.W001, "members"), [
+            dict(date=d1, count=1),
+            dict(date=d2, count=2)])
+        self.assertEquals(DailyRollup.get_timeseries(self.KA, "door2door"), [])
+
+    def test_rebuild(self):
+        self.W001.add_member("Alice", "alice@example.com", "1234567890")
+        db.session.commit()
+        DailyRollup.rebuild()
+        self.assertEquals(DailyRollup.get_timeseries(self.LC01, "members"), [
+            dict(date=datetime.date.today(), count=1)])
+
 class MemberTest(DBTestCase):
     setup_place_types = True
 
@@ -195,6 +427,37 @@ class MemberTest(DBTestCase):
         self.assertTrue(m2 is not None)
         self.assertEquals(m, m2)
 
+    def test_get_all_members(self):
+        members = [self.add_member(name="m%d" % i, email="m%d@example.com" % i) for i in range(5)]
+
+        page1 = self.place.get_all_members(limit=2)
+        self.assertEquals(list(page1), members[:2])
+        self.assertTrue(page1.next is not None)
+
+        page2 = self.place.get_all_members(limit=2, after=page1.next)
+        self.assertEquals(list(page2), members[2:4])
+
+        page3 = self.place.get_all_members(limit=2, after=page2.next)
+        self.assertEquals(list(page3), members[4:])
+        self.assertEquals(page3.next, None)
+
+        self.assertEquals(list(self.place.get_all_members_iter()), members)
+        self.assertEquals(list(self.place.get_all_members_iter(batch_size=2)), members)
+
+    def test_access_token(self):
+        m = self.add_member(name="Alice", email="alice@example.com")
+        m.generate_access_token()
+        db.session.commit()
+
+        token = m.details['access_token']
+        self.assertTrue(m.has_access_token(token))
+        self.assertEquals(Member.find_by_access_token(token), m)
+        self.assertEquals(Member.find_by_access_token("bad-token"), None)
+
+        m.delete_access_token()
+        db.session.commit()
+        self.assertEquals(Member.find_by_access_token(token), None)
+
     def test_find_case_sensitive(self):
         m = self.add_member(name="Alice", email="alice@example.com")
         m2 = Member.find(email='Alice@example.com')
@@ -346,6 +609,18 @@ class DocumentTest(DBTestCase):
         docs = Document.search(type='b')
         assert [doc.key for doc in docs] == ['b1']
 
+    def test_search_by_text(self):
+        # values stored as numbers or booleans match their text
+        self.new_doc("a1", type="a", n=1, flag=True)
+        self.new_doc("a2", type="a", n="2", flag="false")
+
+        assert [doc.key for doc in Document.search(type='a', n=1)] == ['a1']
+        assert [doc.key for doc in Document.search(type='a', n="1")] == ['a1']
+        assert [doc.key for doc in Document.search(type='a', n=2)] == ['a2']
+        assert [doc.key for doc in Document.search(type='a', flag="true")] == ['a1']
+        assert [doc.key for doc in Document.search(type='a', flag=False)] == ['a2']
+        assert Document.search(type='a', n="x") == []
+
     def test_save(self):
         a1 = self.new_doc("a1", type="a", name='a1')
         a1.update(name="aa11")
@@ -1,9 +1,13 @@
 import functools
+import json
+import tempfile
 
-from flask import (abort, request, render_template, session, g)
+from flask import (abort, request, render_template, session, g, Response, stream_with_context,
+                   redirect, url_for)
 from werkzeug.routing import BaseConverter, ValidationError
+from werkzeug.wsgi import wrap_file
 
-from .core import rbac
+from .core import rbac, exporter, exportjobs
 from .models import Place, Member
 import helpers as h
 
@@ -77,6 +81,73 @@ def require_permission(permission):
     return require_permission_decorator
 
 
+def stream_json(name, rows):
+    """Returns a response with a JSON object having a single list named
+    `name`, encoding the rows one at a time as they are consumed.
+
+    This is used for API responses that can be huge, like all the contacts
+    of a state. The rows are typically coming from a server-side cursor,
+    so the response starts immediately and the memory used doesn't grow
+    with the number of rows.
+
+        return stream_json("contacts", (c.dict() for c in contacts))
+    """
+    def generate():
+        yield '{%s: [' % json.dumps(name)
+        for i, row in enumerate(rows):
+            if i:
+                yield ', '
+            yield json.dumps(row)
+        yield ']}'
+
+    # stream_with_context is required to keep the db session alive
+    # till the cursor is exhausted
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def export_response(filename, format, headers, rows, title=None):
+    """Returns a response to download the rows as a file in the given format.
+
+    The rows are consumed lazily. A CSV export is streamed as it is
+    generated. An XLSX export is written to a temporary file first and
+    then sent from that file.
+    """
+    if format == "csv":
+        body = stream_with_context(exporter.iter_csv(headers, rows))
+        response = Response(body, content_type=exporter.CONTENT_TYPES[format])
+    else:
+        f = tempfile.TemporaryFile()
+        exporter.write(f, format, headers, rows, title=title)
+        f.seek(0)
+        response = Response(wrap_file(request.environ, f),
+                            content_type=exporter.CONTENT_TYPES[format],
+                            direct_passthrough=True)
+
+    if isinstance(filename, unicode):
+        filename = filename.encode('utf-8')
+    response.headers['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(filename, format)
+    return response
+
+
+def export_download(name, params, format, filename, title, place, permission):
+    """Exports the registered export as a file in the background and
+    redirects to the page showing its progress.
+
+    The export is sent directly in the response when background jobs are
+    not available.
+    """
+    if not exportjobs.is_enabled():
+        headers, rows = exportjobs.get_rows(name, params)
+        return export_response(filename, format, headers, rows, title=title)
+
+    status = exportjobs.start(name, params, format,
+        filename=filename,
+        title=title,
+        place=place.key,
+        permission=permission)
+    return redirect(url_for("export_status", place=place, id=status['id']))
+
+
 class PlaceConverter(BaseConverter):
     """Converter for place.
 
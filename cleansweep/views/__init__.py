@@ -2,4 +2,4 @@
 from ..plugin import Plugin
 
 # Importing all the view modules so that all the views in them get registered
-from . import place, account, admin, api, unsubscribe
+from . import place, account, admin, api, unsubscribe, exports
@@ -218,6 +218,7 @@ def get_api_user():
     if not request.path.startswith("/api/"):
         return None
     auth = request.authorization
-    user = auth and Member.find(email=auth.username)
-    if user and user.has_access_token(token=auth.password):
+    # find by the access token as that is indexed
+    user = auth and Member.find_by_access_token(auth.password)
+    if user and user.email and user.email.lower() == auth.username.lower():
         return user
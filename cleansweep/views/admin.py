@@ -2,19 +2,19 @@
 """
 from flask import (render_template, abort, url_for, redirect, request,
                     make_response, session, flash)
-from ..models import Member, db, Place
+from ..models import Member, db, Place, PlaceCounters, DailyRollup
 from .. import forms
 from ..app import app
 from ..voterlib import voterdb
-from ..view_helpers import require_permission
+from ..view_helpers import require_permission, export_download
 from ..helpers import get_current_user
-from ..core import mailer, smslib
+from ..core import mailer, smslib, exportjobs
 from ..core.permissions import get_all_permissions, PermissionGroup
 from ..core.divisions import Division
 from ..plugins.audit import record_audit
+import datetime
 import json
 from collections import defaultdict
-import tablib
 
 
 @app.route("/admin")
@@ -42,7 +42,7 @@ def admin_view_permission_group(key):
 @app.route("/admin/permission-groups/<key>/edit", methods=["GET", "POST"])
 @require_permission("siteadmin")
 def admin_edit_permission_group(key):
-    group = PermissionGroup.find(key)
+    group = PermissionGroup.load(key)
     all_permissions = get_all_permissions()
     if not group:
         abort(404)
@@ -106,7 +106,7 @@ def admin_new_division():
 @app.route("/admin/divisions/<key>", methods=["GET", "POST"])
 @require_permission("siteadmin")
 def admin_edit_division(key):
-    division = Division.find(key=key)
+    division = Division.load(key=key)
     if not division:
         abort(404)
 
@@ -198,20 +198,26 @@ def admin_contacts(place):
     return render_template("admin/contacts.html", place=place)
 
 @app.route("/<place:place>/admin/contacts.xls")
+def admin_contacts_download_xls(place):
+    # old URL, the downloads are now available only as xlsx and csv
+    return redirect(url_for("admin_contacts_download", place=place, format="xlsx"))
+
+@app.route("/<place:place>/admin/contacts.<any(xlsx, csv):format>")
 @require_permission("write")
-def admin_contacts_download(place):
+def admin_contacts_download(place, format):
+    return export_download("contacts", dict(place_key=place.key), format,
+        filename=place.key + "-contacts",
+        title="Contacts",
+        place=place,
+        permission="write")
+
+@exportjobs.register("contacts")
+def export_contacts(place_key):
+    place = Place.find(place_key)
     contacts = place.get_contacts_iter()
-
     headers = ['Place', 'Name', 'Phone', 'E-mail', 'Voter ID']
-    data = tablib.Dataset(headers=headers, title="Contacts")
-
-    for c in contacts:
-        data.append([c.place.key, c.name, c.phone, c.email, c.voterid])
-
-    response = make_response(data.xls)
-    response.headers['Content-Type'] = 'application/vnd.ms-excel;charset=utf-8'
-    response.headers['Content-Disposition'] = "attachment; filename='{0}-contacts.xls'".format(place.key)
-    return response
+    rows = ([c.place.key, c.name, c.phone, c.email, c.voterid] for c in contacts)
+    return headers, rows
 
 @app.route("/<place:place>/admin/contacts/add", methods=['GET', 'POST'])
 @require_permission("write")
@@ -246,6 +252,10 @@ def _add_volunteers(place, data):
             phone=phone or None,
             voterid=voterid or None)
         volunteers.append(v)
+    PlaceCounters.increment_many("members", volunteers)
+    # created is set only on insert, they are all created today
+    today = datetime.date.today()
+    DailyRollup.increment_many("members", [(v.place.id, today) for v in volunteers])
     db.session.commit()
     return volunteers
 
@@ -279,5 +289,6 @@ def _load_contacts(place, data):
     contacts = []
     for p, prows in placesdict.items():
         contacts += p.add_contacts(prows)
+    PlaceCounters.increment_many("contacts", contacts)
     db.session.commit()
     return contacts
@@ -3,8 +3,8 @@ import json
 import requests
 from .. import helpers as h
 from ..app import app
-from ..models import Place, Member, db
-from ..view_helpers import require_permission
+from ..models import Place, Member, PlaceCounters, db
+from ..view_helpers import require_permission, stream_json
 from ..core import rbac, smslib
 from ..plugins.audit import record_audit
 from admin import get_sms_config
@@ -64,11 +64,14 @@ def api_place(place):
 @require_permission("write")
 def api_contacts(place):
     if request.method == "GET":
+        if 'limit' in request.args:
+            # paginated using the cursor returned as next in the previous response
+            limit = h.safeint(request.args['limit'], default=100, minvalue=1, maxvalue=1000)
+            contacts = place.get_contacts(limit=limit, after=request.args.get('after'))
+            return jsonify({"contacts": [c.dict() for c in contacts], "next": contacts.next})
+
         contacts = place.get_contacts_iter()
-        data = []
-        for c in contacts:
-            data.append(c.dict())
-        return jsonify({"contacts": data})
+        return stream_json("contacts", (c.dict() for c in contacts))
     else:
         from .admin import _load_contacts
         def prepare_row(row):
@@ -94,11 +97,18 @@ def api_contact(place, contact_id):
         contact.email = data.get("email", "")
         contact.phone = data.get("phone", "")
         contact.voterid = data.get("voterid", "")
-        contact.place = Place.find(key=data.get("place", place.key))
+        new_place = Place.find(key=data.get("place", place.key))
+        if not new_place:
+            abort(400)
+        if new_place.id != contact.place_id:
+            PlaceCounters.increment(contact.place_id, contacts=-1)
+            PlaceCounters.increment(new_place.id, contacts=1)
+        contact.place = new_place
         db.session.add(contact)
         db.session.commit()
         return jsonify(contact.dict())
     elif request.method == "DELETE":
+        PlaceCounters.increment(contact.place_id, contacts=-1)
         db.session.delete(contact)
         db.session.commit()
         return jsonify("")
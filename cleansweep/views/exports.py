@@ -0,0 +1,40 @@
+"""Views to track the exports running in background and to download
+the exported files.
+"""
+import os
+from flask import (render_template, abort, send_file)
+from ..app import app
+from ..view_helpers import require_permission
+from ..core import exportjobs, exporter
+from .. import helpers as h
+
+def get_export_status(place, id):
+    status = exportjobs.get_status(id)
+    if not status or status['place'] != place.key:
+        abort(404)
+    return status
+
+@app.route("/<place:place>/exports/<id>")
+@require_permission(None)
+def export_status(place, id):
+    status = get_export_status(place, id)
+    if not h.has_permission(status['permission']):
+        return render_template("permission_denied.html")
+    return render_template("export.html", place=place, status=status)
+
+@app.route("/<place:place>/exports/<id>/download")
+@require_permission(None)
+def export_file(place, id):
+    status = get_export_status(place, id)
+    if not h.has_permission(status['permission']):
+        return render_template("permission_denied.html")
+
+    path = exportjobs.get_path(status)
+    if status['state'] != 'finished' or not os.path.exists(path):
+        abort(404)
+
+    filename = u"{0}.{1}".format(status['filename'], status['format'])
+    return send_file(path,
+        mimetype=exporter.CONTENT_TYPES[status['format']],
+        as_attachment=True,
+        attachment_filename=filename.encode('utf-8'))
@@ -1,3 +1,4 @@
+import sys
 from flask.ext.script import Manager, Command
 from flask.ext.script.commands import ShowUrls
 from flask.ext.migrate import Migrate, MigrateCommand
@@ -52,19 +53,23 @@ def initdb():
 
 
 @manager.command
-def load(directory):
-    "Loads data from the specified directory."
+def load(directory, bulk=False, diff=False, jobs=1):
+    """Loads data from the specified directory.
 
+    With --jobs N, the sub directories (states) are loaded in parallel
+    using N processes. With --diff, only the rows changed since the last
+    load are loaded.
+    """
     from cleansweep.loaddata import main
-    main(directory)
+    main(directory, bulk=bulk, diff=diff, jobs=int(jobs))
 
 
 @manager.command
-def load_file(filename):
+def load_file(filename, bulk=False, diff=False):
     "Loads data from the specified file."
 
     from cleansweep.loaddata import main_loadfiles
-    main_loadfiles([filename])
+    main_loadfiles([filename], bulk=bulk, diff=diff)
 
 @manager.command
 def load_levels(filename):
@@ -82,6 +87,64 @@ def add_member(place, name, email, phone):
     add_member(place, name, email, phone)
 
 
+@manager.command
+def rebuild_counters():
+    "Recomputes the counters of members, contacts etc. of all places."
+
+    from cleansweep.models import PlaceCounters
+    PlaceCounters.rebuild()
+
+@manager.command
+def rebuild_rollups():
+    "Recomputes the daily rollups used by the stats graphs."
+
+    from cleansweep.models import DailyRollup
+    DailyRollup.rebuild()
+
+@manager.command
+def rebuild_member_index():
+    "Rebuilds the index of members in redis used by the volunteer autocomplete."
+
+    import logging
+    from cleansweep.core import memberindex
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s [%(levelname)s] %(message)s")
+    memberindex.rebuild()
+
+@manager.command
+def check_hierarchy(repair=False, batch_size=10000):
+    """Checks place_parents against the hierarchy of places.
+
+    With --repair, the missing, extra and duplicate rows are fixed in
+    batches of --batch-size rows.
+    """
+    import logging
+    from cleansweep.core.hierarchy import HierarchyChecker
+    logging.basicConfig(level=logging.INFO, format="%(asctime)-15s [%(levelname)s] %(message)s")
+
+    checker = HierarchyChecker(batch_size=int(batch_size))
+    try:
+        counts = checker.check()
+        for name in ["missing", "self", "extra", "duplicate", "null"]:
+            print "{:10s} {}".format(name, counts[name])
+        if checker.has_errors(counts) and repair:
+            checker.repair()
+            print "repaired"
+    finally:
+        checker.close()
+
+    if checker.has_errors(counts) and not repair:
+        # non-zero exit status for cron
+        sys.exit(1)
+
+@manager.command
+def benchmark_queries(place, repeat=5):
+    """Prints the time and plan of the subtree queries of a place.
+
+    Run it before and after a schema change to compare the plans.
+    """
+    from cleansweep.benchmark import main
+    main(place, repeat=int(repeat))
+
 @manager.command
 def run_worker():
     "Runs a worker."
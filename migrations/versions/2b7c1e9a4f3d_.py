@@ -0,0 +1,41 @@
+"""Switch JSON columns to JSONB and index the keys used in queries.
+
+Revision ID: 2b7c1e9a4f3d
+Revises: ca21d44bd9f
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b7c1e9a4f3d'
+down_revision = 'ca21d44bd9f'
+
+from alembic import op
+import sqlalchemy as sa
+
+# (table, column) of all the columns being converted
+COLUMNS = [
+    ('document', 'data'),
+    ('member', 'details'),
+    ('door2door_entry', 'details'),
+    ('audit', 'data'),
+]
+
+def upgrade():
+    for table, column in COLUMNS:
+        op.execute('ALTER TABLE {0} ALTER COLUMN {1} TYPE jsonb USING {1}::jsonb'.format(table, column))
+
+    op.create_index('ix_document_type', 'document', ['type'])
+    op.execute('CREATE INDEX document_data_idx ON document USING gin (data jsonb_path_ops)')
+    op.execute('CREATE INDEX member_details_idx ON member USING gin (details jsonb_path_ops)')
+    op.execute('CREATE INDEX door2door_entry_details_idx ON door2door_entry USING gin (details jsonb_path_ops)')
+
+
+def downgrade():
+    op.drop_index('door2door_entry_details_idx', 'door2door_entry')
+    op.drop_index('member_details_idx', 'member')
+    op.drop_index('document_data_idx', 'document')
+    op.drop_index('ix_document_type', 'document')
+
+    for table, column in COLUMNS:
+        op.execute('ALTER TABLE {0} ALTER COLUMN {1} TYPE json USING {1}::json'.format(table, column))
@@ -0,0 +1,30 @@
+"""Add place_counters table.
+
+Revision ID: 4d8e2a6c1b7f
+Revises: 2b7c1e9a4f3d
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d8e2a6c1b7f'
+down_revision = '2b7c1e9a4f3d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('place_counters',
+        sa.Column('place_id', sa.Integer(), nullable=False),
+        sa.Column('members', sa.Integer(), nullable=False),
+        sa.Column('contacts', sa.Integer(), nullable=False),
+        sa.Column('door2door', sa.Integer(), nullable=False),
+        sa.Column('pending_signups', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['place_id'], ['place.id'], ),
+        sa.PrimaryKeyConstraint('place_id')
+    )
+
+
+def downgrade():
+    op.drop_table('place_counters')
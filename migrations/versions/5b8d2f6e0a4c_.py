@@ -0,0 +1,31 @@
+"""Add trigram indexes for searching members.
+
+Revision ID: 5b8d2f6e0a4c
+Revises: 9c4e1f7a3b2d
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b8d2f6e0a4c'
+down_revision = '9c4e1f7a3b2d'
+
+from alembic import op
+import sqlalchemy as sa
+
+# the expressions must match the ones used in models.search_members_query
+INDEXES = [
+    ('member_name_trgm_idx', 'lower(name)'),
+    ('member_email_trgm_idx', 'lower(email)'),
+    ('member_phone_trgm_idx', "regexp_replace(phone, '[^0-9]', '', 'g')"),
+]
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, expr in INDEXES:
+        op.execute('CREATE INDEX {} ON member USING gin ({} gin_trgm_ops)'.format(name, expr))
+
+
+def downgrade():
+    for name, expr in INDEXES:
+        op.drop_index(name, 'member')
@@ -0,0 +1,29 @@
+"""Add daily_rollup table.
+
+Revision ID: 7a3f5c9e2d1b
+Revises: 4d8e2a6c1b7f
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a3f5c9e2d1b'
+down_revision = '4d8e2a6c1b7f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('daily_rollup',
+        sa.Column('place_id', sa.Integer(), nullable=False),
+        sa.Column('metric', sa.Text(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['place_id'], ['place.id'], ),
+        sa.PrimaryKeyConstraint('place_id', 'metric', 'date')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_rollup')
@@ -0,0 +1,52 @@
+"""Add primary key to place_parents and composite indexes for the subtree queries.
+
+Revision ID: 9c4e1f7a3b2d
+Revises: 7a3f5c9e2d1b
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c4e1f7a3b2d'
+down_revision = '7a3f5c9e2d1b'
+
+from alembic import op
+import sqlalchemy as sa
+
+# (name, table, columns) of the indexes on the tables joined with place_parents
+INDEXES = [
+    ('ix_member_place_id_created', 'member', ['place_id', 'created']),
+    ('ix_door2door_entry_place_id_created', 'door2door_entry', ['place_id', 'created']),
+    ('ix_audit_place_id_timestamp', 'audit', ['place_id', 'timestamp']),
+    ('ix_contact_place_id_id', 'contact', ['place_id', 'id']),
+]
+
+def upgrade():
+    # the primary key can't be added with null or duplicate rows.
+    # python manage.py check-hierarchy --repair fixes any missing rows after this.
+    op.execute('DELETE FROM place_parents WHERE parent_id IS NULL OR child_id IS NULL')
+    op.execute(
+        'DELETE FROM place_parents a USING place_parents b'
+        + ' WHERE a.parent_id=b.parent_id AND a.child_id=b.child_id AND a.ctid > b.ctid')
+
+    op.create_primary_key('place_parents_pkey', 'place_parents', ['parent_id', 'child_id'])
+    op.create_index('ix_place_parents_child_id_parent_id', 'place_parents', ['child_id', 'parent_id'])
+
+    # the single column indexes are not created by the migrations, but
+    # databases created using create_all have them
+    op.execute('DROP INDEX IF EXISTS ix_place_parents_parent_id')
+    op.execute('DROP INDEX IF EXISTS ix_place_parents_child_id')
+
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+    op.execute('ANALYZE place_parents')
+
+
+def downgrade():
+    for name, table, columns in INDEXES:
+        op.drop_index(name, table)
+
+    op.drop_index('ix_place_parents_child_id_parent_id', 'place_parents')
+    op.drop_constraint('place_parents_pkey', 'place_parents', type_='primary')
+    op.alter_column('place_parents', 'parent_id', nullable=True)
+    op.alter_column('place_parents', 'child_id', nullable=True)
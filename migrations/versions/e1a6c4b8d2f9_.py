@@ -0,0 +1,45 @@
+"""Fill place_counters for all places.
+
+The counters used to be computed when they were read for the first time.
+They are now incremented with upserts and a missing row means zero, so
+the rows of all the places with any records must exist.
+
+Revision ID: e1a6c4b8d2f9
+Revises: 5b8d2f6e0a4c
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e1a6c4b8d2f9'
+down_revision = '5b8d2f6e0a4c'
+
+from alembic import op
+import sqlalchemy as sa
+
+# the same counts as models.PlaceCounters.rebuild
+COUNT_QUERY = (
+    "SELECT p.parent_id, count(*) as count"
+    + " FROM {0}, place_parents p"
+    + " WHERE {0}.place_id=p.child_id AND {1}"
+    + " GROUP BY p.parent_id")
+
+def upgrade():
+    op.execute(
+        "INSERT INTO place_counters (place_id, members, contacts, door2door, pending_signups)"
+        + " SELECT place.id,"
+        + "     coalesce(m.count, 0), coalesce(c.count, 0), coalesce(d.count, 0), coalesce(s.count, 0)"
+        + " FROM place"
+        + " LEFT JOIN ({}) m ON m.parent_id=place.id".format(COUNT_QUERY.format("member", "true"))
+        + " LEFT JOIN ({}) c ON c.parent_id=place.id".format(COUNT_QUERY.format("contact", "true"))
+        + " LEFT JOIN ({}) d ON d.parent_id=place.id".format(COUNT_QUERY.format("door2door_entry", "true"))
+        + " LEFT JOIN ({}) s ON s.parent_id=place.id".format(
+            COUNT_QUERY.format("pending_member", "status='pending'"))
+        + " ON CONFLICT (place_id) DO UPDATE SET"
+        + "     members=EXCLUDED.members, contacts=EXCLUDED.contacts,"
+        + "     door2door=EXCLUDED.door2door, pending_signups=EXCLUDED.pending_signups")
+
+
+def downgrade():
+    # the counters are still valid
+    pass